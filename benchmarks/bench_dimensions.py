@@ -0,0 +1,103 @@
+'''Star-schema dimensions: one row per fact row vs hash-keyed surrogate keys.
+
+Builds listings that repeat a pool of outlets (the same restaurant shows up
+on many pages and scrapes with a different rating and vote count), loads
+them both ways and times a typical dashboard join. Run from the
+repository root:
+
+    python -m benchmarks.bench_dimensions --outlets 20000 --listings 300000
+'''
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import numpy as np
+from sqlalchemy import create_engine
+from src.transform.staging import rename_df_cols
+from src.transform.transform import create_dimension_table, create_fact_table, add_coord_source
+from src.load.load import load_dimensions, open_dimension_keys, DIMENSIONS
+from src.utils.db_utils import bulk_load
+from .bench_ingest import make_raw_frame
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "config.json")
+
+JOIN_QUERY = '''
+SELECT l.CITY, f.RATING_TYPE, COUNT(*), AVG(f.RATING), SUM(f.VOTES)
+FROM fact_table f
+JOIN restaurant_dimension_table r ON r.id = f.restaurant_id
+JOIN location_dimension_table l ON l.id = f.location_id
+GROUP BY l.CITY, f.RATING_TYPE
+'''
+
+DIMENSION_QUERY = "SELECT CITY, COUNT(*) FROM location_dimension_table GROUP BY CITY"
+
+
+def make_listings(outlets, listings, rng):
+    pool = rename_df_cols(make_raw_frame(outlets, rng).drop_duplicates("NAME").reset_index(drop=True))
+    pool["Latitude"] = np.round(rng.uniform(8, 32, len(pool)), 6)
+    pool["Longitude"] = np.round(rng.uniform(68, 90, len(pool)), 6)
+    pool = add_coord_source(pool)
+    df = pool.iloc[rng.integers(0, len(pool), listings)].reset_index(drop=True)
+    df["RATING"] = np.round(rng.uniform(1, 5, listings), 1)
+    df["VOTES"] = rng.integers(0, 5000, listings)
+    return df
+
+
+def build(engine, df, config, keyed):
+    for _, table_name, columns_key in DIMENSIONS:
+        create_dimension_table(engine, df, table_name, config["params"][columns_key], config)
+    create_fact_table(engine, df.assign(restaurant_id=0, location_id=0), config)
+    start = time.perf_counter()
+    if keyed:
+        df = load_dimensions(df, engine, open_dimension_keys(engine, config))
+    else:
+        for id_column, table_name, columns_key in DIMENSIONS:
+            df[id_column] = df.index + 1
+            bulk_load(engine, df, table_name, columns=config["params"][columns_key])
+    bulk_load(engine, df, "fact_table", columns=config["params"]["fact_table_1_columns"])
+    return time.perf_counter() - start
+
+
+def query_ms(conn, sql, repeats):
+    conn.execute(sql).fetchall()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        conn.execute(sql).fetchall()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def report(label, path, load_seconds, repeats):
+    conn = sqlite3.connect(path)
+    counts = [conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for _, table, _ in DIMENSIONS]
+    join_ms = query_ms(conn, JOIN_QUERY, repeats)
+    dimension_ms = query_ms(conn, DIMENSION_QUERY, repeats)
+    conn.close()
+    print(f"{label:<7} restaurants {counts[0]:>7}  locations {counts[1]:>7}  db {os.path.getsize(path) / 2**20:5.1f} MiB  "
+          f"load {load_seconds:5.2f} s  join {join_ms:6.1f} ms  dimension query {dimension_ms:6.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--outlets", type=int, default=20000)
+    parser.add_argument("--listings", type=int, default=300000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with open(CONFIG_PATH) as f:
+        config = json.load(f)
+    df = make_listings(args.outlets, args.listings, np.random.default_rng(0))
+    print(f"{len(df)} listings of {df['NAME'].nunique()} outlets")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, keyed in (("before", False), ("after", True)):
+            path = os.path.join(tmp, f"{label}.sqlite")
+            seconds = build(create_engine(f"sqlite:///{path}"), df.copy(), config, keyed)
+            report(label, path, seconds, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+'''Enrichment throughput against the local stub page server.
+
+Compares the previous joblib-per-batch path with the asyncio engine in
+src/extract/enrich.py. Run from the repository root:
+
+    python -m benchmarks.bench_enrich --rows 2000 --latency 0.05
+'''
+import argparse
+import multiprocessing
+import time
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from src.extract.enrich import enrich, extract_lat_long, DEFAULT_ENRICH_PARAMS
+from .stub_server import start_stub_server
+
+
+def make_frame(base_url, rows):
+    return pd.DataFrame({
+        "URL": [f"{base_url}/restaurant/{i}" for i in range(rows)],
+        "Latitude": pd.Series([np.nan] * rows, dtype=object),
+        "Longitude": pd.Series([np.nan] * rows, dtype=object)
+    })
+
+
+def legacy_enrich(df):
+    '''The joblib process pool per 100-row batch that enrich() used to run'''
+    num_cores = multiprocessing.cpu_count()
+    batch_size = 100
+    for start in range(0, len(df), batch_size):
+        batch_df = df.iloc[start:start + batch_size]
+        results = Parallel(n_jobs=num_cores)(
+            delayed(extract_lat_long)(url) for url in batch_df['URL']
+        )
+        df.loc[batch_df.index, ['Latitude', 'Longitude']] = results
+    return df
+
+
+def run(label, func, df):
+    start = time.perf_counter()
+    result = func(df)
+    elapsed = time.perf_counter() - start
+    filled = int(result['Latitude'].notnull().sum())
+    print(f"{label:<28} {len(df):>7} rows  {elapsed:8.2f} s  {len(df) / elapsed:9.1f} rows/s  filled={filled}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="per-request server delay in seconds")
+    parser.add_argument("--filler", type=int, default=400, help="filler blocks per page (page size)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[16, 64, 128])
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(latency=args.latency, filler_blocks=args.filler)
+    try:
+        if not args.skip_legacy:
+            run("joblib per batch (before)", legacy_enrich, make_frame(base_url, args.rows))
+        for concurrency in args.concurrency:
+            params = dict(DEFAULT_ENRICH_PARAMS, concurrency=concurrency, limit_per_host=concurrency)
+            run(f"asyncio concurrency={concurrency}",
+                lambda df: enrich(df, None, params), make_frame(base_url, args.rows))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
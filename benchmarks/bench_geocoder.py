@@ -0,0 +1,86 @@
+'''Network fetches and coordinate error of enrich with and without the locality tier.
+
+Generates listings whose pages the stub server places around their
+CITY/REGION's centre (benchmarks.datagen with locality_urls). It then
+enriches them three ways: with locality_policy off; with "prefer" on an
+empty locality table (a first run, which learns localities from probe
+fetches); and with "prefer" on a second batch of new outlets, once the
+table is warm. For each run it reports pages fetched, wall time, and the
+distance from each filled row to its page's real coordinates. The URL
+cache is off throughout. Run from the repository root:
+
+    python -m benchmarks.bench_geocoder --rows 20000 --latency 0.02
+'''
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from src.extract.enrich import enrich, DEFAULT_ENRICH_PARAMS
+from src.extract.geocoder import LocalityCentroids
+from src.load.spatial import haversine_km
+from .datagen import make_listings, DEFAULT_GENERATOR_PARAMS
+from .stub_server import start_stub_server, coordinates_for
+
+
+def make_batch(rows, outlets, offset, base_url, seed):
+    params = dict(DEFAULT_GENERATOR_PARAMS, url_base=base_url, locality_urls=True, null_rate=0.0)
+    frame = make_listings(rows, np.random.default_rng(seed), outlets, outlets, params)
+    # Shift outlet ids so the second batch has pages the first never fetched
+    frame["URL"] = frame["URL"].str.replace(r"\.(\d+)$", lambda m: f".{int(m.group(1)) + offset}", regex=True)
+    return frame
+
+
+def run(label, df, server, params, centroids=None):
+    requests_before = server.requests
+    start = time.perf_counter()
+    enrich(df, params=params, centroids=centroids)
+    elapsed = time.perf_counter() - start
+    truth = np.array([coordinates_for(url.rsplit("/", 1)[1]) for url in df["URL"]], dtype=float)
+    error = haversine_km(df["Latitude"], df["Longitude"], truth[:, 0], truth[:, 1])
+    print(f"  {label:<30} {server.requests - requests_before:>8} {elapsed:>9.2f} "
+          f"{np.nanmedian(error):>10.3f} {np.nanpercentile(error, 95):>10.3f} {np.nanmax(error):>9.3f} "
+          f"{df['Latitude'].isnull().sum():>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--outlets", type=int, help="distinct outlets per batch (default rows / 3)")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub server delay per request in seconds")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-spread-km", type=float, default=DEFAULT_ENRICH_PARAMS["locality_max_spread_km"])
+    parser.add_argument("--min-samples", type=int, default=DEFAULT_ENRICH_PARAMS["locality_min_samples"])
+    parser.add_argument("--probe-urls", type=int, default=DEFAULT_ENRICH_PARAMS["locality_probe_urls"])
+    args = parser.parse_args()
+    outlets = args.outlets or max(1, args.rows // 3)
+
+    server, base_url = start_stub_server(args.latency, filler_blocks=50)
+
+    params = dict(DEFAULT_ENRICH_PARAMS, concurrency=args.concurrency, limit_per_host=args.concurrency,
+                  locality_max_spread_km=args.max_spread_km, locality_min_samples=args.min_samples,
+                  locality_probe_urls=args.probe_urls)
+    first = make_batch(args.rows, outlets, 0, base_url, 0)
+    second = make_batch(args.rows, outlets, outlets, base_url, 1)
+    print(f"{args.rows} rows per batch, {first['URL'].nunique()} distinct pages, "
+          f"{first[['CITY', 'REGION']].drop_duplicates().shape[0]} localities, latency {args.latency} s")
+    print(f"  {'run':<30} {'fetched':>8} {'wall s':>9} {'median km':>10} {'p95 km':>10} {'max km':>9} {'missing':>8}")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            run("policy off", first.copy(), server, dict(params, locality_policy="off"))
+            centroids = LocalityCentroids(os.path.join(tmp, "locality_centroids.sqlite"))
+            try:
+                run("prefer, empty table", first.copy(), server, dict(params, locality_policy="prefer"), centroids)
+                run("prefer, warm table (new pages)", second.copy(), server, dict(params, locality_policy="prefer"),
+                    centroids)
+                table = centroids.table()
+                print(f"  locality table: {len(table)} localities, median spread {table['spread_km'].median():.2f} km, "
+                      f"{os.path.getsize(centroids.path) / 1024:.0f} KiB")
+            finally:
+                centroids.close()
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
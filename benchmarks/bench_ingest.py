@@ -0,0 +1,100 @@
+'''Raw file ingestion: the old concat-in-a-loop iterate vs the parallel engine.
+
+Builds a raw tree of many small pipe-delimited files plus a few very large
+ones, then times both paths. Run from the repository root:
+
+    python -m benchmarks.bench_ingest --small-files 3000 --large-files 3 --large-rows 300000
+'''
+import argparse
+import logging
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from src.extract.combine import iterate, DEFAULT_RAW_SCHEMA, DEFAULT_INGEST_PARAMS
+
+CITIES = ["Delhi NCR", "Mumbai", "Bangalore", "Kolkata", "Chennai", "Hyderabad", "Pune", "Ahmedabad"]
+CUISINES = ["North Indian", "Chinese", "South Indian", "Fast Food", "Cafe", "Biryani", "Pizza", "Desserts"]
+RATING_TYPES = ["Excellent", "Very Good", "Good", "Average", "Poor"]
+
+
+def make_raw_frame(rows, rng, start=0):
+    ids = np.arange(start, start + rows)
+    frame = pd.DataFrame({
+        "NAME": [f"Restaurant {i}" for i in ids],
+        "PRICE": rng.integers(100, 3000, rows),
+        "CUSINE_CATEGORY": [", ".join(rng.choice(CUISINES, 2, replace=False)) for _ in ids],
+        "CITY": rng.choice(CITIES, rows),
+        "REGION": [f"Sector {r}" for r in rng.integers(1, 80, rows)],
+        "URL": [f"https://www.zomato.com/restaurant/{i}" for i in ids],
+        "PAGE NO": rng.integers(1, 300, rows),
+        "CUSINE TYPE": rng.choice(["Quick Bites", "Casual Dining", "Cafe", "Fine Dining"], rows),
+        "TIMING": "11am to 11pm (Mon-Sun)",
+        "RATING_TYPE": rng.choice(RATING_TYPES, rows),
+        "RATING": np.round(rng.uniform(1, 5, rows), 1),
+        # New listings show "-" instead of a vote count
+        "VOTES": np.where(rng.random(rows) < 0.1, "-", rng.integers(0, 5000, rows).astype(str)),
+        "Latitude": np.nan,
+        "Longitude": np.nan
+    })
+    # Re-scraped listings repeat across files
+    duplicates = frame.sample(frac=0.05, random_state=int(rng.integers(0, 2**31)))
+    return pd.concat([frame, duplicates], ignore_index=True)
+
+
+def write_raw_tree(directory, small_files, small_rows, large_files, large_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    start = 0
+    for i in range(small_files):
+        city_dir = os.path.join(directory, CITIES[i % len(CITIES)])
+        os.makedirs(city_dir, exist_ok=True)
+        make_raw_frame(small_rows, rng, start).to_csv(os.path.join(city_dir, f"page_{i}.csv"), sep="|", index=False)
+        start += small_rows
+    for i in range(large_files):
+        make_raw_frame(large_rows, rng, start).to_csv(os.path.join(directory, f"bulk_{i}.csv"), sep="|", index=False)
+        start += large_rows
+
+
+def legacy_iterate(path):
+    '''The os.walk + pd.concat-per-file loop iterate used before'''
+    combined_df = pd.DataFrame()
+    for root, _, files in os.walk(path):
+        for f in files:
+            if f.endswith(".csv"):
+                df = pd.read_csv(os.path.join(root, f), sep="|", header=0)
+                combined_df = pd.concat([combined_df, df], ignore_index=True)
+    combined_df.drop_duplicates(inplace=True)
+    return combined_df
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed:8.2f} s  {len(result):>9} rows  {len(result) / elapsed:10.0f} rows/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--small-files", type=int, default=3000)
+    parser.add_argument("--small-rows", type=int, default=30)
+    parser.add_argument("--large-files", type=int, default=3)
+    parser.add_argument("--large-rows", type=int, default=300000)
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_raw_tree(tmp, args.small_files, args.small_rows, args.large_files, args.large_rows)
+        print(f"{args.small_files} files x {args.small_rows} rows + {args.large_files} files x {args.large_rows} rows")
+        if not args.skip_legacy:
+            timed("concat per file (before)", lambda: legacy_iterate(tmp))
+        params = dict(DEFAULT_INGEST_PARAMS, n_jobs=args.n_jobs)
+        timed(f"parallel ingest n_jobs={args.n_jobs}", lambda: iterate(tmp, DEFAULT_RAW_SCHEMA, params))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+'''SQLite write throughput: pandas to_sql vs the bulk loader in db_utils.
+
+Times staging (replace the staging table) and the star-schema load (three
+appends) both ways. Run from the repository root:
+
+    python -m benchmarks.bench_load --rows 200000
+'''
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+import numpy as np
+from sqlalchemy import create_engine
+from src.transform.staging import rename_df_cols, staging_table_sql
+from src.transform.transform import add_coord_source
+from src.utils.db_utils import bulk_load, DEFAULT_BULK_PARAMS
+from .bench_ingest import make_raw_frame
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "config.json")
+
+
+def timed(label, rows, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {elapsed:8.2f} s  {rows / elapsed:10.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BULK_PARAMS["batch_size"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with open(CONFIG_PATH) as f:
+        params = json.load(f)["params"]
+    # coord_source is added by enrich in the pipeline
+    df = add_coord_source(rename_df_cols(make_raw_frame(args.rows, np.random.default_rng(0))))
+    df["restaurant_id"] = df.index
+    df["location_id"] = df.index
+    tables = {
+        "restaurant_dimension_table": params["restaurant_dimension_table_columns"],
+        "location_dimension_table": params["location_dimension_table_columns"],
+        "fact_table": params["fact_table_1_columns"],
+    }
+    star_rows = len(df) * len(tables)
+    bulk_params = dict(DEFAULT_BULK_PARAMS, batch_size=args.batch_size)
+    staging_sql = staging_table_sql(df.drop(columns=["restaurant_id", "location_id"]), "staging_db", params["dtype_mapping"])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before = create_engine(f"sqlite:///{tmp}/before.sqlite")
+        after = create_engine(f"sqlite:///{tmp}/after.sqlite")
+        staging = df.drop(columns=["restaurant_id", "location_id"])
+        print(f"{len(df)} rows")
+
+        timed("staging: to_sql replace (before)", len(df),
+              lambda: staging.to_sql("staging_db", before, index=False, if_exists="replace"))
+        timed("staging: bulk_load (after)", len(df),
+              lambda: bulk_load(after, staging, "staging_db", create_sql=staging_sql, replace=True, params=bulk_params))
+
+        timed("star schema: to_sql append (before)", star_rows,
+              lambda: [df[columns].to_sql(table, before, if_exists="append", index=False) for table, columns in tables.items()])
+        timed("star schema: bulk_load (after)", star_rows,
+              lambda: [bulk_load(after, df, table, columns=columns, params=bulk_params) for table, columns in tables.items()])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+'''Coordinate extraction microbenchmark over saved sample pages.
+
+Compares the BeautifulSoup parse extract_lat_long used to do with the
+streaming CoordinateScanner, reporting pages/sec and bytes read per page.
+Run from the repository root:
+
+    python -m benchmarks.bench_parser --pages-dir path/to/saved/pages
+    python -m benchmarks.bench_parser --generate 200
+'''
+import argparse
+import os
+import tempfile
+import time
+from bs4 import BeautifulSoup
+from src.extract.coords import extract_coordinates
+from .stub_server import make_page
+
+
+def legacy_parse(text):
+    '''The BeautifulSoup path extract_lat_long used before the streaming scanner'''
+    soup = BeautifulSoup(text, 'html.parser')
+    script_content = soup.find('script', string=lambda text: text and 'window.__PRELOADED_STATE__' in text)
+    if script_content:
+        latitude_start_index = script_content.string.find(r'"latitude\":\"') + len(r'"latitude\":\"')
+        latitude_end_index = script_content.string.find('",', latitude_start_index)
+        latitude = script_content.string[latitude_start_index:latitude_end_index-1]
+
+        longitude_start_index = script_content.string.find(r'"longitude\":\"') + len(r'"longitude\":\"')
+        longitude_end_index = script_content.string.find('",', longitude_start_index)
+        longitude = script_content.string[longitude_start_index:longitude_end_index-1]
+
+        return latitude, longitude
+    return None, None
+
+
+def save_sample_pages(directory, count, filler_blocks):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(directory, f"restaurant_{i}.html"), "w", encoding="utf-8") as f:
+            f.write(make_page(i, filler_blocks))
+
+
+def load_pages(directory):
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), "rb") as f:
+                pages.append(f.read())
+    return pages
+
+
+def bench_legacy(pages):
+    results = []
+    start = time.perf_counter()
+    for page in pages:
+        # response.text decoded the whole body before parsing
+        results.append(legacy_parse(page.decode("utf-8", errors="replace")))
+    elapsed = time.perf_counter() - start
+    return results, elapsed, sum(len(page) for page in pages)
+
+
+def bench_scanner(pages, chunk_size):
+    results = []
+    bytes_read = 0
+    start = time.perf_counter()
+    for page in pages:
+        coordinates, read = extract_coordinates(page, chunk_size)
+        results.append(coordinates)
+        bytes_read += read
+    elapsed = time.perf_counter() - start
+    return results, elapsed, bytes_read
+
+
+def report(label, pages, elapsed, bytes_read):
+    print(f"{label:<22} {len(pages) / elapsed:10.1f} pages/s  {bytes_read / len(pages) / 1024:9.1f} KiB read/page")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages-dir", help="directory of saved restaurant pages (*.html)")
+    parser.add_argument("--generate", type=int, default=200, help="sample pages to generate when --pages-dir is not given")
+    parser.add_argument("--filler", type=int, default=2000, help="filler blocks per generated page")
+    parser.add_argument("--chunk-size", type=int, default=16384)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pages_dir = args.pages_dir
+        if pages_dir is None:
+            pages_dir = tmp
+            save_sample_pages(pages_dir, args.generate, args.filler)
+        pages = load_pages(pages_dir)
+        if not pages:
+            raise SystemExit(f"No pages found in {pages_dir}")
+
+        legacy_results, legacy_elapsed, legacy_bytes = bench_legacy(pages)
+        scan_results, scan_elapsed, scan_bytes = bench_scanner(pages, args.chunk_size)
+
+    print(f"{len(pages)} pages, {sum(len(p) for p in pages) / len(pages) / 1024:.1f} KiB average")
+    report("BeautifulSoup (before)", pages, legacy_elapsed, legacy_bytes)
+    report("CoordinateScanner", pages, scan_elapsed, scan_bytes)
+    mismatches = sum(1 for a, b in zip(legacy_results, scan_results) if a != b)
+    print(f"speedup {legacy_elapsed / scan_elapsed:.1f}x, mismatched results: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+'''End-to-end benchmark: every main.py stage and the pred_analysis pipeline on generated data.
+
+Generates a raw tree with benchmarks.datagen. Its URLs point at the stub
+page server. The harness then runs main.py (batch or --stream) on a scratch
+copy of the repository, followed by pred_analysis main.py and scoring.py
+on the main_db it built. Stage and hot-function timings come from the
+metrics file main.py writes. The pred_analysis steps are timed as whole
+processes: wall, CPU and peak RSS from wait4. Results are saved as JSON in
+benchmarks/results/ under the commit they ran on, and --compare prints
+them next to an earlier result. Run from the repository root:
+
+    python -m benchmarks.bench_pipeline --rows 100000 --latency 0.02
+    python -m benchmarks.bench_pipeline --rows 100000 --compare benchmarks/results/<earlier>.json
+'''
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+from .datagen import write_raw_tree
+from .stub_server import start_stub_server
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+IGNORED = shutil.ignore_patterns(".git", "__pycache__", "data", "db", "logs", "Main_DB", "results", "Raw_code")
+
+
+def git_commit():
+    '''(short commit hash, whether the work tree has uncommitted changes)'''
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    return git("rev-parse", "--short", "HEAD") or "unknown", bool(git("status", "--porcelain", "--untracked-files=no"))
+
+
+def make_workdir(directory, raw, args):
+    '''Copy the repository to directory and point its configs at raw and the benchmark's settings'''
+    work = os.path.join(directory, "repo")
+    shutil.copytree(REPO_ROOT, work, ignore=IGNORED)
+    os.makedirs(os.path.join(work, "logs"))
+    os.makedirs(os.path.join(work, "db"))
+
+    config_path = os.path.join(work, "config.json")
+    with open(config_path) as f:
+        config = json.load(f)
+    config["file_path"]["raw_data"] = raw
+    with open(config_path, "w") as f:
+        json.dump(config, f, indent=2)
+
+    ml_config_path = os.path.join(work, "src", "pred_analysis", "ML_config.yml")
+    with open(ml_config_path) as f:
+        ml_config = yaml.safe_load(f)
+    ml_config["training"]["time_budget_seconds"] = args.time_budget
+    if args.candidates:
+        ml_config["training"]["candidates"] = args.candidates
+    with open(ml_config_path, "w") as f:
+        yaml.safe_dump(ml_config, f, sort_keys=False)
+    return work
+
+
+def run_process(name, command, cwd, log_dir):
+    '''Run command to completion; returns its record with wall, CPU and peak RSS of the process'''
+    log_path = os.path.join(log_dir, f"{name}.out")
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    record = {
+        "kind": "process", "name": name, "wall_seconds": round(time.perf_counter() - start, 4),
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 4),
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        "peak_rss_bytes": usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+        "exit_code": process.returncode,
+    }
+    if process.returncode:
+        print(f"{name} failed with exit code {process.returncode}; see {log_path}")
+    return record
+
+
+def stage_records(work):
+    '''Stage and function records of the runs in the scratch copy's metrics file, tagged by run'''
+    path = os.path.join(work, "logs", "etl_metrics.jsonl")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    runs = list(dict.fromkeys(record["run_id"] for record in records))
+    for record in records:
+        record["run"] = runs.index(record["run_id"]) + 1
+    return records
+
+
+def label(record):
+    name = record["name"] if record["kind"] != "function" else f"  {record['name']} ({record['stage']})"
+    return f"run {record['run']}: {name}" if record.get("run") else name
+
+
+def report(result, previous=None):
+    print(f"commit {result['commit']}{' (dirty)' if result['dirty'] else ''}, {result['rows_written']} raw rows")
+    earlier = {label(record): record for record in previous["records"]} if previous else {}
+    header = f"{'step':<44} {'wall s':>9} {'cpu s':>9} {'peak MiB':>9} {'rows out':>10}"
+    print(header + (f" {'before s':>9} {'ratio':>7}" if previous else ""))
+    for record in result["records"]:
+        peak = record.get("peak_rss_bytes")
+        line = (f"{label(record):<44} {record['wall_seconds']:>9.2f} {record['cpu_seconds']:>9.2f} "
+                f"{peak / 2**20 if peak else float('nan'):>9.0f} {str(record.get('rows_out', '')):>10}")
+        match = earlier.get(label(record))
+        if match:
+            line += f" {match['wall_seconds']:>9.2f} {record['wall_seconds'] / max(match['wall_seconds'], 1e-9):>6.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--rows-per-file", type=int, default=50000)
+    parser.add_argument("--distinct-urls", type=int, help="distinct pages to enrich (default one per outlet)")
+    parser.add_argument("--null-rate", type=float, default=0.02)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--locality-urls", action="store_true",
+                        help="pages clustered by CITY/REGION, so enrich can fill localities offline")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub server base delay per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="stub server mean extra delay in seconds")
+    parser.add_argument("--filler", type=int, default=400, help="filler blocks per stub page")
+    parser.add_argument("--stream", action="store_true", help="run main.py --stream")
+    parser.add_argument("--chunk-size", type=int)
+    parser.add_argument("--rerun", action="store_true", help="run main.py again on the same files (no new rows)")
+    parser.add_argument("--skip-ml", action="store_true", help="skip the pred_analysis pipeline")
+    parser.add_argument("--time-budget", type=int, default=30, help="hyperparameter search budget in seconds")
+    parser.add_argument("--candidates", nargs="+", help="models to train (default from ML_config)")
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    server, base_url = start_stub_server(args.latency, args.filler, jitter=args.jitter)
+    scratch = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        raw = os.path.join(scratch, "raw")
+        start = time.perf_counter()
+        files, rows_written = write_raw_tree(
+            raw, args.rows, rows_per_file=args.rows_per_file, distinct_urls=args.distinct_urls,
+            null_rate=args.null_rate, duplicate_rate=args.duplicate_rate, locality_urls=args.locality_urls,
+            url_base=base_url
+        )
+        print(f"Generated {rows_written} rows in {files} files in {time.perf_counter() - start:.1f} s")
+        work = make_workdir(scratch, raw, args)
+        log_dir = os.path.join(work, "logs")
+
+        command = [sys.executable, "main.py"] + (["--stream"] if args.stream else [])
+        if args.stream and args.chunk_size:
+            command += ["--chunk-size", str(args.chunk_size)]
+        processes = [run_process("main.py", command, work, log_dir)]
+        if args.rerun:
+            processes.append(run_process("main.py rerun", command, work, log_dir))
+
+        main_db = os.path.join(work, "db", "main_db.sqlite")
+        if not args.skip_ml and os.path.exists(main_db):
+            ml_dir = os.path.join(work, "src", "pred_analysis")
+            # pred_analysis reads its database from ../Main_DB
+            os.makedirs(os.path.join(work, "src", "Main_DB"))
+            shutil.copyfile(main_db, os.path.join(work, "src", "Main_DB", "zomato_DB.sqlite"))
+            processes.append(run_process("pred_analysis main.py", [sys.executable, "main.py"], ml_dir, log_dir))
+            processes.append(run_process("pred_analysis scoring.py", [sys.executable, "scoring.py"], ml_dir, log_dir))
+
+        result = {
+            "commit": commit, "dirty": dirty, "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "args": vars(args), "python": sys.version.split()[0], "cpus": os.cpu_count(),
+            "files": files, "rows_written": rows_written,
+            "records": stage_records(work) + processes,
+        }
+    finally:
+        server.shutdown()
+        if args.keep:
+            print(f"Scratch directory kept at {scratch}")
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    result_path = os.path.join(args.results_dir, f"{result['created_at'].replace(':', '')}-{commit}.json")
+    with open(result_path, "w") as f:
+        json.dump(result, f, indent=2)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    report(result, previous)
+    print(f"Results saved to {result_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+'''Dashboard query latency on main_db without and with the configured indexes.
+
+Loads a synthetic star schema through load_star_schema() with indexing
+disabled, times representative dashboard queries and prints their
+EXPLAIN QUERY PLAN, then creates params.indexes, runs ANALYZE and repeats.
+Run from the repository root:
+
+    python -m benchmarks.bench_queries --outlets 50000 --listings 300000
+'''
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import numpy as np
+from sqlalchemy import create_engine
+from src.transform.transform import create_dimension_table, create_fact_table
+from src.load.load import load_star_schema, DIMENSIONS
+from src.utils.db_utils import create_indexes
+from .bench_dimensions import make_listings
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "config.json")
+
+QUERIES = {
+    "top-rated per city": '''
+        SELECT CITY, NAME, RATING FROM (
+            SELECT l.CITY, r.NAME, f.RATING,
+                   ROW_NUMBER() OVER (PARTITION BY l.CITY ORDER BY f.RATING DESC) AS rank
+            FROM fact_table f
+            JOIN restaurant_dimension_table r ON r.id = f.restaurant_id
+            JOIN location_dimension_table l ON l.id = f.location_id
+            WHERE f.RATING >= 4.5
+        ) WHERE rank <= 10''',
+    "price vs rating by cuisine": '''
+        SELECT r.CUSINE_CATEGORY, COUNT(*), AVG(f.PRICE), AVG(f.RATING)
+        FROM fact_table f
+        JOIN restaurant_dimension_table r ON r.id = f.restaurant_id
+        GROUP BY r.CUSINE_CATEGORY''',
+    "one city drill-down": '''
+        SELECT f.RATING_TYPE, COUNT(*), AVG(f.RATING), SUM(f.VOTES)
+        FROM location_dimension_table l
+        JOIN fact_table f ON f.location_id = l.id
+        JOIN restaurant_dimension_table r ON r.id = f.restaurant_id
+        WHERE l.CITY = 'Pune'
+        GROUP BY f.RATING_TYPE''',
+    "one cuisine's restaurants": '''
+        SELECT r.NAME, f.RATING, f.PRICE
+        FROM restaurant_dimension_table r
+        JOIN fact_table f ON f.restaurant_id = r.id
+        WHERE r.CUSINE_CATEGORY = 'Cafe, Pizza'
+        ORDER BY f.RATING DESC''',
+}
+
+
+def run_queries(path, repeats, show_plans):
+    conn = sqlite3.connect(path)
+    for label, sql in QUERIES.items():
+        conn.execute(sql).fetchall()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            conn.execute(sql).fetchall()
+        elapsed_ms = (time.perf_counter() - start) / repeats * 1000
+        print(f"  {label:<28} {elapsed_ms:9.2f} ms")
+        if show_plans:
+            for row in conn.execute("EXPLAIN QUERY PLAN " + sql):
+                print(f"      {row[-1]}")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--outlets", type=int, default=50000)
+    parser.add_argument("--listings", type=int, default=300000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-plans", action="store_true", help="only print latencies")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with open(CONFIG_PATH) as f:
+        config = json.load(f)
+    indexes = config["params"].get("indexes", {})
+    config["params"]["indexes"] = {}
+    df = make_listings(args.outlets, args.listings, np.random.default_rng(0))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "main_db.sqlite")
+        engine = create_engine(f"sqlite:///{path}")
+        for _, table_name, columns_key in DIMENSIONS:
+            create_dimension_table(engine, df, table_name, config["params"][columns_key], config)
+        create_fact_table(engine, df.assign(restaurant_id=0, location_id=0), config)
+        load_star_schema([df], engine, config)
+
+        print("without indexes")
+        run_queries(path, args.repeats, not args.no_plans)
+        start = time.perf_counter()
+        create_indexes(engine, indexes)
+        print(f"with params.indexes and ANALYZE (built in {time.perf_counter() - start:.2f} s)")
+        run_queries(path, args.repeats, not args.no_plans)
+
+
+if __name__ == "__main__":
+    main()
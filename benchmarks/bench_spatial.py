@@ -0,0 +1,129 @@
+'''Spatial queries on locations: brute-force haversine against the KD-tree and geohash index.
+
+Generates clustered locations (a few thousand per city, spread like
+neighbourhoods around a centre) with per-location fact statistics, then
+times radius and nearest-neighbour queries and the bulk neighbour
+features refresh_location_features computes at load time. The brute-force
+feature pass is timed on a sample of locations and scaled up. The SQL
+radius query is timed against a full-table scan. Run from the repository root:
+
+    python -m benchmarks.bench_spatial --locations 200000 --radius 2
+'''
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from src.load.spatial import SpatialIndex, haversine_km, geohash_encode, location_features, locations_within
+from .bench_ingest import CITIES
+
+# Rough centres of the generated cities; sizes follow a long tail like the scraped data
+CENTRES = np.array([[19.08, 72.88], [28.61, 77.21], [12.97, 77.59], [17.39, 78.49], [13.08, 80.27],
+                    [22.57, 88.36], [18.52, 73.86], [23.02, 72.57], [26.91, 75.79], [21.17, 72.83]])
+
+
+def make_locations(count, rng):
+    city = rng.choice(len(CENTRES), count, p=np.arange(len(CENTRES), 0, -1) / np.arange(len(CENTRES), 0, -1).sum())
+    # Neighbourhood clusters within each city, about 1 km across, scattered over about 15 km
+    cluster = rng.integers(0, 200, count)
+    offsets = np.random.default_rng(1).normal(0, 0.07, (len(CENTRES), 200, 2))[city, cluster]
+    points = CENTRES[city] + offsets + rng.normal(0, 0.004, (count, 2))
+    facts = rng.integers(1, 6, count)
+    return pd.DataFrame({
+        "id": np.arange(1, count + 1), "CITY": np.array(CITIES, dtype=object)[city % len(CITIES)],
+        "Latitude": points[:, 0], "Longitude": points[:, 1],
+    }), pd.DataFrame({
+        "location_id": np.arange(1, count + 1), "facts": facts,
+        "rating_sum": np.round(rng.normal(3.7, 0.4, count), 1) * facts, "ratings": facts,
+    })
+
+
+def timed(function, repeats=1):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return (time.perf_counter() - start) / repeats, result
+
+
+def brute_features(locations, stats, radius_km, sample):
+    lat, lon = locations["Latitude"].to_numpy(), locations["Longitude"].to_numpy()
+    own = stats[["facts", "rating_sum", "ratings"]].to_numpy(dtype=float)
+    counts = np.empty(len(sample))
+    for start in range(0, len(sample), 256):
+        rows = sample[start:start + 256]
+        near = haversine_km(lat[rows, None], lon[rows, None], lat[None, :], lon[None, :]) <= radius_km
+        counts[start:start + 256] = near @ own[:, 0] - own[rows, 0]
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--locations", type=int, default=200000)
+    parser.add_argument("--radius", type=float, default=2.0, help="radius in km")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="single-point queries to average over")
+    parser.add_argument("--brute-sample", type=int, default=2000, help="locations for the brute-force feature pass")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    locations, stats = make_locations(args.locations, rng)
+    lat, lon = locations["Latitude"].to_numpy(), locations["Longitude"].to_numpy()
+    probes = rng.choice(len(locations), args.queries, replace=False)
+    print(f"{len(locations)} locations, radius {args.radius} km, k {args.k}, {args.queries} probe points")
+
+    build, index = timed(lambda: SpatialIndex(lat, lon, locations["id"].to_numpy()))
+    print(f"  KD-tree build                       {build * 1000:10.1f} ms")
+
+    def brute_within():
+        return [np.flatnonzero(haversine_km(lat[p], lon[p], lat, lon) <= args.radius) for p in probes]
+
+    def tree_within():
+        return [index.within(lat[p], lon[p], args.radius)[0] for p in probes]
+
+    brute, expected = timed(brute_within)
+    tree, found = timed(tree_within)
+    assert all(len(a) == len(b) for a, b in zip(expected, found))
+    print(f"  radius query   brute force          {brute / args.queries * 1000:10.3f} ms/query")
+    print(f"  radius query   KD-tree              {tree / args.queries * 1000:10.3f} ms/query "
+          f"({brute / tree:.0f}x, {np.mean([len(ids) for ids in found]):.0f} hits on average)")
+
+    brute, _ = timed(lambda: [np.argpartition(haversine_km(lat[p], lon[p], lat, lon), args.k)[:args.k] for p in probes])
+    tree, _ = timed(lambda: [index.nearest(lat[p], lon[p], args.k) for p in probes])
+    print(f"  {args.k}-nearest     brute force          {brute / args.queries * 1000:10.3f} ms/query")
+    print(f"  {args.k}-nearest     KD-tree              {tree / args.queries * 1000:10.3f} ms/query ({brute / tree:.0f}x)")
+
+    sample = rng.choice(len(locations), min(args.brute_sample, len(locations)), replace=False)
+    brute, counts = timed(lambda: brute_features(locations, stats, args.radius, sample))
+    tree, features = timed(lambda: location_features(locations, stats, args.radius))
+    assert np.array_equal(counts, features["nearby_count"].to_numpy(dtype=float)[sample])
+    brute_total = brute / len(sample) * len(locations)
+    print(f"  neighbour features brute force      {brute_total:10.2f} s (scaled from {len(sample)} locations)")
+    print(f"  neighbour features KD-tree          {tree:10.2f} s ({brute_total / tree:.0f}x)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "main_db.sqlite")
+        conn = sqlite3.connect(path)
+        locations.assign(geohash=geohash_encode(lat, lon, 7)).to_sql("location_dimension_table", conn, index=False)
+        conn.close()
+        engine = create_engine(f"sqlite:///{path}")
+        with engine.connect() as conn:
+            scan, _ = timed(lambda: [pd.read_sql("SELECT * FROM location_dimension_table", conn)
+                                     .pipe(lambda df: df[haversine_km(lat[p], lon[p], df["Latitude"], df["Longitude"]) <= args.radius])
+                                     for p in probes[:20]])
+        # Indexed the way create_indexes does it for params.indexes
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE INDEX location_dimension_table_geohash ON location_dimension_table (geohash)")
+        conn.execute("ANALYZE")
+        conn.close()
+        geohash, results = timed(lambda: [locations_within(engine, lat[p], lon[p], args.radius) for p in probes])
+        assert all(len(df) == len(ids) for df, ids in zip(results, found))
+        print(f"  SQL radius     full scan            {scan / 20 * 1000:10.3f} ms/query")
+        print(f"  SQL radius     geohash index        {geohash / args.queries * 1000:10.3f} ms/query "
+              f"({scan / 20 / (geohash / args.queries):.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+'''Enriched dataset load time and peak memory: CSV vs Parquet vs Feather.
+
+Each load runs in a fresh process so its peak RSS is measured in
+isolation. Run from the repository root:
+
+    python -m benchmarks.bench_storage --rows 500000
+'''
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import numpy as np
+from src.utils.storage import write_dataset, read_dataset
+from .bench_ingest import make_raw_frame
+
+PROJECTION = ["CITY", "REGION", "Latitude", "Longitude"]
+
+
+def peak_rss_kib():
+    '''High-water RSS of this process; VmHWM resets on exec, ru_maxrss does not'''
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure(path, fmt, columns, memory_map, queue):
+    import pandas  # noqa: F401  (import cost is not part of the load)
+    before = peak_rss_kib()
+    start = time.perf_counter()
+    if fmt == "csv (before)":
+        # The previous extract() path: pd.read_csv with full dtype inference
+        df = pandas.read_csv(path + ".csv", usecols=columns)
+    else:
+        df = read_dataset(path, fmt, columns=columns, memory_map=memory_map)
+    elapsed = time.perf_counter() - start
+    peak = peak_rss_kib()
+    queue.put((elapsed, (peak - before) / 1024, len(df), str(df['Latitude'].dtype)))
+
+
+def measure(path, fmt, columns=None, memory_map=True):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(path, fmt, columns, memory_map, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def directory_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    df = make_raw_frame(args.rows, rng)
+    df["Latitude"] = rng.uniform(8, 36, len(df))
+    df["Longitude"] = rng.uniform(68, 97, len(df))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, "enriched_data")
+        # Scraped coordinates used to be written as strings
+        df.astype({"Latitude": str, "Longitude": str}).to_csv(base + ".csv", index=False)
+        write_dataset(df, os.path.join(tmp, "parquet"), "parquet", "zstd")
+        write_dataset(df, os.path.join(tmp, "feather"), "feather", None)
+
+        cases = [
+            ("csv (before)", base, base + ".csv"),
+            ("parquet", os.path.join(tmp, "parquet"), os.path.join(tmp, "parquet")),
+            ("feather", os.path.join(tmp, "feather"), os.path.join(tmp, "feather")),
+        ]
+        print(f"{len(df)} rows")
+        print(f"{'format':<14} {'columns':<10} {'size MiB':>9} {'load s':>8} {'peak MiB':>9}  Latitude dtype")
+        for fmt, path, location in cases:
+            size = directory_size(location) / 2**20
+            for label, columns in (("all", None), ("projected", PROJECTION)):
+                elapsed, peak, rows, lat_dtype = measure(path, fmt, columns)
+                print(f"{fmt:<14} {label:<10} {size:9.1f} {elapsed:8.2f} {peak:9.1f}  {lat_dtype}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+'''Synthetic Zomato-shaped raw data at any scale.
+
+Writes a tree of pipe-delimited listing files like the scraped dataset:
+one directory per city, files of --rows-per-file rows, with chain outlets
+listed in several cities, listings re-scraped into later files, "-" vote
+counts, missing values in every optional column and (by default) no
+coordinates, so enrich has to fetch them. Rows are generated one file at
+a time, so 50M rows need no more memory than one file. Run from the
+repository root:
+
+    python -m benchmarks.datagen /tmp/zomato_raw --rows 1000000 --url-base http://127.0.0.1:8000
+'''
+import argparse
+import itertools
+import os
+import time
+import numpy as np
+import pandas as pd
+from .bench_ingest import CITIES, CUISINES
+
+CUISINE_TYPES = ["Quick Bites", "Casual Dining", "Cafe", "Fine Dining", "Bakery", "Dessert Parlor", "Bar"]
+TIMINGS = ["11am to 11pm (Mon-Sun)", "12noon to 12midnight (Mon-Sun)", "7am to 10pm (Mon-Sat)",
+           "6pm to 1am (Mon-Sun)", "10am to 10pm (Mon, Tue, Wed, Thu, Fri)"]
+# Every combination of one to three cuisines, as the comma-separated CUSINE_CATEGORY strings
+CUISINE_CATEGORIES = np.array([", ".join(combo) for size in (1, 2, 3)
+                               for combo in itertools.combinations(CUISINES, size)], dtype=object)
+OPTIONAL_COLUMNS = ["PRICE", "CUSINE_CATEGORY", "REGION", "CUSINE TYPE", "TIMING", "RATING_TYPE", "RATING", "VOTES"]
+RATING_CUTS = [(4.5, "Excellent"), (4.0, "Very Good"), (3.5, "Good"), (2.5, "Average"), (0.0, "Poor")]
+
+DEFAULT_GENERATOR_PARAMS = {
+    "rows_per_file": 100000,
+    "outlets": None,
+    "distinct_urls": None,
+    "duplicate_rate": 0.05,
+    "null_rate": 0.02,
+    "coordinate_rate": 0.0,
+    "locality_urls": False,
+    "url_base": "https://www.zomato.com",
+}
+
+
+def make_listings(rows, rng, outlets, distinct_urls, params):
+    '''rows raw listings of outlets drawn from [0, outlets), each with its city, cuisine and page URL.
+
+    An outlet's attributes are a function of its id, so repeated outlets
+    are the same restaurant; RATING, VOTES and PRICE vary per listing.
+    '''
+    outlet = rng.integers(0, outlets, rows)
+    # Outlet ids share a name in groups of 8, so chains have outlets in several cities
+    name = pd.Series(outlet // 8).astype(str)
+    city = np.array(CITIES, dtype=object)[outlet % len(CITIES)]
+    rating = np.round(np.clip(rng.normal(3.7, 0.5, rows), 1.0, 4.9), 1)
+    rating_type = np.select([rating >= cut for cut, _ in RATING_CUTS], [label for _, label in RATING_CUTS], "Poor")
+    url_id = pd.Series(outlet % distinct_urls).astype(str)
+    if params["locality_urls"]:
+        # <locality>.<id> pages: the stub server places them around their CITY/REGION's centre
+        url_id = pd.Series(outlet % len(CITIES)).astype(str) + "x" + pd.Series(outlet % 97 + 1).astype(str) + "." + url_id
+    frame = pd.DataFrame({
+        "NAME": ("Restaurant " + name).to_numpy(),
+        "PRICE": (rng.integers(2, 60, rows) * 50).astype(float),
+        "CUSINE_CATEGORY": CUISINE_CATEGORIES[(outlet * 7919) % len(CUISINE_CATEGORIES)],
+        "CITY": city,
+        "REGION": ("Sector " + pd.Series(outlet % 97 + 1).astype(str)).to_numpy(),
+        "URL": (params["url_base"].rstrip("/") + "/restaurant/" + url_id).to_numpy(),
+        "PAGE NO": rng.integers(1, 300, rows).astype(float),
+        "CUSINE TYPE": np.array(CUISINE_TYPES, dtype=object)[outlet % len(CUISINE_TYPES)],
+        "TIMING": np.array(TIMINGS, dtype=object)[outlet % len(TIMINGS)],
+        "RATING_TYPE": rating_type,
+        "RATING": rating,
+        # New listings show "-" instead of a vote count
+        "VOTES": np.where(rng.random(rows) < 0.1, "-", rng.integers(0, 5000, rows).astype(str)),
+        "Latitude": np.nan,
+        "Longitude": np.nan,
+    })
+    if params["coordinate_rate"]:
+        located = rng.random(rows) < params["coordinate_rate"]
+        frame.loc[located, "Latitude"] = 8.0 + (outlet[located] % 2800) / 100
+        frame.loc[located, "Longitude"] = 68.0 + (outlet[located] % 2900) / 100
+    if params["null_rate"]:
+        for column in OPTIONAL_COLUMNS:
+            frame.loc[rng.random(rows) < params["null_rate"], column] = np.nan
+    return frame
+
+
+def write_raw_tree(directory, rows, seed=0, **overrides):
+    '''Write about rows listings under directory (plus duplicate_rate re-scraped copies).
+
+    Returns (files written, rows written including duplicates).
+    '''
+    params = dict(DEFAULT_GENERATOR_PARAMS, **overrides)
+    outlets = params["outlets"] or max(1, rows // 3)
+    distinct_urls = params["distinct_urls"] or outlets
+    rng = np.random.default_rng(seed)
+    previous = None
+    files = written = 0
+    for start in range(0, rows, params["rows_per_file"]):
+        frame = make_listings(min(params["rows_per_file"], rows - start), rng, outlets, distinct_urls, params)
+        if previous is not None and params["duplicate_rate"]:
+            # Re-scraped listings repeat rows of the previous file verbatim
+            frame = pd.concat([frame, previous.sample(frac=params["duplicate_rate"], random_state=rng.integers(2**31))],
+                              ignore_index=True)
+        city_dir = os.path.join(directory, CITIES[files % len(CITIES)])
+        os.makedirs(city_dir, exist_ok=True)
+        frame.to_csv(os.path.join(city_dir, f"page_{files}.csv"), sep="|", index=False)
+        previous = frame
+        files += 1
+        written += len(frame)
+    return files, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--rows-per-file", type=int, default=DEFAULT_GENERATOR_PARAMS["rows_per_file"])
+    parser.add_argument("--outlets", type=int, help="distinct restaurants (default rows / 3)")
+    parser.add_argument("--distinct-urls", type=int, help="distinct page URLs to enrich (default one per outlet)")
+    parser.add_argument("--duplicate-rate", type=float, default=DEFAULT_GENERATOR_PARAMS["duplicate_rate"])
+    parser.add_argument("--null-rate", type=float, default=DEFAULT_GENERATOR_PARAMS["null_rate"])
+    parser.add_argument("--coordinate-rate", type=float, default=DEFAULT_GENERATOR_PARAMS["coordinate_rate"],
+                        help="share of listings that already have coordinates")
+    parser.add_argument("--locality-urls", action="store_true",
+                        help="page URLs the stub server places around their locality's centre")
+    parser.add_argument("--url-base", default=DEFAULT_GENERATOR_PARAMS["url_base"],
+                        help="page server for the URL column, e.g. the stub server")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    files, written = write_raw_tree(
+        args.directory, args.rows, args.seed, rows_per_file=args.rows_per_file, outlets=args.outlets,
+        distinct_urls=args.distinct_urls, duplicate_rate=args.duplicate_rate, null_rate=args.null_rate,
+        coordinate_rate=args.coordinate_rate, locality_urls=args.locality_urls, url_base=args.url_base
+    )
+    elapsed = time.perf_counter() - start
+    print(f"{written} rows in {files} files under {args.directory} in {elapsed:.1f} s ({written / elapsed:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
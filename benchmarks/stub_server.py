@@ -0,0 +1,118 @@
+import argparse
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>{name} | Zomato</title>
+<link rel="stylesheet" href="/static/app.css"></head>
+<body><div id="root">{filler}</div>
+<script>window.__PRELOADED_STATE__ = JSON.parse("{{\\"pages\\":{{\\"restaurant\\":{{\\"{res_id}\\":{{\\"sections\\":{{\\"SECTION_RES_CONTACT\\":{{\\"res_id\\":{res_id},\\"latitude\\":\\"{lat}\\",\\"longitude\\":\\"{lon}\\",\\"locality_verbose\\":\\"{name}\\"}}}}}}}}}}}}");</script>
+<img src="https://maps.zomato.com/php/staticmap?center={lat},{lon}&amp;maptype=zomato&amp;markers={lat},{lon},pin_res32&amp;sensor=false&amp;scale=2&amp;zoom=16&amp;language=en&amp;size=240x150">
+<div class="footer">{filler}</div>
+</body></html>"""
+
+FILLER_BLOCK = '<div class="sc-1mo3ldo-0"><span class="sc-jxGEyO">Delivery | Dining | Nightlife</span></div>\n'
+
+
+def coordinates_for(res_id):
+    '''Deterministic lat/lon for a stub restaurant id.
+
+    An id of the form <locality>.<n> lands within about 0.5 km of its
+    locality's centre, so restaurants of one locality cluster like real ones.
+    '''
+    locality, _, _ = str(res_id).rpartition(".")
+    seed = zlib.crc32(str(locality or res_id).encode())
+    lat = 8.0 + (seed % 2800000) / 100000
+    lon = 68.0 + (seed // 2800000 % 2900000) / 100000
+    if locality:
+        offset = zlib.crc32(str(res_id).encode())
+        lat += (offset % 1000 - 500) / 125000
+        lon += (offset // 1000 % 1000 - 500) / 125000
+    return f"{lat:.7f}", f"{lon:.7f}"
+
+
+def make_page(res_id, filler_blocks=400):
+    '''Render a Zomato-like restaurant page for res_id'''
+    lat, lon = coordinates_for(res_id)
+    filler = FILLER_BLOCK * filler_blocks
+    return PAGE_TEMPLATE.format(name=f"Restaurant {res_id}", res_id=res_id, lat=lat, lon=lon, filler=filler)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        delay = self.server.latency
+        if self.server.jitter:
+            # Exponential tail on top of the base latency, like a real site under load
+            delay += random.expovariate(1 / self.server.jitter)
+        if delay:
+            time.sleep(delay)
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "restaurant":
+            self.send_error(404)
+            return
+        body = make_page(parts[1], self.server.filler_blocks).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients hang up once they have the coordinates; that is expected
+        pass
+
+
+def start_stub_server(latency=0.0, filler_blocks=400, host="127.0.0.1", port=0, jitter=0.0):
+    '''Start the stub page server in a background thread.
+
+    Every response waits latency seconds plus an exponentially distributed
+    extra delay with mean jitter. Both are attributes of the server and can
+    be changed while it runs; server.requests counts the requests served
+    so far. Returns (server, base_url); call
+    server.shutdown() when finished.
+    '''
+    server = StubServer((host, port), StubHandler)
+    server.latency = latency
+    server.jitter = jitter
+    server.filler_blocks = filler_blocks
+    server.requests = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve stub Zomato restaurant pages at /restaurant/<id>")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="base delay per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="mean extra delay per request in seconds")
+    parser.add_argument("--filler", type=int, default=400, help="filler blocks per page (page size)")
+    args = parser.parse_args()
+    server, base_url = start_stub_server(args.latency, args.filler, args.host, args.port, args.jitter)
+    print(f"Serving stub pages at {base_url}/restaurant/<id>; Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,16 @@
-from src.extract.extract import extract
-from src.transform.staging import stage_data
-from src.transform.transform import transform
-from src.load.load import load
+from src.extract.extract import extract, iter_extract, confirm_loaded
+from src.transform.staging import stage_data, stage_chunks
+from src.transform.transform import transform, transform_chunks
+from src.load.load import load, load_chunks
+from src.load.aggregate import aggregate
+from src.utils.config import load_config
+from src.extract.combine import discover_files
+from src.utils.metrics import start_run
+from src.utils.dag import Stage, run_dag, file_fingerprint, get_pipeline_params
+from src.utils.db_utils import table_exists
+from sqlalchemy import create_engine
 
+import argparse
 import logging
 
 logging.basicConfig(
@@ -12,24 +20,128 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S" 
 )
 
-def main():
-    logging.info("Starting extraction process...")
-    extracted_data = extract()
-    logging.info("Extraction complete.")
-    logging.info(f"Extracted data dimension: {extracted_data.shape}")
-    
-    logging.info("Starting staging process...")
-    stage_data(extracted_data)
-    logging.info("Staging complete.")
-    
-    logging.info("Starting transformation process...")
-    transformed_data = transform()
-    logging.info(f"Transformed data dimension: {transformed_data.shape}")
-    logging.info("Transformation complete.")
-    
-    logging.info("Starting loading process...")
-    load()
-    logging.info("Loading complete.")
+# Config a stage's output depends on, besides its upstream stages
+EXTRACT_KEYS = ["file_path.raw_data", "file_path.enriched_data", "params.raw_schema", "params.ingest",
+                "params.enrich", "params.storage"]
+STAGING_KEYS = ["file_path.staging_db", "params.dtype_mapping", "params.bulk_load"]
+TRANSFORM_KEYS = ["file_path.main_db", "params.null_limit", "params.type_inference", "params.dtype_mapping",
+                  "params.restaurant_dimension_table_columns", "params.location_dimension_table_columns",
+                  "params.fact_table_1_columns"]
+LOAD_KEYS = ["file_path.main_db", "params.load", "params.indexes", "params.bulk_load", "params.spatial",
+             "params.restaurant_dimension_table_columns", "params.location_dimension_table_columns",
+             "params.fact_table_1_columns"]
+AGGREGATE_KEYS = ["file_path.main_db", "params.aggregates"]
+
+
+def has_tables(db_url, *table_names):
+    engine = create_engine(db_url)
+    conn = engine.raw_connection()
+    try:
+        return all(table_exists(conn, table_name) for table_name in table_names)
+    finally:
+        conn.close()
+
+
+def raw_files_fingerprint(config):
+    return file_fingerprint(discover_files(config["file_path"]["raw_data"]))
+
+
+def load_and_confirm(config, load_rows):
+    '''Run load_rows(), then drop the pending delta it wrote, so a failed load is retried with the same rows'''
+    rows = load_rows()
+    confirm_loaded(config)
+    return rows
+
+
+def pipeline_stages(config, force=False):
+    '''extract -> transform -> load -> aggregate, handing the frames over in memory.
+
+    load() takes transform()'s typed frame directly, so staging_db is not
+    read back. Staging is only a durability sink, set by
+    params.pipeline.staging: "async" writes it alongside transform and
+    load, "sync" makes load wait for it, "off" skips it. With force,
+    extract hands on the whole enriched dataset, not just the new rows.
+    '''
+    file_paths = config["file_path"]
+    aggregate_tables = list(config["params"].get("aggregates", {}))
+    staging = get_pipeline_params(config)["staging"]
+    stages = [
+        # Not persistent: a rerun replays the rows load has not confirmed (the pending delta),
+        # so a failed transform or load gets the same delta again instead of an empty one
+        Stage("extract", lambda inputs: extract(full=force), config_keys=EXTRACT_KEYS,
+              fingerprint=lambda: raw_files_fingerprint(config), persistent=False, halt=lambda df: df.empty),
+    ]
+    if staging != "off":
+        stages.append(Stage("staging", lambda inputs: stage_data(inputs["extract"]), deps=["extract"],
+                            config_keys=STAGING_KEYS, exists=lambda: has_tables(file_paths["staging_db"], "staging_db")))
+    stages += [
+        Stage("transform", lambda inputs: transform(inputs["extract"], replan=force), deps=["extract"], config_keys=TRANSFORM_KEYS,
+              persistent=False),
+        Stage("load", lambda inputs: load_and_confirm(config, lambda: load(inputs["transform"])),
+              deps=["transform"] + (["staging"] if staging == "sync" else []), config_keys=LOAD_KEYS, exists=lambda: has_tables(file_paths["main_db"], "fact_table")),
+        Stage("aggregate", lambda inputs: aggregate(), deps=["load"], config_keys=AGGREGATE_KEYS,
+              exists=lambda: has_tables(file_paths["main_db"], *aggregate_tables)),
+    ]
+    return stages
+
+
+def streaming_stages(config, chunk_size, force=False):
+    '''extract_staging -> transform_load -> aggregate, each streaming chunk by chunk'''
+    file_paths = config["file_path"]
+    aggregate_tables = list(config["params"].get("aggregates", {}))
+    return [
+        # Extraction and staging interleave chunk by chunk, so they are one stage
+        Stage("extract_staging", lambda inputs: stage_chunks(iter_extract(config, chunk_size, full=force)),
+              config_keys=EXTRACT_KEYS + STAGING_KEYS, fingerprint=lambda: raw_files_fingerprint(config),
+              exists=lambda: has_tables(file_paths["staging_db"], "staging_db"), halt=lambda rows: rows == 0),
+        Stage("transform_load", lambda inputs: load_and_confirm(config, lambda: load_chunks(transform_chunks(chunk_size, replan=force))),
+              deps=["extract_staging"],
+              config_keys=TRANSFORM_KEYS + LOAD_KEYS, exists=lambda: has_tables(file_paths["main_db"], "fact_table")),
+        Stage("aggregate", lambda inputs: aggregate(), deps=["transform_load"], config_keys=AGGREGATE_KEYS,
+              exists=lambda: has_tables(file_paths["main_db"], *aggregate_tables)),
+    ]
+
+
+def main(force=False):
+    config = load_config()
+    pipeline = get_pipeline_params(config)
+    logging.info("Starting pipeline...")
+    outputs = run_dag(pipeline_stages(config, force), config, config["file_path"].get("stage_state", "data/cache/stage_state.json"),
+                      pipeline["max_workers"], force)
+    if "extract" in outputs:
+        logging.info(f"Extracted data dimension: {outputs['extract'].shape}")
+        if outputs["extract"].empty:
+            logging.info("No new rows since the last run; nothing to stage or load.")
+    if "transform" in outputs:
+        logging.info(f"Transformed data dimension: {outputs['transform'].shape}")
+    logging.info("Pipeline complete.")
+
+def main_streaming(chunk_size=None, force=False):
+    '''Run the pipeline in fixed-size chunks so peak memory tracks chunk_size, not the dataset'''
+    config = load_config()
+    if chunk_size is None:
+        chunk_size = config["params"].get("stream", {}).get("chunk_size", 100000)
+    pipeline = get_pipeline_params(config)
+
+    logging.info(f"Starting streaming pipeline (chunk size {chunk_size})...")
+    outputs = run_dag(streaming_stages(config, chunk_size, force), config,
+                      config["file_path"].get("stage_state", "data/cache/stage_state.json"), pipeline["max_workers"], force)
+    if outputs.get("extract_staging") == 0:
+        logging.info("No new rows since the last run; nothing to load.")
+    logging.info("Pipeline complete.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Zomato ETL pipeline")
+    parser.add_argument("--stream", action="store_true", help="process the data in bounded-memory chunks")
+    parser.add_argument("--chunk-size", type=int, help="rows per chunk in --stream mode")
+    parser.add_argument("--profile", action="store_true",
+                        help="also run each stage under cProfile and save its stats in the profiles directory")
+    parser.add_argument("--force", action="store_true", help="run every stage, even those whose inputs are unchanged")
+    args = parser.parse_args()
+    file_paths = load_config()["file_path"]
+    start_run(file_paths.get("metrics", "logs/etl_metrics.jsonl"),
+              file_paths.get("profiles", "logs/profiles") if args.profile else None)
+    if args.stream:
+        main_streaming(args.chunk_size, args.force)
+    else:
+        main(args.force)
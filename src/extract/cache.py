@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import time
+import logging
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+
+DAY = 24 * 60 * 60
+
+
+class EnrichmentCache:
+    '''On-disk URL -> (latitude, longitude, fetched_at, status) cache.
+
+    Successful lookups live for ttl seconds, failed ones for negative_ttl
+    seconds so dead pages are not re-fetched on every run. When the cache
+    holds more than max_entries rows the oldest fetches are evicted.
+    '''
+
+    def __init__(self, path, ttl=90 * DAY, negative_ttl=7 * DAY, max_entries=2000000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS enrich_cache ("
+            "url TEXT PRIMARY KEY, latitude TEXT, longitude TEXT, fetched_at REAL, status TEXT)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS enrich_cache_fetched_at ON enrich_cache (fetched_at)")
+        self.conn.commit()
+
+    def get_many(self, urls, now=None, batch_size=500):
+        '''Return {url: (latitude, longitude, status)} for unexpired entries'''
+        if now is None:
+            now = time.time()
+        found = {}
+        urls = list(urls)
+        for start in range(0, len(urls), batch_size):
+            batch = urls[start:start + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT url, latitude, longitude, fetched_at, status FROM enrich_cache WHERE url IN ({placeholders})",
+                batch
+            )
+            for url, latitude, longitude, fetched_at, status in rows:
+                ttl = self.ttl if status == STATUS_OK else self.negative_ttl
+                if now - fetched_at <= ttl:
+                    found[url] = (latitude, longitude, status)
+        return found
+
+    def put_many(self, results, now=None):
+        '''Store (url, latitude, longitude) results; missing coordinates are cached as failures'''
+        if now is None:
+            now = time.time()
+        rows = [
+            (url, latitude, longitude, now, STATUS_OK if latitude is not None and longitude is not None else STATUS_FAILED)
+            for url, latitude, longitude in results
+        ]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO enrich_cache (url, latitude, longitude, fetched_at, status) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        self.conn.commit()
+
+    def evict(self, now=None):
+        '''Drop expired entries, then the oldest ones beyond max_entries'''
+        if now is None:
+            now = time.time()
+        self.conn.execute(
+            "DELETE FROM enrich_cache WHERE (status = ? AND fetched_at < ?) OR (status != ? AND fetched_at < ?)",
+            (STATUS_OK, now - self.ttl, STATUS_OK, now - self.negative_ttl)
+        )
+        count = self.conn.execute("SELECT COUNT(*) FROM enrich_cache").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM enrich_cache WHERE url IN "
+                "(SELECT url FROM enrich_cache ORDER BY fetched_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+            logging.info(f"Evicted {count - self.max_entries} entries from {self.path}")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def open_cache(config, params):
+    '''Open the cache configured under file_path.enrich_cache, or None if disabled'''
+    path = config["file_path"].get("enrich_cache")
+    if not path or not params.get("use_cache", True):
+        return None
+    return EnrichmentCache(
+        path,
+        ttl=params["cache_ttl_days"] * DAY,
+        negative_ttl=params["negative_ttl_days"] * DAY,
+        max_entries=params["cache_max_entries"]
+    )
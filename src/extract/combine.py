@@ -1,20 +1,174 @@
 import os
 import logging
+import numpy as np
 import pandas as pd
+from joblib import Parallel, delayed
+from ..utils.config import load_config
+from ..utils.pd_utils import SeenHashes, row_hashes
+from ..utils.metrics import instrumented
 
-def iterate(path):
-    combined_df = pd.DataFrame()
+DEFAULT_RAW_SCHEMA = {
+    "NAME": "object",
+    "PRICE": "float64",
+    "CUSINE_CATEGORY": "object",
+    "CITY": "object",
+    "REGION": "object",
+    "URL": "object",
+    "PAGE NO": "float64",
+    "CUSINE TYPE": "object",
+    "TIMING": "object",
+    "RATING_TYPE": "object",
+    "RATING": "float64",
+    "VOTES": "object",
+    "Latitude": "float64",
+    "Longitude": "float64"
+}
 
+DEFAULT_INGEST_PARAMS = {
+    "incremental": False,
+    "n_jobs": -1,
+    "parallel_min_files": 8
+}
+
+
+def discover_files(path):
+    '''List every raw .csv under path, sorted so runs are reproducible'''
+    file_paths = []
     for root, _, files in os.walk(path):
         for f in files:
             if f.endswith(".csv"):
-                file_path = os.path.join(root, f)
-                try:
-                    df = pd.read_csv(file_path, sep="|", header=0)
-                    combined_df = pd.concat([combined_df, df], ignore_index=True)
-                except Exception as e:
-                    logging.error(f"Error reading file {file_path}: {e}")
+                file_paths.append(os.path.join(root, f))
+    return sorted(file_paths)
 
-    logging.info("Converted to DataFrame successfully")
-    combined_df.drop_duplicates(inplace=True)
+
+def read_raw_file(file_path, schema):
+    '''Parse one pipe-delimited file into the fixed schema.
+
+    Text columns are read as objects without type inference; numeric
+    columns are coerced so a bad value becomes NaN instead of turning the
+    whole column into objects. Returns (df, row_hashes), or (None, None) if
+    the file cannot be read.
+    '''
+    text_columns = {col: object for col, dtype in schema.items() if dtype == "object"}
+    try:
+        df = pd.read_csv(file_path, sep="|", header=0, dtype=text_columns, usecols=lambda c: c in schema)
+    except Exception as e:
+        logging.error(f"Error reading file {file_path}: {e}")
+        return None, None
+    df = apply_schema(df, schema)
+    return df, row_hashes(df)
+
+
+def apply_schema(df, schema):
+    '''Reorder df to the schema's columns and cast each one to its dtype'''
+    df = df.reindex(columns=list(schema))
+    for col, dtype in schema.items():
+        if str(df[col].dtype) != dtype:
+            if dtype == "object":
+                df[col] = df[col].astype(object)
+            else:
+                df[col] = pd.to_numeric(df[col], errors="coerce").astype(dtype)
+    return df
+
+
+def get_ingest_settings(config=None):
+    '''Return (raw_schema, ingest_params) from config, falling back to the defaults'''
+    if config is None:
+        config = load_config()
+    schema = config["params"].get("raw_schema", DEFAULT_RAW_SCHEMA)
+    params = dict(DEFAULT_INGEST_PARAMS, **config["params"].get("ingest", {}))
+    return schema, params
+
+
+@instrumented
+def iterate(path, schema=None, params=None):
+    '''Combine every raw file under path into one de-duplicated DataFrame'''
+    if schema is None or params is None:
+        default_schema, default_params = get_ingest_settings()
+        schema = schema or default_schema
+        params = params or default_params
+
+    file_paths = discover_files(path)
+    logging.info(f"Found {len(file_paths)} raw files under {path}")
+    combined_df, _ = ingest_files(file_paths, schema, params)
     return combined_df
+
+
+@instrumented
+def ingest_files(file_paths, schema, params, known_hashes=None):
+    '''Parse file_paths and return (df, row_hashes) of unique rows.
+
+    Rows whose hash is in known_hashes (a sorted array from earlier runs)
+    are dropped as well as duplicates within these files.
+    '''
+    if len(file_paths) >= params["parallel_min_files"]:
+        parsed = Parallel(n_jobs=params["n_jobs"])(
+            delayed(read_raw_file)(file_path, schema) for file_path in file_paths
+        )
+    else:
+        parsed = [read_raw_file(file_path, schema) for file_path in file_paths]
+
+    return combine_parsed(parsed, schema, known_hashes)
+
+
+def combine_parsed(parsed, schema, known_hashes=None):
+    '''Concatenate parsed (df, row_hashes) pairs once and drop duplicate rows by hash'''
+    parsed = [(df, hashes) for df, hashes in parsed if df is not None]
+    if not parsed:
+        empty = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in schema.items()})
+        return empty, np.empty(0, dtype=np.uint64)
+
+    combined_df = pd.concat([df for df, _ in parsed], ignore_index=True)
+    hashes = np.concatenate([hashes for _, hashes in parsed])
+    logging.info("Converted to DataFrame successfully")
+
+    duplicated = pd.Index(hashes).duplicated()
+    if known_hashes is not None and len(known_hashes):
+        # known_hashes is sorted, so membership is a binary search per row
+        positions = np.minimum(np.searchsorted(known_hashes, hashes), len(known_hashes) - 1)
+        seen = known_hashes[positions] == hashes
+        logging.info(f"Dropped {int((seen & ~duplicated).sum())} rows ingested by earlier runs")
+        duplicated = duplicated | seen
+    combined_df = combined_df[~duplicated].reset_index(drop=True)
+    logging.info(f"Kept {len(combined_df)} of {len(hashes)} rows after de-duplication")
+    return combined_df, hashes[~duplicated]
+
+
+def iter_raw_chunks(file_paths, schema, chunk_size, seen=None):
+    '''Yield (df, row_hashes) of unique rows from file_paths in chunks of about chunk_size rows.
+
+    Large files are read with read_csv(chunksize=...), so no file is ever
+    fully materialized; seen (a SeenHashes) drops rows from earlier chunks
+    or earlier runs.
+    '''
+    if seen is None:
+        seen = SeenHashes()
+    pending, pending_rows = [], 0
+    for file_path in file_paths:
+        for df, hashes in _read_raw_file_chunks(file_path, schema, chunk_size):
+            pending.append((df, hashes))
+            pending_rows += len(df)
+            if pending_rows >= chunk_size:
+                yield _unique_chunk(pending, seen)
+                pending, pending_rows = [], 0
+    if pending:
+        yield _unique_chunk(pending, seen)
+
+
+def _read_raw_file_chunks(file_path, schema, chunk_size):
+    text_columns = {col: object for col, dtype in schema.items() if dtype == "object"}
+    try:
+        reader = pd.read_csv(file_path, sep="|", header=0, dtype=text_columns,
+                             usecols=lambda c: c in schema, chunksize=chunk_size)
+        for df in reader:
+            df = apply_schema(df, schema)
+            yield df, row_hashes(df)
+    except Exception as e:
+        logging.error(f"Error reading file {file_path}: {e}")
+
+
+def _unique_chunk(pending, seen):
+    df = pd.concat([df for df, _ in pending], ignore_index=True)
+    hashes = np.concatenate([hashes for _, hashes in pending])
+    new = seen.add_new(hashes)
+    return df[new].reset_index(drop=True), hashes[new]
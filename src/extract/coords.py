@@ -0,0 +1,95 @@
+import re
+
+STATE_MARKER = b'window.__PRELOADED_STATE__'
+LATITUDE_KEY = b'"latitude\\":\\"'
+LONGITUDE_KEY = b'"longitude\\":\\"'
+VALUE_END = b'\\"'
+CENTER_PATTERN = re.compile(rb'center=(-?[0-9.]+),(-?[0-9.]+)')
+
+# Longest span that may straddle two chunks: a key plus its quoted value
+MAX_VALUE_LEN = 32
+OVERLAP = max(len(STATE_MARKER), len(LONGITUDE_KEY) + MAX_VALUE_LEN + len(VALUE_END))
+
+
+class CoordinateScanner:
+    '''Incrementally scan a restaurant page for its coordinates.
+
+    Feed the response body chunk by chunk; feed() returns True as soon as
+    latitude and longitude have been read from window.__PRELOADED_STATE__,
+    at which point the rest of the body can be skipped. If the page ends
+    without them, result() falls back to the map image's center=lat,lon.
+    Only a small tail of the previous chunk is kept between calls.
+    '''
+
+    def __init__(self):
+        self._tail = b''
+        self.state_seen = False
+        self.latitude = None
+        self.longitude = None
+        self.center = None
+        self.bytes_read = 0
+
+    @property
+    def done(self):
+        return self.latitude is not None and self.longitude is not None
+
+    def feed(self, chunk):
+        self.bytes_read += len(chunk)
+        buf = self._tail + chunk
+
+        start = 0
+        if not self.state_seen:
+            marker_at = buf.find(STATE_MARKER)
+            if marker_at != -1:
+                self.state_seen = True
+                start = marker_at + len(STATE_MARKER)
+
+        if self.state_seen:
+            if self.latitude is None:
+                self.latitude = _find_value(buf, LATITUDE_KEY, start)
+            if self.longitude is None:
+                self.longitude = _find_value(buf, LONGITUDE_KEY, start)
+
+        if self.center is None:
+            match = CENTER_PATTERN.search(buf)
+            # A match touching the end of buf may be a truncated number
+            if match and match.end() < len(buf):
+                self.center = (match.group(1).decode(), match.group(2).decode())
+
+        self._tail = buf[-OVERLAP:]
+        return self.done
+
+    def result(self):
+        '''(latitude, longitude) as strings, or (None, None) if not found'''
+        if self.done:
+            return self.latitude, self.longitude
+        if self.center is None:
+            # At end of body a match may legitimately end on the last byte
+            match = CENTER_PATTERN.search(self._tail)
+            if match:
+                self.center = (match.group(1).decode(), match.group(2).decode())
+        if self.center is not None:
+            return self.center
+        return None, None
+
+
+def _find_value(buf, key, start):
+    key_at = buf.find(key, start)
+    if key_at == -1:
+        return None
+    value_start = key_at + len(key)
+    value_end = buf.find(VALUE_END, value_start, value_start + MAX_VALUE_LEN + len(VALUE_END))
+    if value_end == -1:
+        return None
+    return buf[value_start:value_end].decode()
+
+
+def extract_coordinates(data, chunk_size=16384):
+    '''Scan an in-memory page (str or bytes); returns ((lat, lon), bytes_read)'''
+    if isinstance(data, str):
+        data = data.encode()
+    scanner = CoordinateScanner()
+    for offset in range(0, len(data), chunk_size):
+        if scanner.feed(data[offset:offset + chunk_size]):
+            break
+    return scanner.result(), scanner.bytes_read
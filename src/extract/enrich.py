@@ -1,52 +1,263 @@
-from joblib import Parallel, delayed
-import multiprocessing
+import asyncio
+import logging
+import aiohttp
+import numpy as np
+import pandas as pd
 from tqdm import tqdm
 import requests
 from requests.exceptions import SSLError, ConnectionError
-import pandas as pd
-from bs4 import BeautifulSoup
-import os
+from ..utils.config import load_config
+from ..utils.metrics import instrumented
+from .coords import CoordinateScanner
+from .geocoder import locality_keys
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Mobile Safari/537.36'
+}
+
+DEFAULT_ENRICH_PARAMS = {
+    "concurrency": 32,
+    "limit_per_host": 32,
+    "timeout": 10,
+    "keepalive_timeout": 30,
+    "checkpoint_every": 1000,
+    "read_chunk_size": 16384,
+    "drain_limit": 262144,
+    "use_cache": True,
+    "cache_ttl_days": 90,
+    "negative_ttl_days": 7,
+    "cache_max_entries": 2000000,
+    "locality_policy": "fallback",
+    "locality_min_samples": 3,
+    "locality_max_spread_km": 1.0,
+    "locality_probe_urls": 5
+}
+
+
+def get_enrich_params(config=None):
+    '''Merge the "enrich" config block over the defaults'''
+    if config is None:
+        config = load_config()
+    params = dict(DEFAULT_ENRICH_PARAMS)
+    params.update(config["params"].get("enrich", {}))
+    return params
+
+
+@instrumented
+def enrich(df, journal=None, params=None, cache=None, centroids=None):
+    '''Fill missing Latitude/Longitude by scraping each row's URL.
+
+    Only rows where both coordinates are null are considered, so a partially
+    enriched checkpoint resumes where it stopped. Each distinct URL is
+    fetched at most once per run, and URLs with a fresh entry in cache (an
+    EnrichmentCache) are filled without any network call. Results are
+    written into df as each request completes and appended to journal (an
+    EnrichmentJournal), which is fsynced every checkpoint_every URLs.
 
-def enrich(df,output_file):
-    
-    num_cores = multiprocessing.cpu_count()
+    With centroids (a LocalityCentroids), params["locality_policy"] decides
+    how the offline tier is used. "prefer" fills the URLs of a locality
+    with its centroid when the table has locality_min_samples observations
+    of it within locality_max_spread_km; for localities it cannot answer
+    yet, up to locality_probe_urls URLs are fetched first and the table is
+    asked again. "fallback" fetches every URL and uses the centroid only
+    where the page gave no coordinates. Coordinates from pages and from the
+    input rows are added to the table; centroid fills are neither added,
+    journaled nor cached.
+
+    The coord_source column records where each row's coordinates came
+    from: "listing" (the input row or the listing's page) or "locality"
+    (a centroid shared by the whole locality, so not a location of its own).
+    '''
+    if params is None:
+        params = get_enrich_params()
+    policy = params["locality_policy"] if centroids is not None else "off"
+    if 'coord_source' not in df.columns:
+        df['coord_source'] = None
 
- 
-    batch_size = 100
     df_to_process = df[df['Latitude'].isnull() & df['Longitude'].isnull()]
+    # Scraped coordinates are strings; hold them without a float upcast per cell
+    df[['Latitude', 'Longitude']] = df[['Latitude', 'Longitude']].astype(object)
+    url_rows = df_to_process.groupby('URL', sort=False).groups
+
+    if cache is not None:
+        cached = cache.get_many(url_rows.keys())
+        for url, (latitude, longitude, status) in cached.items():
+            df.loc[url_rows[url], 'Latitude'] = latitude
+            df.loc[url_rows[url], 'Longitude'] = longitude
+        logging.info(f"Enrichment cache: {len(cached)} of {len(url_rows)} URLs hit")
+    else:
+        cached = {}
+
+    pending = [url for url in url_rows if url not in cached]
+    filled = set()
+    if policy != "off":
+        localities = df_to_process.groupby('URL', sort=False)[['CITY', 'REGION']].first()
+        # Only URLs the table has not observed yet are counted
+        centroids.add(df[df['Latitude'].notnull() & df['Longitude'].notnull() & (df['coord_source'] != 'locality')])
+    if policy == "prefer":
+        filled = _fill_from_centroids(df, url_rows, pending, localities, centroids, params)
+        unknown = localities.loc[[url for url in pending if url not in filled]]
+        city, region = locality_keys(unknown)
+        # Localities the table cannot answer yet: a few of their pages decide whether the rest need fetching
+        probes = list(unknown[city.notna()].groupby([city, region], sort=False).head(params["locality_probe_urls"]).index)
+        if probes:
+            logging.info(f"Fetching {len(probes)} URLs to learn {city.dropna().nunique()} unknown localities")
+            results = asyncio.run(_enrich_rows(df, url_rows, [(url, url) for url in probes], journal, params, cache))
+            _add_results(centroids, localities, results)
+            probed = set(probes)
+            pending = [url for url in pending if url not in filled and url not in probed]
+            filled |= _fill_from_centroids(df, url_rows, pending, localities, centroids, params)
+        logging.info(f"Locality centroids: {len(filled)} URLs filled offline")
+
+    jobs = [(url, url) for url in pending if url not in filled]
+    logging.info(f"Enriching {len(df_to_process)} rows: fetching {len(jobs)} distinct URLs "
+                 f"with concurrency {params['concurrency']}")
 
-    for start in tqdm(range(0, len(df_to_process), batch_size), desc="Processing Batches"):
-        end = min(start + batch_size, len(df_to_process))
-        batch_df = df_to_process.iloc[start:end]
-        results = Parallel(n_jobs=num_cores)(
-            delayed(extract_lat_long)(row['URL']) for index, row in batch_df.iterrows()
-        )
-        df.loc[batch_df.index, ['Latitude', 'Longitude']] = results
-        df.to_csv(output_file, index=False)
-    print("Enrichment complete.")
+    results = asyncio.run(_enrich_rows(df, url_rows, jobs, journal, params, cache))
+    if policy != "off":
+        _add_results(centroids, localities, results)
+    if policy == "fallback":
+        failed = [url for url, latitude, longitude in results if latitude is None or longitude is None]
+        filled = _fill_from_centroids(df, url_rows, failed, localities, centroids, params)
+        logging.info(f"Locality centroids: {len(filled)} of {len(failed)} failed URLs filled offline")
+    if cache is not None:
+        cache.evict()
+    # Scraped values are strings; store typed coordinates from here on
+    df['Latitude'] = pd.to_numeric(df['Latitude'], errors='coerce')
+    df['Longitude'] = pd.to_numeric(df['Longitude'], errors='coerce')
+    df.loc[df['Latitude'].notnull() & df['Longitude'].notnull() & df['coord_source'].isnull(), 'coord_source'] = 'listing'
+    logging.info("Enrichment complete.")
     return df
 
+
+def _fill_from_centroids(df, url_rows, urls, localities, centroids, params):
+    '''Fill the rows of urls whose locality has a usable centroid; returns the URLs filled'''
+    if not urls:
+        return set()
+    coordinates = centroids.lookup(localities.loc[urls], params["locality_min_samples"],
+                                   params["locality_max_spread_km"]).dropna()
+    if coordinates.empty:
+        return set()
+    rows = np.concatenate([url_rows[url] for url in coordinates.index])
+    row_urls = df.loc[rows, 'URL']
+    df.loc[rows, 'Latitude'] = row_urls.map(coordinates['latitude'].round(6))
+    df.loc[rows, 'Longitude'] = row_urls.map(coordinates['longitude'].round(6))
+    df.loc[rows, 'coord_source'] = 'locality'
+    return set(coordinates.index)
+
+
+def _add_results(centroids, localities, results):
+    '''Add fetched (url, latitude, longitude) results to the locality table'''
+    if results:
+        fetched = pd.DataFrame(results, columns=['URL', 'Latitude', 'Longitude']).set_index('URL')
+        centroids.add(fetched.join(localities).reset_index())
+
+
+async def _enrich_rows(df, url_rows, jobs, journal, params, cache):
+    '''Stream fetched coordinates back into df, checkpointing in groups; returns every result'''
+    checkpoint_every = params["checkpoint_every"]
+    fetched = []
+    results = []
+    with tqdm(total=len(jobs), desc="Enriching URLs") as progress:
+        async for url, latitude, longitude in fetch_coordinates(jobs, params):
+            rows = url_rows[url]
+            df.loc[rows, 'Latitude'] = latitude
+            df.loc[rows, 'Longitude'] = longitude
+            fetched.append((url, latitude, longitude))
+            results.append((url, latitude, longitude))
+            if journal is not None:
+                journal.append(url, latitude, longitude)
+            progress.update(1)
+            if len(fetched) == checkpoint_every:
+                _checkpoint(journal, cache, fetched)
+                fetched = []
+    _checkpoint(journal, cache, fetched)
+    return results
+
+
+def _checkpoint(journal, cache, results):
+    if journal is not None:
+        journal.sync()
+    if cache is not None and results:
+        cache.put_many(results)
+
+
+def make_session(params):
+    '''Create a keep-alive client session sized by the enrich params'''
+    connector = aiohttp.TCPConnector(
+        limit=params["concurrency"],
+        limit_per_host=params["limit_per_host"],
+        keepalive_timeout=params["keepalive_timeout"],
+        ttl_dns_cache=300
+    )
+    timeout = aiohttp.ClientTimeout(total=params["timeout"])
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS)
+
+
+async def fetch_coordinates(jobs, params):
+    '''Yield (key, latitude, longitude) for each (key, url) job as it completes.
+
+    At most params["concurrency"] requests are in flight at once; the pool
+    of pooled connections is shared by every request in the run.
+    '''
+    concurrency = params["concurrency"]
+    async with make_session(params) as session:
+        pending = set()
+        for key, url in jobs:
+            pending.add(asyncio.create_task(_fetch_job(session, key, url, params)))
+            if len(pending) >= concurrency:
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    yield task.result()
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                yield task.result()
+
+
+async def _fetch_job(session, key, url, params):
+    latitude, longitude = await fetch_lat_long(session, url, params)
+    return key, latitude, longitude
+
+
+async def fetch_lat_long(session, url, params=DEFAULT_ENRICH_PARAMS):
+    '''Async counterpart of extract_lat_long using a shared session.
+
+    The body is scanned as it arrives and reading stops once both
+    coordinates are found. A short unread remainder (up to drain_limit
+    bytes) is discarded so the keep-alive connection can be reused;
+    anything longer is cheaper to drop along with the connection.
+    '''
+    try:
+        async with session.get(url) as response:
+            if response.status == 200:
+                scanner = CoordinateScanner()
+                async for chunk in response.content.iter_chunked(params["read_chunk_size"]):
+                    if scanner.feed(chunk):
+                        break
+                remaining = (response.content_length or 0) - scanner.bytes_read
+                if scanner.done and 0 < remaining <= params["drain_limit"]:
+                    await response.read()
+                return scanner.result()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.warning(f"Error fetching {url}: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error with {url}: {e}")
+    return None, None
+
+
 def extract_lat_long(url):
     try:
-        header = {
-            'User-Agent': 'Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Mobile Safari/537.36'
-        }
-        response = requests.get(url, headers=header, timeout=10)  # Adding timeout to avoid hanging
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            script_content = soup.find('script', string=lambda text: text and 'window.__PRELOADED_STATE__' in text)
-            if script_content:
-                latitude_start_index = script_content.string.find(r'"latitude\":\"') + len(r'"latitude\":\"')
-                latitude_end_index = script_content.string.find('",', latitude_start_index)
-                latitude = script_content.string[latitude_start_index:latitude_end_index-1]
-
-                longitude_start_index = script_content.string.find(r'"longitude\":\"') + len(r'"longitude\":\"')
-                longitude_end_index = script_content.string.find('",', longitude_start_index)
-                longitude = script_content.string[longitude_start_index:longitude_end_index-1]
-
-                return latitude, longitude
+        # Stream the body so we can stop reading once the coordinates are found
+        with requests.get(url, headers=HEADERS, timeout=10, stream=True) as response:
+            if response.status_code == 200:
+                scanner = CoordinateScanner()
+                for chunk in response.iter_content(chunk_size=DEFAULT_ENRICH_PARAMS["read_chunk_size"]):
+                    if scanner.feed(chunk):
+                        break
+                return scanner.result()
     except (SSLError, ConnectionError) as e:
         print(f"Error fetching {url}: {e}")
     except Exception as e:
         print(f"Unexpected error with {url}: {e}")
-    return None, None
\ No newline at end of file
+    return None, None
@@ -1,29 +1,214 @@
 import os
 import logging
 import pandas as pd
-from .combine import iterate
+import numpy as np
+from .combine import iterate, discover_files, ingest_files, get_ingest_settings, iter_raw_chunks, SeenHashes
 from ..utils.config import load_config
-from .enrich import enrich
-def extract():
+from ..utils.storage import get_storage_params, dataset_exists, read_dataset, write_dataset, iter_dataset, remove_dataset
+from .enrich import enrich, get_enrich_params
+from .cache import open_cache
+from .geocoder import open_centroids
+from .journal import EnrichmentJournal, replay, read_journal, apply_results
+from .manifest import IngestManifest
+
+
+def enrich_frame(df, config, journal_file):
+    '''Enrich df, resuming from and then clearing the journal at journal_file'''
+    # Resume an interrupted run from its journal before fetching anything
+    replay(df, journal_file)
+    enrich_params = get_enrich_params(config)
+    cache = open_cache(config, enrich_params)
+    centroids = open_centroids(config, enrich_params)
+    journal = EnrichmentJournal(journal_file)
+    try:
+        enriched_dataframe = enrich(df, journal, enrich_params, cache, centroids)
+    finally:
+        journal.close()
+        if cache is not None:
+            cache.close()
+        if centroids is not None:
+            centroids.close()
+    return enriched_dataframe, journal
+
+
+def save_enriched(df, config, append=False):
+    '''Write df to the enriched dataset in the configured format, plus the optional CSV export'''
+    storage = get_storage_params(config)
+    output_file = config["file_path"]["enriched_data"]
+    write_dataset(df, output_file, storage["format"], storage["compression"], append=append)
+    if storage["export_csv"] and storage["format"] != "csv":
+        write_dataset(df, output_file, "csv", append=append)
+
+
+def pending_delta_path(config):
+    return os.path.join(config["file_path"]["ingest_state"], "pending_delta")
+
+
+def read_pending(config):
+    '''Rows extracted by earlier incremental runs that no load has confirmed yet, or None'''
+    storage = get_storage_params(config)
+    path = pending_delta_path(config)
+    if not dataset_exists(path, storage["format"]):
+        return None
+    return read_dataset(path, storage["format"], memory_map=storage["memory_map"])
+
+
+def save_pending(df, config):
+    storage = get_storage_params(config)
+    write_dataset(df, pending_delta_path(config), storage["format"], storage["compression"], append=True)
+
+
+def confirm_loaded(config):
+    '''Drop the pending delta once load has written it; call only after load succeeds'''
+    storage = get_storage_params(config)
+    path = pending_delta_path(config)
+    if dataset_exists(path, storage["format"]):
+        remove_dataset(path, storage["format"])
+        logging.info("Pending delta confirmed as loaded")
+
+
+def extract_incremental(config):
+    '''Parse only new or changed raw files and return their unseen rows plus any unconfirmed ones.
+
+    The delta is enriched and appended to the enriched dataset; the manifest
+    is committed only after that append, so a failed run is retried in full.
+    The delta is also kept as the pending delta until confirm_loaded() runs,
+    so when a later stage fails the next run hands the same rows on again
+    instead of finding nothing new.
+    '''
+    raw_data = config["file_path"]["raw_data"]
+    output_file = config["file_path"]["enriched_data"]
+    journal_file = config["file_path"].get("enrich_journal", output_file + ".journal")
+    schema, ingest_params = get_ingest_settings(config)
+
+    manifest = IngestManifest(config["file_path"]["ingest_state"])
+    try:
+        entries = manifest.changed_files(discover_files(raw_data))
+        to_parse = [entry[0] for entry in entries if manifest.needs_parse(entry)]
+        logging.info(f"{len(to_parse)} new or changed raw files to ingest")
+
+        delta, row_hashes = ingest_files(to_parse, schema, ingest_params, manifest.known_row_hashes())
+        logging.info(f"{len(delta)} new rows since the last run")
+        pending = read_pending(config)
+        if len(delta):
+            delta, journal = enrich_frame(delta, config, journal_file)
+            save_enriched(delta, config, append=True)
+            save_pending(delta, config)
+            journal.remove()
+        manifest.commit(entries, row_hashes)
+    finally:
+        manifest.close()
+    if pending is not None:
+        logging.info(f"{len(pending)} rows from earlier runs are not confirmed as loaded; extracting them again")
+        delta = pd.concat([pending, delta], ignore_index=True) if len(delta) else pending
+    return delta
+
+
+def iter_extract(config, chunk_size, full=False):
+    '''Streaming counterpart of extract(): yield enriched rows in chunks of about chunk_size.
+
+    An existing enriched dataset is read back chunk by chunk. Otherwise raw
+    files (only new or changed ones in incremental mode) are parsed in
+    chunks; each chunk is de-duplicated by row hash, enriched and appended
+    to the enriched dataset before it is yielded. In incremental mode the
+    pending delta of earlier runs is yielded first and every new chunk is
+    added to it, as in extract_incremental(). With full, new raw rows are
+    still ingested, but the whole enriched dataset is yielded afterwards
+    instead of the delta.
+    '''
+    raw_data = config["file_path"]["raw_data"]
+    output_file = config["file_path"]["enriched_data"]
+    journal_file = config["file_path"].get("enrich_journal", output_file + ".journal")
+    storage = get_storage_params(config)
+    schema, ingest_params = get_ingest_settings(config)
+    incremental = ingest_params["incremental"]
+    # Without incremental ingest every run already streams the whole dataset
+    full = full and incremental
+
+    if not incremental and dataset_exists(output_file, storage["format"]):
+        logging.info(f"{output_file} exists. Streaming it in chunks of {chunk_size}.")
+        yield from iter_dataset(output_file, storage["format"], chunk_size)
+        return
+
+    manifest = None
+    if incremental:
+        manifest = IngestManifest(config["file_path"]["ingest_state"])
+        entries = manifest.changed_files(discover_files(raw_data))
+        file_paths = [entry[0] for entry in entries if manifest.needs_parse(entry)]
+        seen = SeenHashes(manifest.known_row_hashes())
+    else:
+        file_paths = discover_files(raw_data)
+        seen = SeenHashes()
+    logging.info(f"Streaming {len(file_paths)} raw files in chunks of {chunk_size}")
+
+    journal_results = read_journal(journal_file)
+    enrich_params = get_enrich_params(config)
+    cache = open_cache(config, enrich_params)
+    centroids = open_centroids(config, enrich_params)
+    journal = EnrichmentJournal(journal_file)
+    new_hashes = []
+    try:
+        if incremental and not full and dataset_exists(pending_delta_path(config), storage["format"]):
+            logging.info("Extracting the rows of earlier runs not confirmed as loaded first")
+            yield from iter_dataset(pending_delta_path(config), storage["format"], chunk_size)
+        for chunk, hashes in iter_raw_chunks(file_paths, schema, chunk_size, seen):
+            if chunk.empty:
+                continue
+            apply_results(chunk, journal_results)
+            chunk = enrich(chunk, journal, enrich_params, cache, centroids)
+            save_enriched(chunk, config, append=incremental or bool(new_hashes))
+            if incremental:
+                save_pending(chunk, config)
+            new_hashes.append(hashes)
+            if not full:
+                yield chunk
+
+        journal.remove()
+        if manifest is not None:
+            row_hashes = np.concatenate(new_hashes) if new_hashes else np.empty(0, dtype=np.uint64)
+            manifest.commit(entries, row_hashes)
+    finally:
+        journal.close()
+        if cache is not None:
+            cache.close()
+        if centroids is not None:
+            centroids.close()
+        if manifest is not None:
+            manifest.close()
+    if full:
+        logging.info(f"Full run: streaming all of {output_file}")
+        yield from iter_dataset(output_file, storage["format"], chunk_size)
+
+
+def extract(full=False):
+    '''Extract the enriched rows: the delta in incremental mode, or with full the whole enriched dataset'''
 
     config=load_config()
     raw_data =config["file_path"]["raw_data"]
-    initial_data=config["file_path"]["initial_data"]
     output_file=config["file_path"]["enriched_data"]
+    journal_file=config["file_path"].get("enrich_journal", output_file + ".journal")
+    storage = get_storage_params(config)
     print(output_file,os.getcwd())
 
     try:
-        
-        if os.path.exists(output_file):
-            logging.info(f"{output_file} exists. Loading DataFrame from CSV.")
+        if config["params"].get("ingest", {}).get("incremental", False):
+            combined_dataframe = extract_incremental(config)
+            if full:
+                logging.info(f"Full run: extracting all of {output_file}")
+                combined_dataframe = read_dataset(output_file, storage["format"], memory_map=storage["memory_map"])
+
+        elif dataset_exists(output_file, storage["format"]):
+            logging.info(f"{output_file} exists. Loading DataFrame from {storage['format']}.")
             print("filefound")
-            combined_dataframe = pd.read_csv(output_file)
+            combined_dataframe = read_dataset(output_file, storage["format"], memory_map=storage["memory_map"])
            
         else:
             logging.info(f"{output_file} does not exist. Creating DataFrame from CSV files in directory.")
             combined_dataframe = iterate(raw_data)
-            enriched_dataframe= enrich(combined_dataframe,output_file)
-            enriched_dataframe.to_csv(output_file, index=False)
+            enriched_dataframe, journal = enrich_frame(combined_dataframe, config, journal_file)
+            # Compact: write the enriched dataset once, then drop the journal
+            save_enriched(enriched_dataframe, config)
+            journal.remove()
             
         
         logging.info("Merging the CSV files complete")
@@ -31,4 +216,5 @@ def extract():
 
     except Exception as e:
         logging.error(f"An error occurred: {e}")
-        print(f"An error occurred: {e}")
\ No newline at end of file
+        print(f"An error occurred: {e}")
+        raise
@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import logging
+import numpy as np
+import pandas as pd
+from ..utils.config import load_config
+from ..utils.storage import get_storage_params, iter_dataset
+
+EARTH_RADIUS_KM = 6371.0088
+POLICIES = ("off", "prefer", "fallback")
+
+
+def locality_keys(df):
+    '''(city, region) keys of df's rows, normalised; None where either is missing'''
+    city = df["CITY"].astype("string").str.strip().str.casefold()
+    region = df["REGION"].astype("string").str.strip().str.casefold()
+    missing = city.isna() | region.isna() | (city == "") | (region == "")
+    return city.mask(missing), region.mask(missing)
+
+
+class LocalityCentroids:
+    '''Offline (CITY, REGION) -> coordinates lookup built from enriched rows.
+
+    One row per locality keeps the count and the sums of latitude,
+    longitude and their squares, so new observations are merged with an
+    upsert and the centroid and spread (RMS distance from the centroid, in
+    km) are derived on read. The sums are in degrees; the variance they
+    give for a locality a few km across is far above float64 rounding.
+    The hashes of the URLs observed so far are kept in locality_urls, so
+    each URL counts once however often its rows are seen again.
+    '''
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS locality_centroids ("
+            "city TEXT, region TEXT, n INTEGER, sum_lat REAL, sum_lon REAL, sum_lat2 REAL, sum_lon2 REAL, "
+            "PRIMARY KEY (city, region))"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS locality_urls (url_hash INTEGER PRIMARY KEY)")
+        self.conn.commit()
+
+    def _unseen(self, urls):
+        '''Mask of urls (unique) not observed before; records them as observed'''
+        hashes = pd.util.hash_pandas_object(urls, index=False).to_numpy().view(np.int64)
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS batch_urls (url_hash INTEGER PRIMARY KEY)")
+        self.conn.execute("DELETE FROM batch_urls")
+        self.conn.executemany("INSERT INTO batch_urls VALUES (?)", ((int(h),) for h in hashes))
+        seen = {row[0] for row in self.conn.execute(
+            "SELECT url_hash FROM batch_urls WHERE url_hash IN (SELECT url_hash FROM locality_urls)"
+        )}
+        self.conn.execute("INSERT OR IGNORE INTO locality_urls SELECT url_hash FROM batch_urls")
+        return ~np.isin(hashes, np.fromiter(seen, dtype=np.int64, count=len(seen)))
+
+    def add(self, df):
+        '''Merge the rows of df (URL, CITY, REGION, Latitude, Longitude) with valid coordinates
+        and a URL not observed before; returns their count'''
+        city, region = locality_keys(df)
+        latitude = pd.to_numeric(df["Latitude"], errors="coerce")
+        longitude = pd.to_numeric(df["Longitude"], errors="coerce")
+        valid = city.notna() & latitude.between(-90, 90) & longitude.between(-180, 180)
+        valid &= ~df["URL"].duplicated()
+        if valid.any():
+            valid[valid] = self._unseen(df.loc[valid, "URL"].astype(str))
+        if not valid.any():
+            self.conn.commit()
+            return 0
+        observations = pd.DataFrame({
+            "city": city[valid], "region": region[valid], "n": 1, "sum_lat": latitude[valid],
+            "sum_lon": longitude[valid], "sum_lat2": latitude[valid] ** 2, "sum_lon2": longitude[valid] ** 2,
+        })
+        sums = observations.groupby(["city", "region"], sort=False).sum().reset_index()
+        self.conn.executemany(
+            "INSERT INTO locality_centroids (city, region, n, sum_lat, sum_lon, sum_lat2, sum_lon2) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (city, region) DO UPDATE SET "
+            "n = n + excluded.n, sum_lat = sum_lat + excluded.sum_lat, sum_lon = sum_lon + excluded.sum_lon, "
+            "sum_lat2 = sum_lat2 + excluded.sum_lat2, sum_lon2 = sum_lon2 + excluded.sum_lon2",
+            sums.itertuples(index=False, name=None)
+        )
+        self.conn.commit()
+        return int(valid.sum())
+
+    def table(self):
+        '''Every locality with its n, centroid latitude/longitude and spread_km'''
+        df = pd.read_sql("SELECT * FROM locality_centroids", self.conn)
+        latitude, longitude = df["sum_lat"] / df["n"], df["sum_lon"] / df["n"]
+        var_lat = (df["sum_lat2"] / df["n"] - latitude ** 2).clip(lower=0)
+        var_lon = (df["sum_lon2"] / df["n"] - longitude ** 2).clip(lower=0)
+        spread = np.sqrt(var_lat + np.cos(np.radians(latitude)) ** 2 * var_lon)
+        return pd.DataFrame({
+            "city": df["city"], "region": df["region"], "n": df["n"], "latitude": latitude,
+            "longitude": longitude, "spread_km": np.radians(spread) * EARTH_RADIUS_KM,
+        })
+
+    def lookup(self, df, min_samples=3, max_spread_km=1.0):
+        '''Centroid (latitude, longitude) for each row of df (CITY, REGION), aligned to its index.
+
+        Rows whose locality is unknown, has fewer than min_samples
+        observations or a spread above max_spread_km get NaN.
+        '''
+        centroids = self.table()
+        centroids = centroids[(centroids["n"] >= min_samples) & (centroids["spread_km"] <= max_spread_km)]
+        city, region = locality_keys(df)
+        keys = pd.DataFrame({"city": city, "region": region}, index=df.index)
+        matched = keys.merge(centroids, on=["city", "region"], how="left")
+        matched.index = df.index
+        return matched[["latitude", "longitude"]]
+
+    def clear(self):
+        self.conn.execute("DELETE FROM locality_centroids")
+        self.conn.execute("DELETE FROM locality_urls")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def open_centroids(config, params):
+    '''Open the locality table configured under file_path.locality_centroids, or None if the policy is off'''
+    path = config["file_path"].get("locality_centroids")
+    policy = params.get("locality_policy", "off")
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown locality_policy {policy!r}; expected one of {POLICIES}")
+    if not path or policy == "off":
+        return None
+    return LocalityCentroids(path)
+
+
+def rebuild_centroids(config, chunk_size=500000):
+    '''Rebuild the locality table from the whole enriched dataset, one observation per URL; returns the URLs used.
+
+    Rows whose coord_source is "locality" were filled from the table and
+    are skipped. Enriched data from before coord_source was recorded
+    should have been written with locality_policy off, or its centroid
+    fills count as observations of their own centroid.
+    '''
+    storage = get_storage_params(config)
+    centroids = LocalityCentroids(config["file_path"]["locality_centroids"])
+    try:
+        centroids.clear()
+        rows = 0
+        for chunk in iter_dataset(config["file_path"]["enriched_data"], storage["format"], chunk_size):
+            if "coord_source" in chunk.columns:
+                chunk = chunk[chunk["coord_source"] != "locality"]
+            rows += centroids.add(chunk)
+        logging.info(f"Locality centroids rebuilt from {rows} enriched URLs: {len(centroids.table())} localities")
+    finally:
+        centroids.close()
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    rebuild_centroids(load_config())
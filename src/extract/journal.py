@@ -0,0 +1,78 @@
+import os
+import json
+import logging
+
+
+class EnrichmentJournal:
+    '''Append-only log of enrichment results, one JSON line per fetched URL.
+
+    Records are buffered and fsynced in groups via sync(), so a crash loses
+    at most the last unsynced group. replay() fills a frame from the journal
+    of an interrupted run; a torn final line is ignored.
+    '''
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def append(self, url, latitude, longitude):
+        self._file.write(json.dumps([url, latitude, longitude], separators=(",", ":")))
+        self._file.write("\n")
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def remove(self):
+        '''Delete the journal once its results are compacted into the enriched dataset'''
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def read_journal(path):
+    '''Return {url: (latitude, longitude)} for successful records in the journal'''
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            try:
+                url, latitude, longitude = json.loads(line)
+            except ValueError:
+                logging.warning(f"Skipping unreadable record {line_number} in {path}")
+                continue
+            if latitude is not None and longitude is not None:
+                results[url] = (latitude, longitude)
+    return results
+
+
+def replay(df, path):
+    '''Fill null Latitude/Longitude in df from the journal at path; returns rows filled'''
+    results = read_journal(path)
+    filled = apply_results(df, results)
+    if results:
+        logging.info(f"Replayed {len(results)} journal records onto {filled} rows from {path}")
+    return filled
+
+
+def apply_results(df, results):
+    '''Fill null Latitude/Longitude in df from a {url: (latitude, longitude)} mapping'''
+    if not results:
+        return 0
+    missing = df['Latitude'].isnull() & df['Longitude'].isnull()
+    urls = df.loc[missing, 'URL']
+    found = urls[urls.isin(results.keys())]
+    df[['Latitude', 'Longitude']] = df[['Latitude', 'Longitude']].astype(object)
+    df.loc[found.index, 'Latitude'] = found.map(lambda url: results[url][0])
+    df.loc[found.index, 'Longitude'] = found.map(lambda url: results[url][1])
+    return len(found)
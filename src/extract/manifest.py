@@ -0,0 +1,94 @@
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import numpy as np
+
+
+def file_content_hash(file_path, block_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    '''Record of which raw files and rows earlier runs have already ingested.
+
+    raw_files keeps path, size, mtime and content hash per file; a file is
+    re-parsed only when it is new or its content hash changed (size/mtime
+    are checked first so unchanged files are never re-hashed). The 64-bit
+    row hashes of every ingested row are kept sorted in row_hashes.npy so a
+    new run can drop rows it has seen before. Files that disappear from the
+    raw folder are left in the manifest; their rows stay loaded.
+
+    Nothing is persisted until commit(), which callers run only once the
+    delta has been written downstream.
+    '''
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.hash_path = os.path.join(directory, "row_hashes.npy")
+        self.conn = sqlite3.connect(os.path.join(directory, "manifest.sqlite"))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS raw_files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, content_hash TEXT, ingested_at REAL)"
+        )
+        self.conn.commit()
+        self._known_hashes = None
+        self._previous_hashes = {}
+
+    def changed_files(self, file_paths):
+        '''Return manifest entries (path, size, mtime_ns, content_hash) for new or changed files.
+
+        Files whose content is unchanged but whose size/mtime moved are
+        included with their existing hash so commit() refreshes the stats.
+        The caller filters those out with needs_parse().
+        '''
+        recorded = {
+            path: (size, mtime_ns, content_hash)
+            for path, size, mtime_ns, content_hash in self.conn.execute(
+                "SELECT path, size, mtime_ns, content_hash FROM raw_files"
+            )
+        }
+        entries = []
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            previous = recorded.get(file_path)
+            if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns:
+                continue
+            entries.append((file_path, stat.st_size, stat.st_mtime_ns, file_content_hash(file_path)))
+        self._previous_hashes = {path: content_hash for path, (_, _, content_hash) in recorded.items()}
+        return entries
+
+    def needs_parse(self, entry):
+        return self._previous_hashes.get(entry[0]) != entry[3]
+
+    def known_row_hashes(self):
+        if self._known_hashes is None:
+            if os.path.exists(self.hash_path):
+                self._known_hashes = np.load(self.hash_path)
+            else:
+                self._known_hashes = np.empty(0, dtype=np.uint64)
+        return self._known_hashes
+
+    def commit(self, entries, new_row_hashes):
+        '''Persist the ingested file entries and merge their row hashes into the seen set'''
+        if len(new_row_hashes):
+            merged = np.union1d(self.known_row_hashes(), np.asarray(new_row_hashes, dtype=np.uint64))
+            tmp_path = self.hash_path + ".tmp.npy"
+            np.save(tmp_path, merged)
+            os.replace(tmp_path, self.hash_path)
+            self._known_hashes = merged
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO raw_files (path, size, mtime_ns, content_hash, ingested_at) VALUES (?, ?, ?, ?, ?)",
+            [(path, size, mtime_ns, content_hash, now) for path, size, mtime_ns, content_hash in entries]
+        )
+        self.conn.commit()
+        logging.info(f"Manifest updated: {len(entries)} files, {len(new_row_hashes)} new row hashes")
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,123 @@
+import logging
+import pandas as pd
+from sqlalchemy import create_engine
+from ..utils.config import load_config
+from ..utils.db_utils import table_ddl, table_exists, _sqlite_rows
+from .delta import WATERMARK_TABLE, CHANGES_TABLE, load_watermark
+
+AGGREGATE_WATERMARK_TABLE = "aggregate_watermark"
+
+
+def aggregate_sql(definition, config, where, changes=False):
+    '''SELECT of a definition's group-by and measure columns, joined to both dimensions.
+
+    Rows come from fact_table, or with changes from the logged previous
+    versions in fact_changes, which hold the previous measures (including
+    the dimension ids and RATING_TYPE) of their fact.
+    '''
+    location_columns = set(config['params']['location_dimension_table_columns'])
+    fact_columns = set(config['params']['fact_table_1_columns'])
+    group_by = [f'{"f" if col in fact_columns else "l" if col in location_columns else "r"}."{col}"'
+                for col in definition["group_by"]]
+    measures = [f'f."{col}"' for col in definition["measures"]]
+    source = f"{CHANGES_TABLE} f" if changes else "fact_table f"
+    return (
+        f"SELECT {', '.join(group_by + measures)} FROM {source} "
+        f"JOIN restaurant_dimension_table r ON r.id = f.restaurant_id "
+        f"JOIN location_dimension_table l ON l.id = f.location_id "
+        f"WHERE {where}"
+    )
+
+
+def partial_aggregates(rows, definition, sign=1):
+    '''fact_count plus per-measure sum and non-null count of rows, by the group-by columns'''
+    group_by = list(definition["group_by"])
+    parts = rows[group_by].copy()
+    parts["fact_count"] = sign
+    for col in definition["measures"]:
+        values = pd.to_numeric(rows[col], errors='coerce')
+        parts[f"{col}_sum"] = values.fillna(0) * sign
+        parts[f"{col}_count"] = values.notnull().astype(int) * sign
+    return parts.groupby(group_by, dropna=False, observed=True, sort=False).sum().reset_index()
+
+
+def refresh_aggregate(conn, engine, name, definition, config):
+    '''Bring the aggregate table name up to the latest load; returns the number of groups.
+
+    Only facts stamped with a load after the table's watermark are read;
+    facts those loads updated are first retracted using the version logged
+    in fact_changes, so every measure stays an exact sum/count. Averages
+    are recomputed from them. The table and its watermark are replaced in
+    one transaction, so an interrupted refresh is simply redone.
+    '''
+    group_by = list(definition["group_by"])
+    row = conn.execute(f"SELECT load_id FROM {AGGREGATE_WATERMARK_TABLE} WHERE name = ?", (name,)).fetchone()
+    watermark = row[0] if row and table_exists(conn, name) else 0
+    latest = conn.execute(f"SELECT MAX(load_id) FROM {WATERMARK_TABLE}").fetchone()[0] or 0
+    if latest <= watermark:
+        logging.info(f"{name} is up to date at load {watermark}")
+        return None
+
+    added = pd.read_sql(aggregate_sql(definition, config, f"f.load_id > {watermark}"), con=engine)
+    deltas = [partial_aggregates(added, definition)]
+    retracted = pd.DataFrame()
+    if table_exists(conn, CHANGES_TABLE):
+        # The earliest change of each fact after the watermark holds the version counted at the watermark
+        retracted = pd.read_sql(aggregate_sql(
+            definition, config,
+            f"f.rowid IN (SELECT MIN(rowid) FROM {CHANGES_TABLE} WHERE load_id > {watermark} GROUP BY fact_id) "
+            f"AND f.prev_load_id <= {watermark}",
+            changes=True
+        ), con=engine)
+        deltas.append(partial_aggregates(retracted, definition, sign=-1))
+    if watermark:
+        current = pd.read_sql(f"SELECT * FROM {name}", con=engine)
+        deltas.append(current.drop(columns=[f"{col}_avg" for col in definition["measures"]]))
+
+    totals = pd.concat(deltas, ignore_index=True).groupby(group_by, dropna=False, sort=True).sum().reset_index()
+    totals = totals[totals["fact_count"] > 0].reset_index(drop=True)
+    for col in definition["measures"]:
+        totals[f"{col}_avg"] = totals[f"{col}_sum"] / totals[f"{col}_count"].where(totals[f"{col}_count"] > 0)
+
+    columns = list(totals.columns)
+    column_list = ", ".join(f'"{col}"' for col in columns)
+    conn.execute("BEGIN")
+    conn.execute(f"DROP TABLE IF EXISTS {name}")
+    conn.execute(table_ddl(name, totals, config['params']['dtype_mapping']))
+    conn.executemany(f"INSERT INTO {name} ({column_list}) VALUES ({', '.join('?' * len(columns))})", _sqlite_rows(totals))
+    conn.execute(
+        f"INSERT OR REPLACE INTO {AGGREGATE_WATERMARK_TABLE} (name, load_id) VALUES (?, ?)", (name, latest)
+    )
+    conn.commit()
+    logging.info(f"{name}: {len(added)} facts added, {len(retracted)} retracted since load {watermark}; "
+                 f"{len(totals)} groups at load {latest}")
+    return len(totals)
+
+
+def aggregate():
+    '''Refresh the aggregate tables in params.aggregates from the loads since their last refresh'''
+    config = load_config()
+    definitions = config['params'].get('aggregates', {})
+    engine = create_engine(config["file_path"]["main_db"])
+    conn = engine.raw_connection()
+    try:
+        if not load_watermark(conn):
+            logging.warning("No finished upsert load in main_db; aggregate tables need load mode 'upsert'.")
+            return
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {AGGREGATE_WATERMARK_TABLE} (name TEXT PRIMARY KEY, load_id INTEGER)")
+        conn.commit()
+        for name, definition in definitions.items():
+            refresh_aggregate(conn, engine, name, definition, config)
+
+        if definitions and table_exists(conn, CHANGES_TABLE):
+            # Change rows every aggregate has consumed are no longer needed
+            consumed = conn.execute(
+                f"SELECT MIN(load_id), COUNT(*) FROM {AGGREGATE_WATERMARK_TABLE} WHERE name IN ({', '.join('?' * len(definitions))})",
+                list(definitions)
+            ).fetchone()
+            if consumed[1] == len(definitions):
+                conn.execute(f"DELETE FROM {CHANGES_TABLE} WHERE load_id <= ?", (consumed[0],))
+                conn.commit()
+    finally:
+        conn.close()
+    logging.info("Aggregation completed.")
@@ -0,0 +1,212 @@
+import json
+import logging
+import numpy as np
+import pandas as pd
+from ..utils.db_utils import table_exists
+from .dimensions import natural_key_hashes
+
+DEFAULT_LOAD_PARAMS = {
+    "mode": "append",
+    "max_runs": 16,
+    "fact_key": ["URL", "CUSINE_CATEGORY"]
+}
+
+WATERMARK_TABLE = "load_watermark"
+CHANGES_TABLE = "fact_changes"
+SCHEME_TABLE = "fact_key_scheme"
+
+
+def get_load_params(config):
+    params = dict(DEFAULT_LOAD_PARAMS)
+    params.update(config["params"].get("load", {}))
+    return params
+
+
+def content_hashes(df, columns):
+    '''Signed 64-bit hash of each row's measure columns.
+
+    Numeric columns are hashed as float64 so a fact compares equal whether
+    its VOTES arrived as an integer or a float column.
+    '''
+    values = df[list(columns)].copy()
+    for col in values.columns:
+        if pd.api.types.is_numeric_dtype(values[col]) and not pd.api.types.is_bool_dtype(values[col]):
+            values[col] = values[col].astype(float)
+    return natural_key_hashes(values, values.columns)
+
+
+class FactKeys:
+    '''Fact ids and content hashes of the loaded facts, keyed by fact key.
+
+    A fact's key is the hash of its key columns (params.load.fact_key, by
+    default the listing: URL and CUSINE_CATEGORY); its row_hash covers the
+    measure columns, including the dimension ids, so a listing whose
+    restaurant or location attributes change is updated, not duplicated.
+    The key columns are recorded in fact_key_scheme: facts keyed another
+    way cannot be matched, so opening them raises instead. diff() splits
+    incoming facts into new ones, changed ones and unchanged ones; one
+    FactKeys serves one load, so facts from first_id on are its own. The
+    lookup is held as a few (keys, ids, hashes) runs, like SeenHashes, so
+    adding a chunk's new facts does not copy everything loaded so far.
+    '''
+
+    def __init__(self, conn, table_name, key_columns, measure_columns, max_runs=16):
+        self.table_name = table_name
+        self.key_columns = list(key_columns)
+        self.measure_columns = list(measure_columns)
+        self.max_runs = max_runs
+        existing = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+        missing = [col for col in ("fact_key", "row_hash", "load_id") if col not in existing]
+        if existing and missing:
+            # Facts appended before delta loading have no key and will not be matched
+            for col in missing:
+                conn.execute(f"ALTER TABLE {table_name} ADD COLUMN {col} INTEGER")
+            conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_fact_key ON {table_name}(fact_key)")
+            conn.commit()
+            logging.warning(f"Added {missing} to {table_name}; its existing rows will not be matched")
+
+        self._check_scheme(conn, bool(existing))
+
+        rows = conn.execute(
+            f"SELECT fact_key, fact_id, row_hash FROM {table_name} WHERE fact_key IS NOT NULL"
+        ).fetchall() if existing else []
+        loaded = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        self.runs = [(pd.Index(loaded[:, 0]), loaded[:, 1], loaded[:, 2])] if len(loaded) else []
+        max_id = conn.execute(f"SELECT MAX(fact_id) FROM {table_name}").fetchone()[0] if existing else None
+        self.next_id = (max_id or 0) + 1
+        self.first_id = self.next_id
+
+    def _check_scheme(self, conn, existing):
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {SCHEME_TABLE} (table_name TEXT PRIMARY KEY, key_columns TEXT)")
+        row = conn.execute(f"SELECT key_columns FROM {SCHEME_TABLE} WHERE table_name = ?", (self.table_name,)).fetchone()
+        if row is None:
+            keyed = existing and conn.execute(
+                f"SELECT 1 FROM {self.table_name} WHERE fact_key IS NOT NULL LIMIT 1"
+            ).fetchone() is not None
+            if keyed:
+                raise ValueError(f"{self.table_name} has facts keyed on their dimension ids, not {self.key_columns}; "
+                                 "rebuild main_db (delete it and rerun with --force) to load them by listing")
+            conn.execute(f"INSERT INTO {SCHEME_TABLE} (table_name, key_columns) VALUES (?, ?)",
+                         (self.table_name, json.dumps(self.key_columns)))
+            conn.commit()
+        elif json.loads(row[0]) != self.key_columns:
+            raise ValueError(f"{self.table_name} has facts keyed on {json.loads(row[0])}, not {self.key_columns}; "
+                             "rebuild main_db (delete it and rerun with --force) to change params.load.fact_key")
+
+    def __len__(self):
+        return sum(len(keys) for keys, _, _ in self.runs)
+
+    def latest(self, df):
+        '''df with a fact_key column and only the last row of each fact.
+
+        Earlier rows of a fact are dropped, and the drop count is logged. Do
+        this before the dimension ids are assigned, so the dropped rows do
+        not add dimension rows that no fact references.
+        '''
+        missing = [col for col in self.key_columns if col not in df.columns]
+        if missing:
+            raise ValueError(f"Fact key columns {missing} are not in the data")
+        df = df.assign(fact_key=natural_key_hashes(df, self.key_columns))
+        duplicated = df["fact_key"].duplicated(keep="last")
+        if duplicated.any():
+            logging.info(f"{self.table_name}: {int(duplicated.sum())} rows repeat a fact later in the batch; keeping the last")
+            df = df[~duplicated]
+        return df
+
+    def diff(self, df):
+        '''Return (inserts, updates, unchanged) for the facts in df.
+
+        inserts and updates are df's rows with fact_id, fact_key and
+        row_hash columns added; new facts get fresh fact_ids. Repeated facts
+        are reduced to their last row as in latest(). A fact this load
+        inserted from an earlier chunk is still an insert: when it changed
+        it is among the updates (fact_id >= first_id), and it is never
+        counted as unchanged.
+        '''
+        df = self.latest(df) if "fact_key" not in df.columns else df
+        df = df.assign(row_hash=content_hashes(df, self.measure_columns))
+        keys = df["fact_key"].to_numpy()
+        hashes = df["row_hash"].to_numpy()
+
+        found = np.zeros(len(df), dtype=bool)
+        changed = np.zeros(len(df), dtype=bool)
+        fact_ids = np.zeros(len(df), dtype=np.int64)
+        for run_keys, run_ids, run_hashes in self.runs:
+            positions = run_keys.get_indexer(keys)
+            hit = positions >= 0
+            fact_ids[hit] = run_ids[positions[hit]]
+            run_changed = hit & (run_hashes[np.where(hit, positions, 0)] != hashes)
+            run_hashes[positions[run_changed]] = hashes[run_changed]
+            found |= hit
+            changed |= run_changed
+
+        new = ~found
+        fact_ids[new] = np.arange(self.next_id, self.next_id + new.sum())
+        self.next_id += int(new.sum())
+        if new.any():
+            self.runs.append((pd.Index(keys[new]), fact_ids[new], hashes[new].copy()))
+            if len(self.runs) > self.max_runs:
+                run_keys, run_ids, run_hashes = zip(*self.runs)
+                self.runs = [(
+                    pd.Index(np.concatenate([run.to_numpy() for run in run_keys])),
+                    np.concatenate(run_ids),
+                    np.concatenate(run_hashes)
+                )]
+
+        df.insert(0, "fact_id", fact_ids)
+        unchanged = found & ~changed & (fact_ids < self.first_id)
+        return df[new], df[changed], int(unchanged.sum())
+
+
+def record_changes(conn, table_name, fact_ids, load_id, measure_columns, batch_size=50000):
+    '''Copy the current measures of fact_ids into the change log before they are updated.
+
+    Each change row keeps the fact's previous load_id, so consumers such as
+    the aggregate tables can retract exactly the versions they counted.
+    '''
+    columns = ", ".join(f'"{col}"' for col in measure_columns)
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (load_id INTEGER, fact_id INTEGER, prev_load_id INTEGER, {columns})"
+    )
+    insert_sql = (
+        f"INSERT INTO {CHANGES_TABLE} (load_id, fact_id, prev_load_id, {columns}) "
+        f"SELECT ?, fact_id, load_id, {columns} FROM {table_name} WHERE fact_id = ?"
+    )
+    fact_ids = [int(fact_id) for fact_id in fact_ids]
+    for start in range(0, len(fact_ids), batch_size):
+        conn.execute("BEGIN")
+        conn.executemany(insert_sql, ((load_id, fact_id) for fact_id in fact_ids[start:start + batch_size]))
+        conn.commit()
+
+
+def begin_load(conn):
+    '''Open a load run in the watermark table and return its load_id'''
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} ("
+        "load_id INTEGER PRIMARY KEY, started_at TEXT, finished_at TEXT, "
+        "inserted INTEGER, updated INTEGER, unchanged INTEGER)"
+    )
+    load_id = conn.execute(
+        f"INSERT INTO {WATERMARK_TABLE} (started_at) VALUES (CURRENT_TIMESTAMP)"
+    ).lastrowid
+    conn.commit()
+    return load_id
+
+
+def end_load(conn, load_id, inserted, updated, unchanged):
+    '''Mark load_id finished; facts with load_id up to the watermark are complete'''
+    conn.execute(
+        f"UPDATE {WATERMARK_TABLE} SET finished_at = CURRENT_TIMESTAMP, inserted = ?, updated = ?, unchanged = ? "
+        "WHERE load_id = ?",
+        (inserted, updated, unchanged, load_id)
+    )
+    conn.commit()
+    logging.info(f"Load {load_id}: {inserted} facts inserted, {updated} updated, {unchanged} unchanged")
+
+
+def load_watermark(conn):
+    '''load_id of the last finished load, or 0 before the first one'''
+    if not table_exists(conn, WATERMARK_TABLE):
+        return 0
+    row = conn.execute(f"SELECT MAX(load_id) FROM {WATERMARK_TABLE} WHERE finished_at IS NOT NULL").fetchone()
+    return row[0] or 0
@@ -0,0 +1,136 @@
+import json
+import logging
+import numpy as np
+import pandas as pd
+from ..utils.pd_utils import row_hashes
+
+SCHEME_TABLE = "dimension_key_scheme"
+# Bumped when natural_key_hashes changes, so stored key hashes are recomputed
+KEY_HASH_VERSION = 2
+
+
+def natural_key_hashes(df, columns):
+    '''Signed 64-bit hash of each row's natural-key columns.
+
+    Categorical and string columns are hashed as their values so a key
+    hashes the same whether it arrives typed (streaming) or as plain text
+    (staging reload), and every missing value (NaN from CSV, None from
+    parquet or SQLite, pd.NA) is hashed as None.
+    '''
+    keys = df[list(columns)].copy()
+    for col in keys.columns:
+        if not pd.api.types.is_numeric_dtype(keys[col]) or isinstance(keys[col].dtype, pd.CategoricalDtype):
+            values = keys[col].astype(object)
+            keys[col] = values.where(values.notna(), None)
+        elif pd.api.types.is_extension_array_dtype(keys[col]) and not pd.api.types.is_bool_dtype(keys[col]):
+            # Nullable Int64/Float64 hash like the float64 NaN columns they arrive as elsewhere
+            keys[col] = keys[col].astype(float)
+    return row_hashes(keys).view(np.int64)
+
+
+class DimensionKeys:
+    '''Surrogate keys of one dimension table, keyed by natural-key hash.
+
+    The {key_hash: id} lookup is read from the dimension table's key_hash
+    column once, so ids stay stable across runs: a natural key loaded
+    earlier maps to the same id, and only unseen keys get new ids
+    (continuing after the largest id in the table). key_frame(df, columns),
+    if given, returns the values hashed in place of df[columns], e.g. with
+    approximate values masked; the rows stored keep df's values.
+
+    Key columns the table lacks are added, filled from backfill
+    ({column: (SQL type, SQL expression)}, NULL otherwise). When the key
+    columns or KEY_HASH_VERSION differ from those recorded in
+    dimension_key_scheme, the stored key hashes are recomputed from the
+    rows, so existing ids keep matching and their facts are not rewritten.
+    '''
+
+    def __init__(self, conn, table_name, columns, key_frame=None, backfill=None):
+        self.table_name = table_name
+        self.columns = list(columns)
+        self.key_frame = key_frame
+        existing = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+        if existing and "key_hash" not in existing:
+            # Tables from before key hashing had one row per fact row; those ids are not reused
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN key_hash INTEGER")
+            conn.commit()
+            logging.warning(f"Added key_hash to {table_name}; its existing rows will not be matched")
+        if existing:
+            self._migrate(conn, existing, backfill or {})
+        self.lookup = {}
+        self.next_id = 1
+        if existing:
+            self.lookup = dict(conn.execute(f"SELECT key_hash, id FROM {table_name} WHERE key_hash IS NOT NULL"))
+            self.next_id = (conn.execute(f"SELECT MAX(id) FROM {table_name}").fetchone()[0] or 0) + 1
+        self.first_id = self.next_id
+
+    def _migrate(self, conn, existing, backfill):
+        added = [col for col in self.columns if col not in existing]
+        for col in added:
+            sql_type, expression = backfill.get(col, ("TEXT", "NULL"))
+            conn.execute(f'ALTER TABLE {self.table_name} ADD COLUMN "{col}" {sql_type}')
+            conn.execute(f'UPDATE {self.table_name} SET "{col}" = {expression}')
+            logging.warning(f"Added {col} to {self.table_name} and filled it with {expression}")
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {SCHEME_TABLE} (table_name TEXT PRIMARY KEY, key_columns TEXT, version INTEGER)")
+        scheme = (json.dumps(self.columns), KEY_HASH_VERSION)
+        row = conn.execute(f"SELECT key_columns, version FROM {SCHEME_TABLE} WHERE table_name = ?", (self.table_name,)).fetchone()
+        if row is None or tuple(row) != scheme:
+            self._rehash(conn)
+            conn.execute(f"INSERT OR REPLACE INTO {SCHEME_TABLE} (table_name, key_columns, version) VALUES (?, ?, ?)",
+                         (self.table_name, *scheme))
+        conn.commit()
+
+    def _rehash(self, conn):
+        '''Recompute the key_hash of every stored row from its key columns'''
+        columns = ", ".join(f'"{col}"' for col in self.columns)
+        cursor = conn.execute(f"SELECT id, {columns} FROM {self.table_name}")
+        df = pd.DataFrame(cursor.fetchall(), columns=[description[0] for description in cursor.description])
+        if df.empty:
+            return
+        keys = df if self.key_frame is None else self.key_frame(df, self.columns)
+        hashes = natural_key_hashes(keys, self.columns)
+        conn.executemany(f"UPDATE {self.table_name} SET key_hash = ? WHERE id = ?",
+                         zip(hashes.tolist(), df["id"].tolist()))
+        logging.info(f"Recomputed the key hashes of {len(df)} {self.table_name} rows for key {self.columns}")
+
+    def __len__(self):
+        return len(self.lookup)
+
+    def drop_unreferenced(self, conn, fact_table, id_column):
+        '''Delete the rows inserted since this DimensionKeys was opened that no fact references.
+
+        A fact repeated in a later chunk is rewritten with that chunk's ids,
+        so the dimension rows of its earlier version can be left unused.
+        '''
+        stale = [row[0] for row in conn.execute(
+            f"SELECT id FROM {self.table_name} WHERE id >= ? "
+            f"AND id NOT IN (SELECT {id_column} FROM {fact_table} WHERE {id_column} >= ?)",
+            (self.first_id, self.first_id)
+        )]
+        if stale:
+            conn.executemany(f"DELETE FROM {self.table_name} WHERE id = ?", ((row_id,) for row_id in stale))
+            conn.commit()
+            dropped = set(stale)
+            self.lookup = {key: row_id for key, row_id in self.lookup.items() if row_id not in dropped}
+            logging.info(f"{self.table_name}: dropped {len(stale)} rows of this load that no fact references")
+
+    def assign(self, df):
+        '''Return (ids, new_rows): the surrogate id of every row of df, and the
+        dimension rows (id, key_hash and the key columns) for keys not seen before.
+        '''
+        keys = df if self.key_frame is None else self.key_frame(df, self.columns)
+        hashes = pd.Series(natural_key_hashes(keys, self.columns), index=df.index)
+        ids = hashes.map(self.lookup)
+        missing = ids.isnull()
+        first = missing & ~hashes.duplicated()
+
+        new_rows = df.loc[first, self.columns].copy()
+        new_ids = np.arange(self.next_id, self.next_id + len(new_rows), dtype=np.int64)
+        new_rows.insert(0, "key_hash", hashes[first].to_numpy())
+        new_rows.insert(0, "id", new_ids)
+        self.lookup.update(zip(new_rows["key_hash"].tolist(), new_ids.tolist()))
+        self.next_id += len(new_rows)
+
+        if missing.any():
+            ids[missing] = hashes[missing].map(self.lookup)
+        return ids.astype(np.int64).to_numpy(), new_rows.reset_index(drop=True)
@@ -1,8 +1,17 @@
-import pandas as pd
+import numpy as np
 from sqlalchemy import create_engine
 import logging
 from ..utils.config import load_config
-from ..utils.pd_utils import load_df
+from ..utils.pd_utils import load_df, drop_column
+from ..utils.db_utils import bulk_load, bulk_update, get_bulk_params, create_indexes
+from .dimensions import DimensionKeys
+from .delta import FactKeys, get_load_params, begin_load, end_load, record_changes
+from .spatial import refresh_location_features
+
+DIMENSIONS = (
+    ("restaurant_id", "restaurant_dimension_table", "restaurant_dimension_table_columns"),
+    ("location_id", "location_dimension_table", "location_dimension_table_columns")
+)
 
 def add_auto_increment_ids(data, start_id=1):
     '''Add auto-increment IDs to DataFrame'''
@@ -27,7 +36,7 @@ def process_data(data, start_id=1):
         return add_auto_increment_ids(data, start_id)
 
 
-def load_data_into_table(data, table_name, engine, columns=None):
+def load_data_into_table(data, table_name, engine, columns=None, params=None):
     '''Load data into specified table'''
     #print("columns in data before processing:", data.columns)
     processed_data = process_data(data)
@@ -37,35 +46,157 @@ def load_data_into_table(data, table_name, engine, columns=None):
     #print(columns)
     #print(processed_data.head(3))    
     # Load data into the table
-    processed_data[columns].to_sql(table_name, con=engine, if_exists='append', index=False)
+    bulk_load(engine, processed_data, table_name, columns=list(columns), params=params)
 
 
-def load():
-     
-    config = load_config()
-    db_path = config["file_path"]["staging_db"]
-    engine = create_engine(db_path)
-    data=load_df(engine,"staging_db")
-    db_path = config["file_path"]["main_db"]
-    engine = create_engine(db_path)
-    data['restaurant_id'] = data.index
-    data['location_id'] = data.index
+def location_key_frame(df, columns):
+    '''Location natural key values: coordinates filled from a locality centroid are left out,
+    so a locality-filled location is identified by its locality, not by a centroid that moves'''
+    keys = df[list(columns)].copy()
+    if "coord_source" in keys.columns:
+        approximate = (keys["coord_source"].astype(object) == "locality").to_numpy()
+        keys.loc[approximate, [col for col in ("Latitude", "Longitude") if col in keys.columns]] = np.nan
+    return keys
+
+
+# Locations loaded before coord_source was recorded were located from their listing
+LOCATION_BACKFILL = {
+    "coord_source": ("TEXT", "CASE WHEN \"Latitude\" IS NOT NULL AND \"Longitude\" IS NOT NULL THEN 'listing' END")
+}
+
+
+def open_dimension_keys(engine, config):
+    '''{fact id column: DimensionKeys} with the lookups of the existing dimension tables'''
+    conn = engine.raw_connection()
+    try:
+        return {
+            id_column: DimensionKeys(conn, table_name, config['params'][columns_key],
+                                     *((location_key_frame, LOCATION_BACKFILL) if id_column == "location_id" else ()))
+            for id_column, table_name, columns_key in DIMENSIONS
+        }
+    finally:
+        conn.close()
+
+
+def load_dimensions(data, engine, dimension_keys, params=None):
+    '''Set data's surrogate id columns and insert the dimension rows for unseen natural keys'''
+    for id_column, keys in dimension_keys.items():
+        ids, new_rows = keys.assign(data)
+        data[id_column] = ids
+        if len(new_rows):
+            bulk_load(engine, new_rows, keys.table_name, params=params)
+        logging.info(f"{keys.table_name}: {len(new_rows)} new keys, {len(keys)} in total")
+    return data
+
 
-    restaurant_columns = config['params'] ['restaurant_dimension_table_columns']
-    #restaurant_columns_name = config['params'] ['dimension_table_1_columns']
-    load_data_into_table(data, "restaurant_dimension_table", engine, columns=restaurant_columns)
-  
+def open_fact_keys(engine, fact_columns, load_params):
+    '''FactKeys for fact_table, keyed by params.load.fact_key with the fact columns as measures'''
+    key_columns = load_params["fact_key"]
+    measure_columns = [col for col in fact_columns if col not in key_columns]
+    conn = engine.raw_connection()
+    try:
+        return FactKeys(conn, "fact_table", key_columns, measure_columns, load_params["max_runs"])
+    finally:
+        conn.close()
 
-    location_columns = config['params'] ['location_dimension_table_columns']  
-    #location_columns_name = config['params'] ['dimension_table_2_columns']
-    load_data_into_table(data, "location_dimension_table", engine, columns=location_columns)
 
+def load_facts(data, engine, fact_keys, load_id, fact_columns, params=None):
+    '''Insert new facts and update changed ones in place; returns (inserted, updated, unchanged)
 
-    fact_table_name = config['params'] ['fact_table_1']  
-    fact_columns = config['params'] ['fact_table_1_columns']
+    Facts this load inserted from an earlier chunk are rewritten without a
+    change log entry and count only as the one insert.
+    '''
+    inserts, updates, unchanged = fact_keys.diff(data)
+    tracking_columns = ["fact_id", "fact_key", "row_hash", "load_id"]
+    if len(inserts):
+        bulk_load(engine, inserts.assign(load_id=load_id), "fact_table",
+                  columns=tracking_columns + list(fact_columns), params=params)
+    changed = updates[updates["fact_id"] < fact_keys.first_id]
+    if len(changed):
+        conn = engine.raw_connection()
+        try:
+            record_changes(conn, "fact_table", changed["fact_id"], load_id, fact_keys.measure_columns)
+        finally:
+            conn.close()
+    if len(updates):
+        bulk_update(engine, updates.assign(load_id=load_id), "fact_table",
+                    fact_keys.measure_columns + ["row_hash", "load_id"], "fact_id", params=params)
+    return len(inserts), len(changed), unchanged
 
-    load_data_into_table(data, "fact_table", engine, columns=fact_columns)
- 
+
+def load_star_schema(chunks, engine, config):
+    '''Load an iterable of DataFrames into the star schema; returns the number of rows read.
+
+    In "upsert" load mode only new facts are inserted and changed facts
+    updated, and the run is recorded in the load watermark table; in
+    "append" mode every row is appended to fact_table. The indexes in
+    params.indexes are created once the data is in, followed by ANALYZE.
+    '''
+    fact_columns = config['params']['fact_table_1_columns']
+    bulk_params = get_bulk_params(config)
+    load_params = get_load_params(config)
+    upsert = load_params["mode"] == "upsert"
+
+    dimension_keys = None
+    fact_keys = None
+    counts = [0, 0, 0]
+    rows = 0
+    for data in chunks:
+        if dimension_keys is None:
+            # transform_chunks creates the tables with its first chunk
+            dimension_keys = open_dimension_keys(engine, config)
+            if upsert:
+                fact_keys = open_fact_keys(engine, fact_columns, load_params)
+                conn = engine.raw_connection()
+                try:
+                    load_id = begin_load(conn)
+                finally:
+                    conn.close()
+        if upsert:
+            data = fact_keys.latest(data)
+        data = load_dimensions(data, engine, dimension_keys, params=bulk_params)
+        if upsert:
+            counts = [total + count for total, count in
+                      zip(counts, load_facts(data, engine, fact_keys, load_id, fact_columns, params=bulk_params))]
+        else:
+            load_data_into_table(data, "fact_table", engine, columns=fact_columns, params=bulk_params)
+        rows += len(data)
+
+    if fact_keys is not None:
+        conn = engine.raw_connection()
+        try:
+            for id_column, keys in dimension_keys.items():
+                keys.drop_unreferenced(conn, "fact_table", id_column)
+            end_load(conn, load_id, *counts)
+        finally:
+            conn.close()
+    if rows:
+        refresh_location_features(engine, config)
+        create_indexes(engine, config['params'].get('indexes', {}))
+    return rows
+
+
+def load(data=None):
+    '''Load data (the typed frame from transform()) into the star schema; returns the rows loaded.
+
+    Without data the staging table is read back instead.
+    '''
+    config = load_config()
+    if data is None:
+        engine = create_engine(config["file_path"]["staging_db"])
+        data = load_df(engine, "staging_db")
+        data = drop_column(data, "key_pk")
+    db_path = config["file_path"]["main_db"]
+    engine = create_engine(db_path)
+    rows = load_star_schema([data], engine, config)
     logging.info("Loading data completed.")
+    return rows
+
 
-   
\ No newline at end of file
+def load_chunks(chunks):
+    '''Streaming counterpart of load(): load each typed chunk into the star schema'''
+    config = load_config()
+    engine = create_engine(config["file_path"]["main_db"])
+    rows = load_star_schema(chunks, engine, config)
+    logging.info(f"Loading data completed: {rows} rows.")
+    return rows
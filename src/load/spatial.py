@@ -0,0 +1,238 @@
+import logging
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from ..utils.db_utils import bulk_update, get_bulk_params
+
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_ALPHABET = np.array(list("0123456789bcdefghjkmnpqrstuvwxyz"))
+LOCATION_TABLE = "location_dimension_table"
+LOCATION_FEATURES = {"geohash": "TEXT", "nearby_count": "INTEGER", "nearby_avg_rating": "REAL"}
+
+DEFAULT_SPATIAL_PARAMS = {
+    "geohash_precision": 7,
+    "radius_km": 2.0,
+    "batch_size": 20000
+}
+
+
+def get_spatial_params(config):
+    return dict(DEFAULT_SPATIAL_PARAMS, **config["params"].get("spatial", {}))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    '''Great-circle distance in km between points given in degrees; broadcasts like numpy'''
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def geohash_encode(latitude, longitude, precision=7):
+    '''Geohash of each point as an object array; None where a coordinate is missing or out of range'''
+    lat = np.atleast_1d(np.asarray(latitude, dtype=float))
+    lon = np.atleast_1d(np.asarray(longitude, dtype=float))
+    valid = np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+    bits = precision * 5
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    # Quantizing to 2**n cells is the same as n bisection steps
+    lat_cells = np.clip((np.where(valid, lat, 0) + 90) / 180 * 2.0 ** lat_bits, 0, 2 ** lat_bits - 1).astype(np.uint64)
+    lon_cells = np.clip((np.where(valid, lon, 0) + 180) / 360 * 2.0 ** lon_bits, 0, 2 ** lon_bits - 1).astype(np.uint64)
+    code = np.zeros(len(lat), dtype=np.uint64)
+    for bit in range(bits):
+        # Bits alternate longitude, latitude, starting with the most significant longitude bit
+        cells, width = (lon_cells, lon_bits) if bit % 2 == 0 else (lat_cells, lat_bits)
+        code = (code << np.uint64(1)) | ((cells >> np.uint64(width - 1 - bit // 2)) & np.uint64(1))
+    shifts = np.arange(precision - 1, -1, -1, dtype=np.uint64) * np.uint64(5)
+    chars = GEOHASH_ALPHABET[((code[:, None] >> shifts) & np.uint64(31)).astype(np.intp)]
+    hashes = np.ascontiguousarray(chars).view(f"<U{precision}").ravel().astype(object)
+    hashes[~valid] = None
+    return hashes
+
+
+def geohash_cell_km(precision, latitude=0.0):
+    '''(height, width) in km of a geohash cell of precision at latitude'''
+    bits = precision * 5
+    height = 180 / 2 ** (bits // 2) * np.pi / 180 * EARTH_RADIUS_KM
+    width = 360 / 2 ** ((bits + 1) // 2) * np.pi / 180 * EARTH_RADIUS_KM * np.cos(np.radians(latitude))
+    return height, width
+
+
+def covering_geohashes(latitude, longitude, radius_km, max_precision=7):
+    '''Geohash prefixes whose cells together cover every point within radius_km.
+
+    Uses the longest precision up to max_precision whose cells are at least
+    radius_km on each side; then the circle's bounding box spans at most
+    three cells per axis and the 3x3 sample points land in all of them.
+    '''
+    precision = max_precision
+    while precision > 1 and min(geohash_cell_km(precision, latitude)) < radius_km:
+        precision -= 1
+    dlat = np.degrees(radius_km / EARTH_RADIUS_KM)
+    dlon = dlat / max(np.cos(np.radians(latitude)), 1e-6)
+    lats, lons = np.meshgrid(latitude + np.array([-dlat, 0, dlat]), longitude + np.array([-dlon, 0, dlon]))
+    return sorted(set(geohash_encode(lats.ravel(), lons.ravel(), precision)) - {None})
+
+
+def _unit_vectors(latitude, longitude):
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _chord(radius_km):
+    return 2 * np.sin(np.minimum(radius_km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+def _arc_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+class SpatialIndex:
+    '''In-memory KD-tree over points on the sphere, for radius and nearest-neighbour queries.
+
+    Points are stored as 3-D unit vectors, where straight-line (chord)
+    distance is monotonic in great-circle distance, so the tree answers
+    haversine queries exactly. Points without coordinates are left out.
+    Results carry the ids the index was built with, and distances in km.
+    '''
+
+    def __init__(self, latitude, longitude, ids=None):
+        latitude = np.asarray(latitude, dtype=float)
+        longitude = np.asarray(longitude, dtype=float)
+        ids = np.arange(len(latitude)) if ids is None else np.asarray(ids)
+        valid = np.isfinite(latitude) & np.isfinite(longitude)
+        self.ids = ids[valid]
+        self.latitude = latitude[valid]
+        self.longitude = longitude[valid]
+        self.tree = cKDTree(_unit_vectors(self.latitude, self.longitude))
+
+    @classmethod
+    def from_table(cls, engine, table_name=LOCATION_TABLE):
+        '''Index the id, Latitude and Longitude of every row of table_name'''
+        with engine.connect() as conn:
+            df = pd.read_sql(f'SELECT id, "Latitude", "Longitude" FROM {table_name}', con=conn)
+        return cls(pd.to_numeric(df["Latitude"], errors="coerce"), pd.to_numeric(df["Longitude"], errors="coerce"), df["id"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def within(self, latitude, longitude, radius_km):
+        '''(ids, distances) of the points within radius_km of one point, nearest first'''
+        center = _unit_vectors(np.atleast_1d(latitude), np.atleast_1d(longitude))[0]
+        positions = np.array(self.tree.query_ball_point(center, _chord(radius_km)), dtype=np.intp)
+        distances = _arc_km(np.linalg.norm(self.tree.data[positions] - center, axis=1)) if len(positions) else np.empty(0)
+        order = np.argsort(distances, kind="stable")
+        return self.ids[positions[order]], distances[order]
+
+    def nearest(self, latitude, longitude, k=5):
+        '''(ids, distances) of the k points nearest to one point'''
+        k = min(k, len(self))
+        if k == 0:
+            return self.ids[:0], np.empty(0)
+        center = _unit_vectors(np.atleast_1d(latitude), np.atleast_1d(longitude))[0]
+        chords, positions = self.tree.query(center, k=k)
+        return self.ids[np.atleast_1d(positions)], _arc_km(np.atleast_1d(chords))
+
+    def neighbor_sums(self, latitude, longitude, radius_km, values, batch_size=20000):
+        '''For each query point, the sum of every column of values over indexed points within radius_km.
+
+        values has one row per indexed point (in index order). The pairs
+        are found batch by batch by a tree-to-tree search, so no Python
+        loop runs per point. Returns an array of shape (queries, columns).
+        '''
+        values = np.asarray(values, dtype=float).reshape(len(self), -1)
+        queries = _unit_vectors(np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float))
+        sums = np.zeros((len(queries), values.shape[1]))
+        valid = np.flatnonzero(np.isfinite(queries).all(axis=1))
+        for start in range(0, len(valid), batch_size):
+            batch = valid[start:start + batch_size]
+            pairs = cKDTree(queries[batch]).sparse_distance_matrix(self.tree, _chord(radius_km), output_type="ndarray")
+            neighbors = values[pairs["j"]]
+            for column in range(values.shape[1]):
+                sums[batch, column] = np.bincount(pairs["i"], weights=neighbors[:, column], minlength=len(batch))
+        return sums
+
+
+def ensure_location_columns(conn, table_name=LOCATION_TABLE):
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")}
+    for column, sql_type in LOCATION_FEATURES.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN {column} {sql_type}")
+    conn.commit()
+
+
+def location_features(locations, fact_stats, radius_km, precision=7, batch_size=20000):
+    '''geohash, nearby_count and nearby_avg_rating for each row of locations (id, Latitude, Longitude).
+
+    fact_stats holds per location_id the number of facts and the sum and
+    count of their ratings. Neighbours are the facts at other locations
+    within radius_km; a location's own facts are left out. Locations whose
+    coord_source is "locality" sit on a shared centroid, so they are
+    neither neighbours nor given neighbour figures (only a geohash).
+    '''
+    latitude = pd.to_numeric(locations["Latitude"], errors="coerce").to_numpy(dtype=float)
+    longitude = pd.to_numeric(locations["Longitude"], errors="coerce").to_numpy(dtype=float)
+    stats = fact_stats.set_index("location_id").reindex(locations["id"]).fillna(0)
+    own = stats[["facts", "rating_sum", "ratings"]].to_numpy(dtype=float)
+
+    features = pd.DataFrame({"id": locations["id"].to_numpy(), "geohash": geohash_encode(latitude, longitude, precision)})
+    if "coord_source" in locations.columns:
+        approximate = (locations["coord_source"].astype(object) == "locality").to_numpy()
+        latitude, longitude = np.where(approximate, np.nan, latitude), np.where(approximate, np.nan, longitude)
+    index = SpatialIndex(latitude, longitude)
+    valid = np.isfinite(latitude) & np.isfinite(longitude)
+    sums = index.neighbor_sums(latitude, longitude, radius_km, own[valid], batch_size) - own
+    nearby_count = np.where(valid, sums[:, 0], np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        nearby_avg = np.where(valid & (sums[:, 2] > 0.5), sums[:, 1] / sums[:, 2], np.nan)
+    features["nearby_count"] = pd.array(np.round(nearby_count), dtype="Int64")
+    features["nearby_avg_rating"] = nearby_avg
+    return features
+
+
+def refresh_location_features(engine, config):
+    '''Recompute the geohash and neighbour columns of every location from the current facts.
+
+    Runs after each load, since new or updated facts change the neighbour
+    figures of the locations around them. The geohash column is indexed via
+    params.indexes for radius queries in SQL (locations_within).
+    nearby_avg_rating averages every loaded rating, so it is for queries
+    and dashboards; as a model input it would leak held-out targets (the
+    model uses pred_analysis's nearby_train_rating instead).
+    '''
+    params = get_spatial_params(config)
+    conn = engine.raw_connection()
+    try:
+        ensure_location_columns(conn)
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({LOCATION_TABLE})")}
+    finally:
+        conn.close()
+    source = ', "coord_source"' if "coord_source" in columns else ""
+    with engine.connect() as conn:
+        locations = pd.read_sql(f'SELECT id, "Latitude", "Longitude"{source} FROM {LOCATION_TABLE}', con=conn)
+        fact_stats = pd.read_sql(
+            'SELECT location_id, COUNT(*) AS facts, SUM("RATING") AS rating_sum, COUNT("RATING") AS ratings '
+            "FROM fact_table GROUP BY location_id", con=conn
+        )
+    features = location_features(locations, fact_stats, params["radius_km"], params["geohash_precision"],
+                                 params["batch_size"])
+    bulk_update(engine, features, LOCATION_TABLE, list(LOCATION_FEATURES), "id", params=get_bulk_params(config))
+    logging.info(f"Location features refreshed for {len(features)} locations "
+                 f"({int(features['geohash'].notnull().sum())} with coordinates, radius {params['radius_km']} km)")
+
+
+def locations_within(engine, latitude, longitude, radius_km, precision=7, table_name=LOCATION_TABLE):
+    '''Rows of table_name within radius_km of a point, nearest first, with a distance_km column.
+
+    Candidates come from range scans of the geohash index over the cells
+    covering the circle; only those are checked with haversine.
+    '''
+    prefixes = covering_geohashes(latitude, longitude, radius_km, precision)
+    where = " OR ".join("(geohash >= ? AND geohash < ?)" for _ in prefixes)
+    # "{" sorts right after "z", the last geohash character
+    args = [value for prefix in prefixes for value in (prefix, prefix + "{")]
+    with engine.connect() as conn:
+        candidates = pd.read_sql(f"SELECT * FROM {table_name} WHERE {where}", con=conn, params=tuple(args))
+    distances = haversine_km(latitude, longitude, pd.to_numeric(candidates["Latitude"], errors="coerce"),
+                             pd.to_numeric(candidates["Longitude"], errors="coerce"))
+    candidates["distance_km"] = distances
+    return candidates[candidates["distance_km"] <= radius_km].sort_values("distance_km", kind="stable").reset_index(drop=True)
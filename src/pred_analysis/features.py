@@ -0,0 +1,195 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.spatial import cKDTree
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.compose import ColumnTransformer
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import OneHotEncoder
+
+# ML_config params that change the built matrices; anything else can change without invalidating the cache
+FEATURE_PARAMS = ['selected_columns_for_prediction', 'one_hot_columns', 'Target_column',
+                  'rating_type_category_mapping', 'test_size', 'random_state', 'nearby_radius_km']
+
+# Features the encoder computes while fitting, with the columns it computes them from
+FITTED_FEATURES = {'nearby_train_rating': ['Latitude', 'Longitude', 'location_id']}
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def input_columns(ML_config):
+    """Columns the encoder reads: the selected features, with fitted ones replaced by their source columns"""
+    columns = []
+    for name in ML_config['params']['selected_columns_for_prediction']:
+        columns += FITTED_FEATURES.get(name, [name])
+    return list(dict.fromkeys(columns))
+
+
+def _unit_vectors(latitude, longitude):
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class NearbyRating(BaseEstimator, TransformerMixin):
+    """Mean rating of the training facts at other locations within radius_km (nearby_train_rating).
+
+    fit(X, y) keeps per-location rating sums of the training rows only, so
+    test ratings never reach the feature; the nearby_avg_rating column the
+    ETL load writes covers every fact and must not be a model input. As in
+    the ETL's location_features, a row's own location is left out. Rows
+    without coordinates or rated neighbours get the training mean. X holds
+    Latitude, Longitude and location_id.
+    """
+
+    def __init__(self, radius_km=2.0, batch_size=20000):
+        self.radius_km = radius_km
+        self.batch_size = batch_size
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=float)
+        rated = pd.DataFrame({'Latitude': X[:, 0], 'Longitude': X[:, 1], 'location_id': X[:, 2],
+                              'rating': np.asarray(y, dtype=float)}).dropna()
+        stats = rated.groupby('location_id').agg(Latitude=('Latitude', 'first'), Longitude=('Longitude', 'first'),
+                                                 rating_sum=('rating', 'sum'), ratings=('rating', 'size'))
+        self.location_ids_ = stats.index.to_numpy()
+        self.sums_ = stats[['rating_sum', 'ratings']].to_numpy(dtype=float)
+        self.tree_ = cKDTree(_unit_vectors(stats['Latitude'].to_numpy(), stats['Longitude'].to_numpy()))
+        self.mean_ = float(rated['rating'].mean()) if len(rated) else np.nan
+        return self
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=float)
+        queries = _unit_vectors(X[:, 0], X[:, 1])
+        chord = 2 * np.sin(min(self.radius_km / EARTH_RADIUS_KM, np.pi) / 2)
+        sums = np.zeros((len(X), 2))
+        valid = np.flatnonzero(np.isfinite(queries).all(axis=1))
+        for start in range(0, len(valid) if len(self.location_ids_) else 0, self.batch_size):
+            batch = valid[start:start + self.batch_size]
+            pairs = cKDTree(queries[batch]).sparse_distance_matrix(self.tree_, chord, output_type='ndarray')
+            other = self.location_ids_[pairs['j']] != X[batch[pairs['i']], 2]
+            for column in range(2):
+                sums[batch, column] = np.bincount(pairs['i'][other], weights=self.sums_[pairs['j'][other], column],
+                                                  minlength=len(batch))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(sums[:, 1] > 0, sums[:, 0] / sums[:, 1], self.mean_).reshape(-1, 1)
+
+
+def build_encoder(ML_config):
+    """Unfitted encoder: sparse one-hot for one_hot_columns, mean imputation for the rest.
+
+    Categories not seen during fit encode as all zeros instead of failing,
+    so a fitted encoder can be reused on new restaurants. A selected
+    nearby_train_rating is computed by NearbyRating, so the encoder has to
+    be fitted with the training targets.
+    """
+    params = ML_config['params']
+    selected = params['selected_columns_for_prediction']
+    one_hot_columns = params.get('one_hot_columns', ['CUSINETYPE', 'CITY'])
+    numeric_columns = [col for col in selected if col not in one_hot_columns and col not in FITTED_FEATURES]
+    transformers = [
+        ('one_hot', OneHotEncoder(handle_unknown='ignore', dtype=np.float32), one_hot_columns),
+        ('numeric', SimpleImputer(strategy='mean'), numeric_columns),
+    ]
+    if 'nearby_train_rating' in selected:
+        transformers.append(('nearby_train_rating', NearbyRating(params.get('nearby_radius_km', 2.0)),
+                             FITTED_FEATURES['nearby_train_rating']))
+    return ColumnTransformer(transformers, sparse_threshold=1.0)
+
+
+def encode(encoder, df):
+    """Transform df with a fitted encoder into a float32 CSR matrix"""
+    return sp.csr_matrix(encoder.transform(df), dtype=np.float32)
+
+
+def source_fingerprint(engine, ML_config):
+    """Cheap fingerprint of the rows the feature query reads, without reading them.
+
+    Uses each table's row count and largest rowid, plus the last finished
+    load from load_watermark when main_db is loaded in upsert mode (so
+    facts updated in place change it too).
+    """
+    params = ML_config['params']
+    tables = [params['fact_table_1'], params['dimension_table_1'], params['dimension_table_2']]
+    with engine.connect() as conn:
+        fingerprint = {
+            table: list(conn.exec_driver_sql(f"SELECT COUNT(*), MAX(rowid) FROM {table}").fetchone())
+            for table in tables
+        }
+        has_watermark = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='load_watermark'"
+        ).fetchone()
+        if has_watermark:
+            fingerprint['load_watermark'] = list(conn.exec_driver_sql(
+                "SELECT MAX(load_id), MAX(finished_at) FROM load_watermark WHERE finished_at IS NOT NULL"
+            ).fetchone())
+    return fingerprint
+
+
+def latest_load_id(engine):
+    """Last finished load in load_watermark, or None when main_db has no upsert loads"""
+    with engine.connect() as conn:
+        has_watermark = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='load_watermark'"
+        ).fetchone()
+        if not has_watermark:
+            return None
+        return conn.exec_driver_sql("SELECT MAX(load_id) FROM load_watermark WHERE finished_at IS NOT NULL").scalar()
+
+
+def feature_cache_key(engine, ML_config):
+    params = ML_config['params']
+    key = {
+        'source': source_fingerprint(engine, ML_config),
+        'params': {name: params.get(name) for name in FEATURE_PARAMS},
+    }
+    return hashlib.blake2b(json.dumps(key, sort_keys=True, default=str).encode(), digest_size=12).hexdigest()
+
+
+class FeatureCache:
+    """Built train/test matrices and their fitted encoder on disk, one directory per key.
+
+    An entry is written to a temporary directory and renamed into place,
+    so a reader never sees a partial entry.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return (X_train, X_test, y_train, y_test, encoder) for key, or None"""
+        path = self._path(key)
+        if not os.path.isdir(path):
+            return None
+        entry = (
+            sp.load_npz(os.path.join(path, 'X_train.npz')),
+            sp.load_npz(os.path.join(path, 'X_test.npz')),
+            np.load(os.path.join(path, 'y_train.npy')),
+            np.load(os.path.join(path, 'y_test.npy')),
+            joblib.load(os.path.join(path, 'encoder.joblib')),
+        )
+        logging.info(f"Feature cache hit {key}")
+        return entry
+
+    def put(self, key, X_train, X_test, y_train, y_test, encoder):
+        path = self._path(key)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        sp.save_npz(os.path.join(tmp_path, 'X_train.npz'), X_train)
+        sp.save_npz(os.path.join(tmp_path, 'X_test.npz'), X_test)
+        np.save(os.path.join(tmp_path, 'y_train.npy'), np.asarray(y_train))
+        np.save(os.path.join(tmp_path, 'y_test.npy'), np.asarray(y_test))
+        joblib.dump(encoder, os.path.join(tmp_path, 'encoder.joblib'))
+        if os.path.isdir(path):
+            shutil.rmtree(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+        logging.info(f"Feature cache stored {key}")
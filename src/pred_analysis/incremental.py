@@ -0,0 +1,153 @@
+import time
+import logging
+import numpy as np
+import scipy.sparse as sp
+from sklearn import metrics
+from load import load_features, prepare_features
+from features import encode, latest_load_id
+from scoring import load_artifact, save_artifact
+from train import get_training_params
+
+DEFAULT_INCREMENTAL = {
+    'max_error_increase': 0.1,
+    'max_unseen_category_rate': 0.2,
+    'max_new_rows_fraction': 0.5,
+    'rf_new_estimators': 20,
+    'rf_max_estimators': 300,
+}
+
+
+def get_incremental_params(ML_config):
+    params = dict(DEFAULT_INCREMENTAL)
+    params.update(ML_config.get('incremental', {}))
+    return params
+
+
+def linear_state(X, y):
+    """Least-squares sufficient statistics of X (plus an intercept column) and y: X'X, X'y and the row count"""
+    X = sp.hstack([X, np.ones((X.shape[0], 1))], format='csr', dtype=np.float64)
+    return {'xtx': (X.T @ X).toarray(), 'xty': X.T @ np.asarray(y, dtype=np.float64), 'rows': X.shape[0]}
+
+
+def model_state(model_name, X, y):
+    """State an incremental update of model_name needs, saved with its artifact"""
+    return linear_state(X, y) if model_name == 'LR' else None
+
+
+def update_linear(model, state, X, y):
+    """Add X, y to the statistics and re-solve, as if the model were refit on all rows seen so far"""
+    new = linear_state(X, y)
+    state = {name: state[name] + new[name] for name in state}
+    solution = np.linalg.lstsq(state['xtx'], state['xty'], rcond=None)[0]
+    model.coef_, model.intercept_ = solution[:-1], solution[-1]
+    return state
+
+
+def grow_forest(model, X, y, params, n_jobs):
+    """Add rf_new_estimators trees fitted on X, y; the oldest trees beyond rf_max_estimators are dropped"""
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + params['rf_new_estimators'], n_jobs=n_jobs)
+    model.fit(X, y)
+    if len(model.estimators_) > params['rf_max_estimators']:
+        model.estimators_ = model.estimators_[-params['rf_max_estimators']:]
+        model.n_estimators = len(model.estimators_)
+
+
+def unseen_category_rate(encoder, features):
+    """Share of rows with a one-hot value the encoder was not fitted on (it encodes as all zeros)"""
+    one_hot = encoder.named_transformers_['one_hot']
+    unseen = np.zeros(len(features), dtype=bool)
+    for column, categories in zip(one_hot.feature_names_in_, one_hot.categories_):
+        values = features[column]
+        unseen |= values.notnull().to_numpy() & ~values.isin(categories).to_numpy()
+    return unseen.mean() if len(unseen) else 0.0
+
+
+def incremental_update(engine, ML_config):
+    """Update the LATEST model with the facts loaded since it was trained.
+
+    The current model is first scored on the new facts. If its RMSE there
+    rose more than max_error_increase above the full retrain's test RMSE,
+    too many new facts have categories the encoder has not seen, or the
+    facts added since the last full retrain exceed max_new_rows_fraction of
+    its training rows, a full retrain is needed. Otherwise LR is re-solved
+    from its saved least-squares statistics plus the new facts, and RF
+    grows warm-start trees on the new facts; DT cannot be updated. The
+    result is saved as a new version.
+
+    Facts an upsert load updated count as new observations; their previous
+    versions stay in the statistics and the older trees. Returns True when
+    the saved model is current, False when a full retrain is needed.
+    """
+    params = get_incremental_params(ML_config)
+    model_dir = ML_config['database'].get('model_dir', '../Main_DB/models')
+    try:
+        version, artifact, manifest = load_artifact(model_dir)
+    except FileNotFoundError:
+        logging.info("No saved model; a full retrain is needed.")
+        return False
+    if manifest.get('features') != ML_config['params']['selected_columns_for_prediction']:
+        logging.info(f"Model {version} was trained on other features; a full retrain is needed.")
+        return False
+    training = manifest.get('training', {})
+    trained_through = training.get('load_id')
+    latest = latest_load_id(engine)
+    if trained_through is None or latest is None:
+        logging.info("No load watermark for the saved model or main_db (needs load mode 'upsert'); "
+                     "a full retrain is needed.")
+        return False
+    if latest <= trained_through:
+        logging.info(f"Model {version} is up to date at load {trained_through}")
+        return True
+
+    start = time.perf_counter()
+    df = load_features(engine, ML_config, ML_config['params'].get('feature_chunk_size', 50000),
+                       load_range=(trained_through, latest))
+    if df.empty:
+        logging.info(f"No usable facts in loads {trained_through + 1}-{latest}; model {version} is kept.")
+        return True
+    encoder, model, model_name = artifact['encoder'], artifact['model'], manifest['model']
+    features = prepare_features(df, ML_config)
+    X = encode(encoder, features)
+    y = df[ML_config['params']['Target_column']].to_numpy(dtype=np.float64)
+
+    y_pred = model.predict(X)
+    mae = metrics.mean_absolute_error(y, y_pred)
+    rmse = metrics.mean_squared_error(y, y_pred) ** 0.5
+    baseline_rmse = training.get('baseline_rmse', manifest['metrics']['rmse'])
+    rows_since_full = training.get('rows_since_full', 0) + len(df)
+    checks = {
+        'error increase': (rmse / baseline_rmse - 1, params['max_error_increase']),
+        'unseen category rate': (unseen_category_rate(encoder, features), params['max_unseen_category_rate']),
+        'new rows fraction': (rows_since_full / training.get('rows', len(df)), params['max_new_rows_fraction']),
+    }
+    logging.info(f"{len(df)} new facts from loads {trained_through + 1}-{latest}: {model_name} MAE {mae:.4f}, "
+                 f"RMSE {rmse:.4f} (baseline {baseline_rmse:.4f}); "
+                 + ", ".join(f"{name} {value:.3f} (limit {limit})" for name, (value, limit) in checks.items()))
+
+    reasons = [name for name, (value, limit) in checks.items() if value > limit]
+    state = artifact.get('state')
+    if model_name == 'DT':
+        reasons.append("DT cannot be updated incrementally")
+    if model_name == 'LR' and state is None:
+        reasons.append("no saved least-squares state")
+    if reasons:
+        logging.warning(f"Full retrain needed: {', '.join(reasons)}")
+        return False
+
+    if model_name == 'LR':
+        state = update_linear(model, state, X, y)
+    else:
+        grow_forest(model, X, y, params, get_training_params(ML_config)['n_jobs'])
+    save_artifact(model_dir, model, encoder, ML_config, model_name, manifest['params'], manifest['metrics'],
+                  manifest.get('data_key'), state, {
+                      **training,
+                      'mode': 'incremental',
+                      'load_id': latest,
+                      'rows_since_full': rows_since_full,
+                      'baseline_rmse': baseline_rmse,
+                      'parent': version,
+                      'new_rows_mae': mae,
+                      'new_rows_rmse': rmse,
+                  })
+    logging.info(f"Incremental update of {version} with {len(df)} facts took {time.perf_counter() - start:.1f} s")
+    return True
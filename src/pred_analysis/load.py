@@ -1,8 +1,18 @@
 
 
+import numpy as np
 import pandas as pd
-import sqlalchemy
+import logging
 from sklearn.model_selection import train_test_split  # Add this line at the top of load.py
+from features import build_encoder, encode, input_columns
+
+# Features computed in SQL from a source column: {feature: (source column, expression template)}
+DERIVED_FEATURES = {
+    'cusine_count': ('CUSINE_CATEGORY', "LENGTH({col}) - LENGTH(REPLACE({col}, ',', '')) + 1"),
+}
+
+# Rows without these are dropped before training, as preprocess_data does
+REQUIRED_COLUMNS = ['Latitude', 'Longitude', 'RATING', 'cusine_count', 'RATING_TYPE']
 
 
 def load_data(engine, staging_table_names):
@@ -22,43 +32,151 @@ def load_data(engine, staging_table_names):
     combined_df = pd.concat(dfs, axis=1)
     return combined_df
 
-from sklearn.impute import SimpleImputer
 
-def preprocess_data(df, ML_config):
-    """Preprocess the data by cleaning, encoding, imputing, and splitting it into train and test sets."""
+def feature_query(engine, ML_config, target=True, extra_select=(), extra_joins="", extra_where=()):
+    """Build the SELECT joining the fact table to both dimensions on their keys.
+
+    Only the selected feature columns and (with target) the target are
+    projected, and the rows preprocess_data would drop for missing values
+    are filtered out in SQL. extra_select, extra_joins and extra_where are
+    appended as given (fact_table is aliased f). Returns (sql, feature
+    names in select order, the names whose declared column type is TEXT).
+    """
+    params = ML_config['params']
+    tables = {'f': params['fact_table_1'], 'r': params['dimension_table_1'], 'l': params['dimension_table_2']}
+    owners = {}
+    declared = {}
+    with engine.connect() as conn:
+        for alias, table_name in tables.items():
+            for row in conn.exec_driver_sql(f"PRAGMA table_info({table_name})"):
+                owners.setdefault(row[1], alias)
+                declared.setdefault(row[1], row[2].upper())
+
+    def expression(name):
+        if name in DERIVED_FEATURES:
+            source, template = DERIVED_FEATURES[name]
+            return f"({template.format(col=f'{owners[source]}.{source}')})"
+        return f'{owners[name]}."{name}"'
+
+    targets = [params['Target_column']] if target else []
+    columns = list(dict.fromkeys(input_columns(ML_config) + targets))
+    missing = [name for name in columns if name not in owners and DERIVED_FEATURES.get(name, (name,))[0] not in owners]
+    if missing:
+        raise ValueError(f"Columns {missing} are not in the database; rerun the ETL load to create them")
+    required = [name for name in REQUIRED_COLUMNS if target or name != params['Target_column']]
+    select = ", ".join(list(extra_select) + [f'{expression(name)} AS "{name}"' for name in columns])
+    where = " AND ".join([f"{expression(name)} IS NOT NULL" for name in required] + list(extra_where))
+    sql = (
+        f"SELECT {select} FROM {tables['f']} f "
+        f"JOIN {tables['r']} r ON r.id = f.restaurant_id "
+        f"JOIN {tables['l']} l ON l.id = f.location_id "
+        f"{extra_joins} "
+        f"WHERE {where}"
+    )
+    text_columns = [name for name in columns if name not in DERIVED_FEATURES and declared[name] == 'TEXT']
+    return sql, columns, text_columns
+
+
+def load_features(engine, ML_config, chunk_size=50000, load_range=None):
+    """Load the model's feature columns and target via one joined, projected query.
+
+    Rows are read in chunks of chunk_size and converted as they arrive:
+    numeric columns into float32 arrays, text columns into integer codes
+    over a vocabulary grown chunk by chunk. With load_range (after,
+    through) only facts last written by loads in that range are read.
+    Returns a DataFrame of float32 and categorical columns; no wide object
+    frame is ever built.
+    """
+    extra_where = ["f.load_id > ? AND f.load_id <= ?"] if load_range is not None else []
+    args = tuple(load_range) if load_range is not None else ()
+    sql, columns, text_columns = feature_query(engine, ML_config, extra_where=extra_where)
+    logging.info(f"Feature query: {sql}")
+    arrays = {name: [] for name in columns}
+    vocabularies = {name: {} for name in text_columns}
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, args)
+        for rows in iter(lambda: cursor.fetchmany(chunk_size), []):
+            for name, values in zip(columns, zip(*rows)):
+                values = np.array(values, dtype=object)
+                if name in vocabularies:
+                    vocabulary = vocabularies[name]
+                    chunk_codes, uniques = pd.factorize(values)
+                    # Code -1 (missing) maps through the trailing -1
+                    mapping = np.array([vocabulary.setdefault(value, len(vocabulary)) for value in uniques] + [-1], dtype=np.int32)
+                    arrays[name].append(mapping[chunk_codes])
+                else:
+                    arrays[name].append(pd.to_numeric(values, errors='coerce').astype(np.float32))
+        cursor.close()
+    finally:
+        conn.close()
+
+    features = {}
+    for name in columns:
+        dtype = np.int32 if name in vocabularies else np.float32
+        values = np.concatenate(arrays[name]) if arrays[name] else np.empty(0, dtype=dtype)
+        if name in vocabularies:
+            values = pd.Categorical.from_codes(values, categories=list(vocabularies[name]))
+        features[name] = values
+    df = pd.DataFrame(features, columns=columns)
+    logging.info(f"Loaded {len(df)} feature rows ({df.memory_usage(deep=True).sum() / 2**20:.1f} MiB)")
+    return df
+
+
+def prepare_features(df, ML_config):
+    """Selected feature columns of df as the encoder expects them.
+
+    cusine_count is derived from CUSINE_CATEGORY when df does not have it
+    or has it null, and RATING_TYPE is mapped to its numeric scale. Used
+    for training and for scoring, so both see the same inputs.
+    """
+    if 'cusine_count' not in df.columns:
+        df = df.assign(cusine_count=df['CUSINE_CATEGORY'].astype('string').str.count(',') + 1)
+    elif 'CUSINE_CATEGORY' in df.columns and df['cusine_count'].isnull().any():
+        derived = df['CUSINE_CATEGORY'].astype('string').str.count(',') + 1
+        df = df.assign(cusine_count=pd.to_numeric(df['cusine_count']).fillna(derived))
+    filtered_df = df[input_columns(ML_config)].copy()
+    category_mapping = ML_config['params']['rating_type_category_mapping']
+    filtered_df['RATING_TYPE'] = filtered_df['RATING_TYPE'].astype(object).map(category_mapping).astype(float)
+    return filtered_df
+
+
+def build_features(df, ML_config):
+    """Clean df, split it, and encode both splits with an encoder fitted on the training rows.
+
+    Returns (X_train, X_test, y_train, y_test, encoder) with X as sparse
+    float32 CSR matrices and y as arrays; the encoder can be saved and
+    reused to encode new rows the same way.
+    """
 
     df = df.loc[:, ~df.columns.duplicated()].copy()
 
-    
+    # Frames from load_features are already projected, derived and filtered
     uselessColumns = ['fact_id', 'restaurant_id', 'location_id', 'NAME']
-    df = df.drop(uselessColumns, axis=1)
+    df = df.drop([col for col in uselessColumns if col in df.columns and col not in input_columns(ML_config)], axis=1)
 
-    
-    df['cusine_count'] = df['CUSINE_CATEGORY'].str.count(',') + 1
+    if 'cusine_count' not in df.columns:
+        df['cusine_count'] = df['CUSINE_CATEGORY'].str.count(',') + 1
 
     
-    df = df.dropna(subset=['Latitude', 'Longitude', 'RATING', 'cusine_count', 'RATING_TYPE'])
+    df = df.dropna(subset=[col for col in REQUIRED_COLUMNS if col in df.columns])
 
     
-    selected_columns = ML_config['params']['selected_columns_for_prediction']
-    filtered_df = df[selected_columns]
-
-    
-    category_mapping = ML_config['params']['rating_type_category_mapping']
-    filtered_df.loc[:, 'RATING_TYPE'] = df['RATING_TYPE'].map(category_mapping)
+    filtered_df = prepare_features(df, ML_config)
 
   
-    filtered_df = pd.get_dummies(filtered_df, columns=['CUSINETYPE', 'CITY'])
+    y = df[ML_config['params']['Target_column']].to_numpy(dtype=np.float64)
 
-    
-    imputer = SimpleImputer(strategy='mean')  # You can also use 'median' or other strategies
-    X = pd.DataFrame(imputer.fit_transform(filtered_df), columns=filtered_df.columns)
 
-  
-    y = df['RATING']
+    X_train, X_test, y_train, y_test = train_test_split(filtered_df, y, test_size=ML_config['params']['test_size'], random_state=ML_config['params']['random_state'])
 
+    # Fit on the training split only, so test rows never inform the imputed means or nearby ratings
+    encoder = build_encoder(ML_config).fit(X_train, y_train)
+    return encode(encoder, X_train), encode(encoder, X_test), y_train, y_test, encoder
 
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=ML_config['params']['test_size'], random_state=ML_config['params']['random_state'])
 
+def preprocess_data(df, ML_config):
+    """Preprocess the data by cleaning, encoding, imputing, and splitting it into train and test sets."""
+    X_train, X_test, y_train, y_test, _ = build_features(df, ML_config)
     return X_train, X_test, y_train, y_test
-
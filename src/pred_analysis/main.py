@@ -1,11 +1,14 @@
 # main.py
 
-import pandas as pd
 import sqlalchemy
 import logging
-from load import load_data, preprocess_data
-from sklearn.model_selection import train_test_split  # Add this line at the top of load.py
-from model import train_linear_regression, train_decision_tree, train_random_forest, evaluate_model
+from load import load_features, build_features
+from features import FeatureCache, feature_cache_key
+from train import train_and_select
+from scoring import save_artifact
+from features import latest_load_id
+from incremental import incremental_update, model_state
+import argparse
 import yaml
 import os
 sql_staging_table_name = 'staging_data'
@@ -31,8 +34,12 @@ def initialize_db(engine):
     with engine.connect() as conn:
         logging.info("Database created and connected successfully.")
 
-def etl_predictive_pipeline():
-    """Main ETL and Predictive Analysis Pipeline."""
+def etl_predictive_pipeline(incremental=False):
+    """Main ETL and Predictive Analysis Pipeline.
+
+    With incremental the saved model is updated with the newly loaded facts
+    instead, unless its drift or error checks call for a full retrain.
+    """
     logging.info("Starting ETL and Predictive Analysis Pipeline...")
     
     # Load configuration
@@ -44,29 +51,42 @@ def etl_predictive_pipeline():
     engine = sqlalchemy.create_engine(f'sqlite:///{sqlite_db_path}')
     initialize_db(engine)
 
-    # Step 1: Load Data
-    staging_table_names = [config['params']['fact_table_1'], config['params']['dimension_table_1'], config['params']['dimension_table_2']]
-    df = load_data(engine, staging_table_names)
+    if incremental and incremental_update(engine, config):
+        return
 
-    # Step 2: Preprocess Data
-    X_train, X_test, y_train, y_test = preprocess_data(df, config)
+    trained_through = latest_load_id(engine)
+    # Steps 1 and 2 are skipped when the same data and config were preprocessed before
+    cache = FeatureCache(config['database'].get('feature_cache_dir', '../Main_DB/feature_cache'))
+    cache_key = feature_cache_key(engine, config)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        X_train, X_test, y_train, y_test, encoder = cached
+    else:
+        # Step 1: Load Data (joined and projected in SQL, read in chunks)
+        df = load_features(engine, config, config['params'].get('feature_chunk_size', 50000))
 
-    # Step 3: Train Models and Evaluate
-    # Train Linear Regression
-    lr_model = train_linear_regression(X_train, y_train)
-    mse_lr, mae_lr = evaluate_model(lr_model, X_test, y_test)
-    logging.info(f"Linear Regression - MSE: {mse_lr}, MAE: {mae_lr}")
+        # Step 2: Preprocess Data
+        X_train, X_test, y_train, y_test, encoder = build_features(df, config)
+        cache.put(cache_key, X_train, X_test, y_train, y_test, encoder)
+    logging.info(f"Feature matrices: train {X_train.shape}, test {X_test.shape}")
 
-    # Train Decision Tree
-    dt_model = train_decision_tree(X_train, y_train, config)
-    mse_dt, mae_dt = evaluate_model(dt_model, X_test, y_test)
-    logging.info(f"Decision Tree - MSE: {mse_dt}, MAE: {mae_dt}")
+    # Step 3: Search hyperparameters, select on CV RMSE and evaluate only the winner on the test split
+    leaderboard, estimators = train_and_select(config, X_train, y_train, X_test, y_test)
+    best = leaderboard.iloc[0]
+    logging.info(f"Best model: {best['model']} {best['params']} - CV RMSE: {best['cv_rmse']:.4f}, "
+                 f"test MAE: {best['mae']}, test RMSE: {best['rmse']}")
 
-    # Train Random Forest
-    rf_model = train_random_forest(X_train, y_train, config)
-    mse_rf, mae_rf = evaluate_model(rf_model, X_test, y_test)
-    logging.info(f"Random Forest - MSE: {mse_rf}, MAE: {mae_rf}")
+    # Step 4: Keep the winner and its encoder for scoring (scoring.py) without retraining
+    save_artifact(config['database'].get('model_dir', '../Main_DB/models'), estimators[0], encoder, config,
+                  best['model'], best['params'], {'mae': best['mae'], 'rmse': best['rmse']}, cache_key,
+                  model_state(best['model'], X_train, y_train),
+                  {'mode': 'full', 'load_id': trained_through, 'rows': X_train.shape[0], 'rows_since_full': 0,
+                   'baseline_rmse': best['rmse']})
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the rating model on main_db")
+    parser.add_argument("--incremental", action="store_true",
+                        help="update the saved model with newly loaded facts; retrain fully only when needed")
+    args = parser.parse_args()
     config=read_config("./ML_config.yml")
-    etl_predictive_pipeline()
+    etl_predictive_pipeline(args.incremental)
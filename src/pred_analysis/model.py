@@ -5,6 +5,16 @@ from sklearn.tree import DecisionTreeRegressor
 from sklearn.ensemble import RandomForestRegressor
 from sklearn import metrics
 
+def build_model(name, config, **params):
+    """Unfitted model for a candidate name ('LR', 'DT' or 'RF'); its config block is the base, params override it."""
+    if name == 'LR':
+        return LinearRegression(**params)
+    if name == 'DT':
+        return DecisionTreeRegressor(**{**config['DT'], **params})
+    if name == 'RF':
+        return RandomForestRegressor(**{**config['RF'], **params})
+    raise ValueError(f"Unknown model: {name}")
+
 def train_linear_regression(X_train, y_train):
     """Train a Linear Regression model."""
     print("Training Linear Regression model...")
@@ -28,5 +38,5 @@ def evaluate_model(model, X_test, y_test):
     """Evaluate the model with MAE and RMSE metrics."""
     y_pred = model.predict(X_test)
     mae = metrics.mean_absolute_error(y_test, y_pred)
-    rmse = metrics.mean_squared_error(y_test, y_pred, squared=False)
+    rmse = metrics.mean_squared_error(y_test, y_pred) ** 0.5
     return mae, rmse
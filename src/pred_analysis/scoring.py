@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import logging
+import argparse
+import datetime
+import joblib
+import yaml
+import pandas as pd
+import sqlalchemy
+from load import feature_query, prepare_features, DERIVED_FEATURES
+from features import encode, input_columns
+
+PREDICTIONS_TABLE = 'rating_predictions'
+
+
+def save_artifact(model_dir, model, encoder, ML_config, model_name, params, metrics, data_key=None,
+                  state=None, training=None):
+    """Save model and encoder as a new version under model_dir and point LATEST at it.
+
+    A version directory holds artifact.joblib (encoder, model and the
+    state incremental updates need) and manifest.json (model, params,
+    metrics, feature columns, source data key, and the training dict:
+    rows trained on, load watermark, parent version). Returns the version
+    string.
+    """
+    version = f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{model_name}"
+    suffix = 1
+    while os.path.exists(os.path.join(model_dir, version + (f"-{suffix}" if suffix > 1 else ""))):
+        suffix += 1
+    version += f"-{suffix}" if suffix > 1 else ""
+    path = os.path.join(model_dir, version)
+    os.makedirs(path)
+    joblib.dump({'encoder': encoder, 'model': model, 'state': state}, os.path.join(path, 'artifact.joblib'))
+    manifest = {
+        'version': version,
+        'model': model_name,
+        'params': params,
+        'metrics': metrics,
+        'features': ML_config['params']['selected_columns_for_prediction'],
+        'rating_type_category_mapping': ML_config['params']['rating_type_category_mapping'],
+        'data_key': data_key,
+        'training': training or {},
+    }
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+    latest_tmp = os.path.join(model_dir, 'LATEST.tmp')
+    with open(latest_tmp, 'w') as f:
+        f.write(version)
+    os.replace(latest_tmp, os.path.join(model_dir, 'LATEST'))
+    logging.info(f"Saved model artifact {version}")
+    return version
+
+
+def load_artifact(model_dir, version=None):
+    """Return (version, artifact, manifest) for version, or the LATEST one.
+
+    artifact is the dict saved by save_artifact: encoder, model and state.
+    """
+    if version is None:
+        with open(os.path.join(model_dir, 'LATEST')) as f:
+            version = f.read().strip()
+    path = os.path.join(model_dir, version)
+    artifact = joblib.load(os.path.join(path, 'artifact.joblib'))
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    return version, artifact, manifest
+
+
+class RatingPredictor:
+    """Warm, in-process rating predictor: the artifact is loaded once and reused.
+
+    predict_one() takes a record with the raw feature columns (CUSINETYPE,
+    CITY, CUSINE_CATEGORY or cusine_count, RATING_TYPE, VOTES, PRICE,
+    nearby_count, and Latitude, Longitude and location_id for
+    nearby_train_rating); missing or unseen values are handled by the
+    fitted encoder.
+    """
+
+    def __init__(self, model_dir, ML_config, version=None):
+        self.version, artifact, self.manifest = load_artifact(model_dir, version)
+        self.encoder, self.model = artifact['encoder'], artifact['model']
+        if hasattr(self.model, 'n_jobs'):
+            # Scoring calls are small; thread start-up would cost more than it saves
+            self.model.n_jobs = 1
+        self.ML_config = ML_config
+
+    def predict(self, df):
+        features = prepare_features(df, self.ML_config)
+        return self.model.predict(encode(self.encoder, features))
+
+    def predict_one(self, record):
+        columns = input_columns(self.ML_config)
+        # Derived features left out of record are derived by prepare_features, not imputed
+        row = {name: [record.get(name)] for name in columns + ['CUSINE_CATEGORY']
+               if name not in DERIVED_FEATURES or name in record}
+        return float(self.predict(pd.DataFrame(row))[0])
+
+
+def score_unscored(engine, ML_config, predictor, chunk_size=50000, rescore=False):
+    """Predict ratings for facts without a current prediction from predictor's model version.
+
+    A prediction is current when it was made by that version for the load
+    that last wrote the fact, so facts updated by an upsert load are
+    scored again.
+
+    Facts are read in fact_id order with keyset pagination, so every chunk
+    is its own short query and the writes in between never contend with an
+    open read. Each chunk is predicted in one vectorized call and written
+    with one executemany in its own transaction. With rescore every fact
+    is scored again. Returns the number of facts scored.
+    """
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {PREDICTIONS_TABLE} ("
+            "fact_id INTEGER PRIMARY KEY, predicted_rating REAL, model_version TEXT, load_id INTEGER, scored_at TEXT)"
+        )
+    where = ["f.fact_id > ?"]
+    if not rescore:
+        where.append("(p.fact_id IS NULL OR p.model_version IS NOT ? OR p.load_id IS NOT f.load_id)")
+    sql, columns, _ = feature_query(
+        engine, ML_config, target=False,
+        extra_select=["f.fact_id AS fact_id", "f.load_id AS load_id"],
+        extra_joins=f"LEFT JOIN {PREDICTIONS_TABLE} p ON p.fact_id = f.fact_id",
+        extra_where=where,
+    )
+    sql += " ORDER BY f.fact_id LIMIT ?"
+
+    scored = 0
+    last_id = 0
+    start = time.perf_counter()
+    conn = engine.raw_connection()
+    try:
+        while True:
+            args = (last_id,) if rescore else (last_id, predictor.version)
+            rows = conn.execute(sql, args + (chunk_size,)).fetchall()
+            if not rows:
+                break
+            chunk = pd.DataFrame(rows, columns=['fact_id', 'load_id'] + columns)
+            for name in ('VOTES', 'PRICE', 'cusine_count'):
+                if name in chunk.columns:
+                    chunk[name] = pd.to_numeric(chunk[name], errors='coerce')
+            predictions = predictor.predict(chunk)
+            scored_at = datetime.datetime.now().isoformat(timespec='seconds')
+            conn.execute("BEGIN")
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {PREDICTIONS_TABLE} "
+                "(fact_id, predicted_rating, model_version, load_id, scored_at) VALUES (?, ?, ?, ?, ?)",
+                zip(chunk['fact_id'].tolist(), predictions.astype(float).tolist(), [predictor.version] * len(chunk),
+                    chunk['load_id'].tolist(), [scored_at] * len(chunk))
+            )
+            conn.commit()
+            scored += len(chunk)
+            last_id = int(chunk['fact_id'].iloc[-1])
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+    logging.info(f"Scored {scored} facts with {predictor.version} in {elapsed:.1f} s"
+                 + (f" ({scored / elapsed:.0f} rows/s)" if scored else ""))
+    return scored
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Score facts in main_db with a saved rating model")
+    parser.add_argument("--version", help="model version to use (default: LATEST)")
+    parser.add_argument("--chunk-size", type=int, help="facts per prediction batch")
+    parser.add_argument("--rescore", action="store_true", help="score every fact again")
+    args = parser.parse_args()
+
+    with open("ML_config.yml") as f:
+        config = yaml.safe_load(f)
+    engine = sqlalchemy.create_engine(f"sqlite:///{config['database']['sqlite_db_path']}")
+    predictor = RatingPredictor(config['database'].get('model_dir', '../Main_DB/models'), config, args.version)
+    score_unscored(engine, config, predictor, args.chunk_size or config['params'].get('feature_chunk_size', 50000),
+                   args.rescore)
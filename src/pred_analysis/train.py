@@ -0,0 +1,133 @@
+import time
+import logging
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.model_selection import ParameterGrid, KFold, cross_val_score
+from model import build_model, evaluate_model
+
+DEFAULT_TRAINING = {
+    'n_jobs': -1,
+    'candidates': ['LR', 'DT', 'RF'],
+    'cv': 3,
+    'time_budget_seconds': 300,
+    'patience': 8,
+}
+
+
+def get_training_params(ML_config):
+    params = dict(DEFAULT_TRAINING)
+    params.update(ML_config.get('training', {}))
+    return params
+
+
+def _parallel(n_jobs):
+    # Feature arrays above 1 MB are memory-mapped read-only into the workers instead of copied
+    return Parallel(n_jobs=n_jobs, max_nbytes='1M', mmap_mode='r')
+
+
+def _fit_and_evaluate(name, params, config, X_train, y_train, X_test, y_test, n_jobs=-1):
+    """Fit one candidate, a random forest on n_jobs cores, and score it on the test split"""
+    start = time.perf_counter()
+    model = build_model(name, config, **params, **({'n_jobs': n_jobs} if name == 'RF' else {}))
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    mae, rmse = evaluate_model(model, X_test, y_test)
+    return {'model': name, 'params': params, 'mae': mae, 'rmse': rmse,
+            'fit_seconds': fit_seconds, 'estimator': model}
+
+
+def _cross_validate(name, params, config, X, y, cv):
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    # Parallelism is across candidates, so each model fits on a single core
+    model = build_model(name, config, **params, **({'n_jobs': 1} if name == 'RF' else {}))
+    scores = -cross_val_score(model, X, y, cv=cv, scoring='neg_root_mean_squared_error')
+    return {'model': name, 'params': params, 'cv_rmse': scores.mean(), 'cv_std': scores.std(),
+            'seconds': time.perf_counter() - start, 'cpu_seconds': time.process_time() - cpu_start}
+
+
+def search_hyperparameters(name, config, X, y, training):
+    """Cross-validated random-order grid search over ML_config['search'][name].
+
+    Parameter sets are evaluated in parallel, one batch per round of
+    workers. The search stops early once time_budget_seconds has been used
+    or the best CV RMSE has not improved for patience evaluated sets, so
+    with a budget the grid does not have to be exhausted. Returns the
+    leaderboard sorted by CV RMSE; its first row holds the best params.
+    """
+    space = config.get('search', {}).get(name)
+    if not space:
+        return pd.DataFrame()
+    grid = list(ParameterGrid(space))
+    np.random.default_rng(config['params']['random_state']).shuffle(grid)
+    cv = KFold(n_splits=training['cv'], shuffle=True, random_state=config['params']['random_state'])
+    workers = effective_n_jobs(training['n_jobs'])
+
+    start = time.perf_counter()
+    results = []
+    best = np.inf
+    since_improvement = 0
+    stop_reason = "grid exhausted"
+    with _parallel(training['n_jobs']) as parallel:
+        for batch_start in range(0, len(grid), workers):
+            if time.perf_counter() - start > training['time_budget_seconds']:
+                stop_reason = "time budget used"
+                break
+            if since_improvement >= training['patience']:
+                stop_reason = f"no improvement in {since_improvement} sets"
+                break
+            batch = grid[batch_start:batch_start + workers]
+            for result in parallel(delayed(_cross_validate)(name, params, config, X, y, cv) for params in batch):
+                results.append(result)
+                if result['cv_rmse'] < best:
+                    best = result['cv_rmse']
+                    since_improvement = 0
+                else:
+                    since_improvement += 1
+
+    leaderboard = pd.DataFrame(results).sort_values('cv_rmse', kind='stable').reset_index(drop=True)
+    logging.info(f"{name} search: {len(results)}/{len(grid)} parameter sets in {time.perf_counter() - start:.1f} s "
+                 f"({stop_reason}); best CV RMSE {best:.4f} with {leaderboard.loc[0, 'params']}")
+    return leaderboard
+
+
+def train_and_select(config, X_train, y_train, X_test, y_test):
+    """Search DT/RF hyperparameters, cross-validate the default and tuned candidates, and fit the best.
+
+    The winner is chosen on CV RMSE over the training split (the same
+    folds as the search), so the test split is used once, to report the
+    chosen model's MAE and RMSE without selection bias. Returns
+    (leaderboard, estimators): the leaderboard sorted by CV RMSE with test
+    metrics on its first row only, and the fitted winner.
+    """
+    training = get_training_params(config)
+    cv = KFold(n_splits=training['cv'], shuffle=True, random_state=config['params']['random_state'])
+    candidates = [(name, {}) for name in training['candidates']]
+    scored = []
+    for name in training['candidates']:
+        search = search_hyperparameters(name, config, X_train, y_train, training)
+        if len(search):
+            logging.info(f"{name} search leaderboard:\n{search.head(10).to_string()}")
+            if search.loc[0, 'params']:
+                scored.append(search.iloc[0].to_dict())
+    start = time.perf_counter()
+    with _parallel(training['n_jobs']) as parallel:
+        defaults = parallel(delayed(_cross_validate)(name, params, config, X_train, y_train, cv)
+                            for name, params in candidates)
+    wall = time.perf_counter() - start
+    # CPU time, unlike wall time, is not inflated when workers share cores
+    serial = sum(result['cpu_seconds'] for result in defaults)
+    logging.info(f"Cross-validated {len(defaults)} candidates in {wall:.1f} s on "
+                 f"{effective_n_jobs(training['n_jobs'])} workers; serial CV takes {serial:.1f} s "
+                 f"(speedup {serial / wall:.2f}x)")
+    scored += defaults
+    leaderboard = pd.DataFrame(scored).sort_values('cv_rmse', kind='stable').reset_index(drop=True)
+
+    winner = leaderboard.loc[0]
+    result = _fit_and_evaluate(winner['model'], winner['params'], config, X_train, y_train, X_test, y_test,
+                               n_jobs=training['n_jobs'])
+    for column in ('mae', 'rmse', 'fit_seconds'):
+        leaderboard.loc[0, column] = result[column]
+    logging.info(f"Model leaderboard (selected on CV RMSE, test metrics for the winner only):\n{leaderboard.to_string()}")
+    return leaderboard, [result['estimator']]
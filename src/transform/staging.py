@@ -1,36 +1,61 @@
-import pandas as pd
 from sqlalchemy import create_engine
 from ..utils.config import load_config
-from ..utils.db_utils import execute_sql
+from ..utils.db_utils import bulk_load, get_bulk_params
 
 
 
 
 def rename_df_cols(df):
-    
+
     col_no_space = dict((i, i.replace(' ', '')) for i in list(df.columns))
     df.rename(columns=col_no_space, inplace=True)
     return df
 
 
+def staging_table_sql(df, table_name, map_data):
+    '''DDL for the staging table with column types mapped from df's dtypes'''
+    sql=f"CREATE TABLE IF NOT EXISTS {table_name} (key_pk INTEGER PRIMARY KEY AUTOINCREMENT"
+
+    col_list_dtype = [(i, str(df[i].dtype)) for i in list(df.columns)]
+    for col_name, dtype in col_list_dtype:
+        sqlite_dtype = map_data.get(dtype, 'TEXT')
+        sql += f", {col_name} {sqlite_dtype}"
+
+    sql += ')'
+    print(sql)
+    return sql
+
+
 def stage_data(df):
-    
-    
+
+
     config=load_config()
     map_data = config["params"]["dtype_mapping"]
     table_name="staging_db"
     staging_db_path=config["file_path"]["staging_db"]
-    df = rename_df_cols(df)
-    sql=f"CREATE TABLE IF NOT EXISTS {table_name} (key_pk INTEGER PRIMARY KEY AUTOINCREMENT,"
+    # A shallow copy, so the caller's frame (possibly shared with transform) keeps its column names
+    df = rename_df_cols(df.copy(deep=False))
 
     engine=create_engine(staging_db_path)
+    sql = staging_table_sql(df, table_name, map_data)
+    return bulk_load(engine, df, table_name, create_sql=sql, replace=True, params=get_bulk_params(config))
 
-    col_list_dtype = [(i, str(df[i].dtype)) for i in list(df.columns)]
-    for col_name, dtype in col_list_dtype:
-        sqlite_dtype = map_data.get(dtype, 'TEXT') 
-        sql += f" {col_name} {sqlite_dtype}"
 
-    sql += ')'
-    print(sql)
-    execute_sql(engine,sql)
-    df.to_sql(table_name, engine, index=False, if_exists="replace")
\ No newline at end of file
+def stage_chunks(chunks):
+    '''Stage an iterable of DataFrames; the first chunk replaces the table, the rest append'''
+    config=load_config()
+    map_data = config["params"]["dtype_mapping"]
+    table_name="staging_db"
+    engine=create_engine(config["file_path"]["staging_db"])
+    bulk_params = get_bulk_params(config)
+
+    rows = 0
+    for df in chunks:
+        df = rename_df_cols(df)
+        if rows == 0:
+            sql = staging_table_sql(df, table_name, map_data)
+            bulk_load(engine, df, table_name, create_sql=sql, replace=True, params=bulk_params)
+        else:
+            bulk_load(engine, df, table_name, params=bulk_params)
+        rows += len(df)
+    return rows
@@ -1,3 +1,6 @@
+import os
+import json
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -5,7 +8,10 @@ from sqlalchemy import create_engine
 import logging
 from ..utils.db_utils import execute_sql
 from ..utils.config import load_config
-from ..utils.pd_utils import load_df
+from ..utils.pd_utils import load_df, iter_df, row_hashes, SeenHashes, drop_column
+from ..utils.metrics import instrumented
+from ..utils.storage import get_storage_params, dataset_exists, iter_dataset
+from .staging import rename_df_cols
 
 
 
@@ -22,25 +28,93 @@ def drop_duplicates(data):
     data.drop_duplicates(inplace=True)
     return data
 
-def convert_object_to_numeric(df):
+DEFAULT_TYPE_PARAMS = {
+    "sample_size": 10000,
+    "numeric_min_ratio": 0.8,
+    "category_max_ratio": 0.5,
+    "category_max_unique": 5000
+}
+
+BOOLEAN_VALUES = {"true": True, "false": False, "yes": True, "no": False, "y": True, "n": False}
+
+
+def get_type_params(config):
+    params = dict(DEFAULT_TYPE_PARAMS)
+    params.update(config["params"].get("type_inference", {}))
+    return params
+
+
+def plan_column_types(df, params):
+    '''Choose a target type for each object column from a sample of its values.
+
+    Returns {column: (kind, reason)} with kind one of "integer", "float",
+    "boolean", "category" or "string". A column is numeric when at least
+    numeric_min_ratio of its sampled non-null values parse as numbers; the
+    rest will be coerced to NaN rather than keeping the column as objects.
+    '''
+    if len(df) > params["sample_size"]:
+        df = df.sample(n=params["sample_size"], random_state=0)
+    plan = {}
     for column in df.select_dtypes(include='object').columns:
-        try:
-            # Attempt to convert to integer
-            df[column] = pd.to_numeric(df[column], errors='raise', downcast='integer')
-            logging.info(f"Converted {column} to integer type.")
-        except (ValueError, TypeError):
-            try:
-                # Attempt to convert to float
-                df[column] = pd.to_numeric(df[column], errors='raise')
-                df[column] = df[column].astype(float)
-                logging.info(f"Converted {column} to float type.")
-            except (ValueError, TypeError):
-                logging.info(f"Left {column} as object type.")
+        values = df[column].dropna()
+        if values.empty:
+            plan[column] = ("string", "no non-null values in sample")
+            continue
+        if values.astype(str).str.strip().str.lower().isin(BOOLEAN_VALUES.keys()).all():
+            plan[column] = ("boolean", "only yes/no values in sample")
+            continue
+        numeric = pd.to_numeric(values, errors='coerce')
+        parsed = numeric.notnull().mean()
+        if parsed >= params["numeric_min_ratio"]:
+            kind = "integer" if (numeric.dropna() % 1 == 0).all() else "float"
+            plan[column] = (kind, f"{parsed:.1%} of sample numeric")
+            continue
+        unique = values.nunique()
+        if unique <= params["category_max_unique"] and unique / len(values) <= params["category_max_ratio"]:
+            plan[column] = ("category", f"{unique} distinct values in {len(values)} sampled")
+        else:
+            plan[column] = ("string", f"{unique} distinct values in {len(values)} sampled")
+    return plan
+
+
+def apply_column_types(df, plan):
+    '''Convert df's columns as planned in one vectorized pass per column'''
+    for column, (kind, _) in plan.items():
+        if column not in df.columns:
+            continue
+        if kind in ("integer", "float"):
+            converted = pd.to_numeric(df[column], errors='coerce')
+            if kind == "integer" and converted.notnull().all() and (converted % 1 == 0).all():
+                df[column] = pd.to_numeric(converted, downcast='integer')
+            else:
+                df[column] = converted.astype(float)
+        elif kind == "boolean":
+            df[column] = df[column].str.strip().str.lower().map(BOOLEAN_VALUES).astype("boolean")
+        elif kind == "category":
+            df[column] = df[column].astype("category")
+    return df
+
+
+@instrumented
+def infer_types(df, params=DEFAULT_TYPE_PARAMS, plan=None):
+    '''Replace object columns with the narrowest fitting dtype (or as planned), logging each decision'''
+    if plan is None:
+        plan = plan_column_types(df, params)
+    plan = {column: decision for column, decision in plan.items() if column in df.columns}
+    before = {column: df[column].memory_usage(deep=True) for column in plan}
+    df = apply_column_types(df, plan)
+    total_saved = 0
+    for column, (kind, reason) in plan.items():
+        after = df[column].memory_usage(deep=True)
+        total_saved += before[column] - after
+        logging.info(f"{column}: {kind} -> {df[column].dtype} ({reason}); "
+                     f"{before[column] / 2**20:.1f} MiB -> {after / 2**20:.1f} MiB")
+    logging.info(f"Type inference saved {total_saved / 2**20:.1f} MiB")
     return df
 
 def create_dimension_table(engine, data, table_name, columns,config):
     '''Create dimension table (generic for restaurant or location) using SQLite syntax'''
-    initial_sql = f"CREATE TABLE IF NOT EXISTS {table_name} (id INTEGER PRIMARY KEY"
+    initial_sql = f"CREATE TABLE IF NOT EXISTS {table_name} (id INTEGER PRIMARY KEY, key_hash INTEGER UNIQUE"
     
     for col in columns:
         dtype = str(data[col].dtype)
@@ -68,6 +142,7 @@ def create_fact_table(engine, data,config):
                 initial_sql += f", {col} {sqlite_dtype}"
    
     initial_sql += ", restaurant_id INTEGER, location_id INTEGER"
+    initial_sql += ", fact_key INTEGER UNIQUE, row_hash INTEGER, load_id INTEGER"
     initial_sql += ", FOREIGN KEY (restaurant_id) REFERENCES restaurant_dim_table(id)"
     initial_sql += ", FOREIGN KEY (location_id) REFERENCES location_dim_table(id)"
     initial_sql += ")"
@@ -76,21 +151,75 @@ def create_fact_table(engine, data,config):
     logging.info("Created fact table.")
 
 
-def transform():
-   
+def add_coord_source(df):
+    '''Give data enriched before coord_source was recorded the column, marking located rows "listing"'''
+    if 'coord_source' not in df.columns:
+        located = df['Latitude'].notnull() & df['Longitude'].notnull()
+        df = df.assign(coord_source=np.where(located, 'listing', None))
+    return df
+
+
+def column_plan(config, fallback_chunks, replan=False):
+    '''(columns to drop, type plan) for the extracted data, made once on the whole enriched dataset.
+
+    Incremental runs only hand over a delta; deltas are typed with this
+    plan so a small one can neither drop a sparse column nor change a
+    column's kind. The plan is kept in file_path.column_plan with the
+    null_limit and type_inference settings it was made with, and is made
+    again when they change or with replan. Without an enriched dataset it
+    is made from fallback_chunks() instead.
+    '''
+    path = config["file_path"].get("column_plan", "data/cache/column_plan.json")
+    type_params = get_type_params(config)
+    settings = {"null_limit": config['params']['null_limit'], "type_inference": type_params}
+    if not replan and os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        if saved["settings"] == settings:
+            logging.info(f"Using the column plan in {path}")
+            return saved["drop"], {column: tuple(decision) for column, decision in saved["plan"].items()}
+
+    enriched = config["file_path"]["enriched_data"]
+    storage = get_storage_params(config)
+    if dataset_exists(enriched, storage["format"]):
+        chunks = (rename_df_cols(chunk) for chunk in iter_dataset(enriched, storage["format"]))
+    else:
+        chunks = fallback_chunks()
+    null_percentages, sample = profile_chunks(chunks, type_params["sample_size"])
+    drop = [col for col, pct in null_percentages.items() if pct > settings["null_limit"]]
+    plan = plan_column_types(sample.drop(columns=drop + ['key_pk'], errors='ignore'), type_params) if sample is not None else {}
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"settings": settings, "drop": drop, "plan": plan}, f, indent=2)
+    os.replace(tmp_path, path)
+    logging.info(f"Column plan made and saved to {path}")
+    return drop, plan
+
+
+def transform(df=None, replan=False):
+    '''Type the staged data and create the star-schema tables for it.
+
+    Columns are dropped and typed as column_plan() says, so an incremental
+    delta gets the same columns and kinds as the full dataset. With df (the extracted frame) the staging table is not read back, so
+    this can run while df is being staged; df itself is left unchanged.
+    '''
     config = load_config()
-    db_path = config["file_path"]["staging_db"]
-    table_name = "staging_db"
-    engine = create_engine(db_path)
-    df = load_df(engine, table_name)
-    df['restaurant_id'] = df.index
-    df['location_id'] = df.index
+    if df is None:
+        engine = create_engine(config["file_path"]["staging_db"])
+        df = load_df(engine, "staging_db")
+        df = drop_column(df, 'key_pk')
+    else:
+        df = rename_df_cols(df.copy(deep=False))
     db_path = config["file_path"]["main_db"]
     engine = create_engine(db_path)
-    null_limit = config['params']['null_limit']
-    df = remove_columns_with_high_null_percentage(df, null_limit)
+    df = add_coord_source(df)
+    cols_to_drop, plan = column_plan(config, lambda: [df], replan)
+    df = df.drop(columns=cols_to_drop, errors='ignore')
+    logging.info(f"Dropped columns: {cols_to_drop}")
     df = drop_duplicates(df)
-    df = convert_object_to_numeric(df)
+    df = infer_types(df, get_type_params(config), plan)
     restaurant_columns = config['params']['restaurant_dimension_table_columns']
     location_columns = config['params']['location_dimension_table_columns']
     create_dimension_table(engine, df, 'restaurant_dimension_table', restaurant_columns, config)
@@ -99,9 +228,62 @@ def transform():
     logging.info("Transformation process completed successfully.")
     return df
 
-    
-    
 
+def profile_chunks(chunks, sample_size, random_state=0):
+    '''Light first pass over chunks: null percentages and a uniform row sample.
 
+    The sample keeps the sample_size rows with the smallest random keys
+    seen so far, so it is a uniform sample of the whole table while only
+    ever holding one chunk plus the sample in memory.
+    '''
+    rng = np.random.default_rng(random_state)
+    rows = 0
+    nulls = {}
+    sample = None
+    for df in chunks:
+        rows += len(df)
+        for col in df.columns:
+            nulls[col] = nulls.get(col, 0) + int(df[col].isnull().sum())
+        candidates = df.assign(_sample_key=rng.random(len(df))).nsmallest(sample_size, "_sample_key")
+        sample = candidates if sample is None else pd.concat([sample, candidates]).nsmallest(sample_size, "_sample_key")
+    null_percentages = {col: (count / rows) * 100 if rows else 0 for col, count in nulls.items()}
+    if sample is not None:
+        sample = sample.drop(columns="_sample_key").reset_index(drop=True)
+    return null_percentages, sample
 
 
+def transform_chunks(chunk_size, replan=False):
+    '''Streaming counterpart of transform(): yield typed chunks of the staging table.
+
+    The high-null columns and type plan come from column_plan() (a first
+    pass over the enriched dataset, or the staging table without one);
+    the pass over staging drops those columns, applies that plan to every chunk so all chunks get the same kinds and drops rows
+    seen in earlier chunks (by row hash). Surrogate keys are assigned by
+    load_chunks(). The star-schema tables are created from the first
+    converted chunk.
+    '''
+    config = load_config()
+    table_name = "staging_db"
+    staging_engine = create_engine(config["file_path"]["staging_db"])
+    engine = create_engine(config["file_path"]["main_db"])
+
+    cols_to_drop, plan = column_plan(config, lambda: iter_df(staging_engine, table_name, chunk_size), replan)
+    logging.info(f"Dropped columns: {cols_to_drop}")
+    for column, (kind, reason) in plan.items():
+        logging.info(f"{column}: {kind} ({reason})")
+
+    seen = SeenHashes()
+    tables_created = False
+    for df in iter_df(staging_engine, table_name, chunk_size):
+        df = apply_column_types(add_coord_source(df).drop(columns=cols_to_drop + ['key_pk'], errors='ignore'), plan)
+        df = df[seen.add_new(row_hashes(df))].reset_index(drop=True)
+        if not tables_created:
+            restaurant_columns = config['params']['restaurant_dimension_table_columns']
+            location_columns = config['params']['location_dimension_table_columns']
+            create_dimension_table(engine, df, 'restaurant_dimension_table', restaurant_columns, config)
+            create_dimension_table(engine, df, 'location_dimension_table', location_columns, config)
+            create_fact_table(engine, df, config)
+            tables_created = True
+        yield df
+    logging.info("Transformation process completed successfully.")
+
@@ -0,0 +1,174 @@
+import os
+import json
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .metrics import stage as metrics_stage, row_count, profiling
+
+DEFAULT_PIPELINE_PARAMS = {
+    "max_workers": 2,
+    "staging": "async"
+}
+
+
+class Stage:
+    '''One step of the pipeline graph.
+
+    run(inputs) gets the outputs of deps by name and returns this stage's
+    output. The cache key is a hash of the config_keys values (dotted
+    paths into config), fingerprint() and the keys of deps. exists() says
+    whether the stage's stored output is still there. A stage that is not
+    persistent only hands its output over in memory, so it has to run
+    again whenever a dependent runs; its run must then give the output
+    again (e.g. extract replays its unconfirmed delta), or a dependent
+    that failed would be rerun on nothing. When halt(output) is true (e.g.
+    no new rows) the stages downstream of it are not run.
+    '''
+
+    def __init__(self, name, run, deps=(), config_keys=(), fingerprint=None, exists=None, persistent=True, halt=None):
+        self.name = name
+        self.run = run
+        self.deps = tuple(deps)
+        self.config_keys = tuple(config_keys)
+        self.fingerprint = fingerprint
+        self.exists = exists
+        self.persistent = persistent
+        self.halt = halt
+
+
+def get_pipeline_params(config):
+    return dict(DEFAULT_PIPELINE_PARAMS, **config["params"].get("pipeline", {}))
+
+
+def config_value(config, key):
+    value = config
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def stage_key(stage, config, dep_keys):
+    payload = {
+        "stage": stage.name,
+        "config": {key: config_value(config, key) for key in stage.config_keys},
+        "fingerprint": stage.fingerprint() if stage.fingerprint else None,
+        "deps": {dep: dep_keys[dep] for dep in stage.deps},
+    }
+    return hashlib.blake2b(json.dumps(payload, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+def file_fingerprint(paths):
+    '''Path, size and mtime of every file in paths; changes whenever a file is added, removed or rewritten'''
+    entries = []
+    for path in sorted(paths):
+        stat = os.stat(path)
+        entries.append((path, stat.st_size, stat.st_mtime_ns))
+    return hashlib.blake2b(json.dumps(entries).encode(), digest_size=16).hexdigest()
+
+
+class StageCache:
+    '''{stage name: key of its last successful run}, kept in a JSON file'''
+
+    def __init__(self, path):
+        self.path = path
+        self.keys = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.keys = json.load(f)
+
+    def get(self, name):
+        return self.keys.get(name)
+
+    def set(self, name, key):
+        self.keys[name] = key
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.keys, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def _run_stage(stage, inputs):
+    rows_in = next((row_count(value) for value in inputs.values() if row_count(value) is not None), None)
+    with metrics_stage(stage.name, rows_in) as record:
+        output = stage.run(inputs)
+        record["rows_out"] = row_count(output)
+    return output
+
+
+def run_dag(stages, config, cache_path, max_workers=2, force=False):
+    '''Run stages (listed in dependency order), skipping those whose inputs are unchanged.
+
+    A stage is up to date when its key matches the one cached from its last
+    successful run and its output still exists; force runs every stage.
+    Stages whose dependencies are finished run concurrently on up to
+    max_workers threads, or one at a time when the run is profiled.
+    Returns {stage name: output} of the stages that ran.
+    '''
+    if profiling():
+        max_workers = 1
+    by_name = {}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on {missing}, which are not listed before it")
+        by_name[stage.name] = stage
+
+    cache = StageCache(cache_path)
+    keys = {}
+    for stage in stages:
+        keys[stage.name] = stage_key(stage, config, keys)
+    to_run = {
+        stage.name for stage in stages
+        if force or cache.get(stage.name) != keys[stage.name] or (stage.exists and not stage.exists())
+    }
+    # A stage that runs needs the in-memory outputs of its dependencies, so those run too
+    for stage in reversed(stages):
+        if stage.name in to_run:
+            to_run.update(dep for dep in stage.deps if not by_name[dep].persistent)
+    for stage in stages:
+        if stage.name not in to_run:
+            logging.info(f"Stage {stage.name} is up to date; skipped.")
+
+    outputs = {}
+    finished = {name for name in by_name if name not in to_run}
+    halted = set()
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            if error is None:
+                for stage in stages:
+                    if stage.name in finished or stage.name in halted or stage.name in running.values():
+                        continue
+                    if any(dep in halted for dep in stage.deps):
+                        logging.info(f"Stage {stage.name} not run: {', '.join(d for d in stage.deps if d in halted)} halted.")
+                        halted.add(stage.name)
+                    elif all(dep in finished for dep in stage.deps):
+                        logging.info(f"Running stage {stage.name}")
+                        inputs = {dep: outputs[dep] for dep in stage.deps if dep in outputs}
+                        running[pool.submit(_run_stage, stage, inputs)] = stage.name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    outputs[name] = future.result()
+                except Exception as e:
+                    logging.error(f"Stage {name} failed: {e}")
+                    error = error or e
+                    continue
+                stage = by_name[name]
+                if stage.halt and stage.halt(outputs[name]):
+                    # Not cached: a halted stage may not have written its output, so it runs again next time
+                    logging.info(f"Stage {name} halted the pipeline.")
+                    halted.add(name)
+                else:
+                    finished.add(name)
+                    cache.set(name, keys[name])
+    if error is not None:
+        raise error
+    return outputs
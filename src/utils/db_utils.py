@@ -1,5 +1,15 @@
 import logging
+import pandas as pd
 from sqlalchemy import create_engine
+from .metrics import instrumented
+
+DEFAULT_BULK_PARAMS = {
+    "batch_size": 50000,
+    "journal_mode": "WAL",
+    "synchronous": "OFF",
+    "cache_size": -262144
+}
+
 
 def execute_sql(engine, sql):
     '''Execute a SQL query'''
@@ -18,3 +28,171 @@ def create_sqlite_engine(db_path):
    
     engine = create_engine(f'sqlite:///{db_path}')
     return engine
+
+
+def get_bulk_params(config):
+    params = dict(DEFAULT_BULK_PARAMS)
+    params.update(config["params"].get("bulk_load", {}))
+    return params
+
+
+def table_ddl(table_name, df, dtype_mapping, columns=None, primary_key=None, default_type="TEXT"):
+    '''CREATE TABLE IF NOT EXISTS statement with column types mapped from df's dtypes'''
+    if columns is None:
+        columns = list(df.columns)
+    definitions = [f"{primary_key} INTEGER PRIMARY KEY"] if primary_key else []
+    for col in columns:
+        definitions.append(f'"{col}" {dtype_mapping.get(str(df[col].dtype), default_type)}'.strip())
+    return f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(definitions)})"
+
+
+def table_exists(conn, table_name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone()
+    return row is not None
+
+
+def index_statements(table_name, indexes):
+    '''CREATE INDEX IF NOT EXISTS statements for indexes, each a column name or a list of them'''
+    statements = []
+    for index in indexes:
+        columns = [index] if isinstance(index, str) else list(index)
+        name = f"{table_name}_{'_'.join(columns)}"
+        column_list = ", ".join(f'"{col}"' for col in columns)
+        statements.append(f'CREATE INDEX IF NOT EXISTS "{name}" ON {table_name} ({column_list})')
+    return statements
+
+
+def create_indexes(engine, indexes, analyze=True):
+    '''Create the configured {table: [index, ...]} indexes, then refresh planner statistics.
+
+    Indexes on tables or columns that do not exist (e.g. a column dropped
+    for too many nulls) are skipped with a warning.
+    '''
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        for table_name, table_indexes in indexes.items():
+            existing = {row[1] for row in cur.execute(f"PRAGMA table_info({table_name})")}
+            for index in table_indexes:
+                columns = [index] if isinstance(index, str) else list(index)
+                missing = [col for col in columns if col not in existing]
+                if missing:
+                    logging.warning(f"Skipping index on {table_name}{columns}: missing {missing}")
+                    continue
+                cur.execute(index_statements(table_name, [columns])[0])
+        if analyze:
+            cur.execute("ANALYZE")
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    logging.info(f"Indexes created on {list(indexes)}" + (" and statistics analyzed" if analyze else ""))
+
+
+def _sqlite_rows(df):
+    '''Rows of df as tuples of plain Python values, with NaN/NaT as NULL'''
+    values = df.astype(object).where(df.notnull(), None)
+    for col in values.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]) or pd.api.types.is_timedelta64_dtype(df[col]):
+            values[col] = values[col].map(lambda value: None if value is None else str(value))
+    return values.itertuples(index=False, name=None)
+
+
+def _load_pragmas(cur, params):
+    '''Apply the load-time PRAGMAs; returns the synchronous setting to restore afterwards'''
+    previous_synchronous = cur.execute("PRAGMA synchronous").fetchone()[0]
+    cur.execute(f"PRAGMA journal_mode={params['journal_mode']}")
+    cur.execute(f"PRAGMA synchronous={params['synchronous']}")
+    cur.execute(f"PRAGMA cache_size={int(params['cache_size'])}")
+    return previous_synchronous
+
+
+@instrumented
+def bulk_load(engine, df, table_name, columns=None, create_sql=None, replace=False, index_sql=(), params=None):
+    '''Insert df into table_name with batched executemany inside explicit transactions.
+
+    create_sql is the table's DDL (typically built from dtype_mapping) and
+    is honored as-is: with replace the table is dropped and recreated from
+    it, otherwise it is only run if the table does not exist yet. A missing
+    table without create_sql gets untyped columns from table_ddl(). Statements
+    in index_sql are run after the data is in, so index maintenance does not
+    slow the inserts. Returns the number of rows inserted.
+    '''
+    if params is None:
+        params = DEFAULT_BULK_PARAMS
+    if columns is None:
+        columns = list(df.columns)
+    df = df[list(columns)]
+
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        previous_synchronous = _load_pragmas(cur, params)
+
+        if replace:
+            cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+        if create_sql is None and not table_exists(cur, table_name):
+            create_sql = table_ddl(table_name, df, {}, columns, default_type="")
+        if create_sql is not None:
+            cur.execute(create_sql)
+        conn.commit()
+
+        column_list = ", ".join(f'"{col}"' for col in columns)
+        placeholders = ", ".join("?" * len(columns))
+        insert_sql = f"INSERT INTO {table_name} ({column_list}) VALUES ({placeholders})"
+
+        batch_size = params["batch_size"]
+        for start in range(0, len(df), batch_size):
+            cur.execute("BEGIN")
+            cur.executemany(insert_sql, _sqlite_rows(df.iloc[start:start + batch_size]))
+            conn.commit()
+
+        for sql in index_sql:
+            cur.execute(sql)
+        conn.commit()
+        cur.execute(f"PRAGMA synchronous={previous_synchronous}")
+        cur.close()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Bulk load into {table_name} failed: {e}")
+        raise
+    finally:
+        conn.close()
+    logging.info(f"Bulk loaded {len(df)} rows into {table_name}")
+    return len(df)
+
+
+@instrumented
+def bulk_update(engine, df, table_name, set_columns, key_column, params=None):
+    '''Update rows of table_name in place from df, matched on key_column.
+
+    Uses the same PRAGMAs and batched executemany transactions as
+    bulk_load(). Returns the number of rows in df.
+    '''
+    if params is None:
+        params = DEFAULT_BULK_PARAMS
+    set_columns = list(set_columns)
+    df = df[set_columns + [key_column]]
+    assignments = ", ".join(f'"{col}" = ?' for col in set_columns)
+    update_sql = f'UPDATE {table_name} SET {assignments} WHERE "{key_column}" = ?'
+
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        previous_synchronous = _load_pragmas(cur, params)
+        conn.commit()
+        batch_size = params["batch_size"]
+        for start in range(0, len(df), batch_size):
+            cur.execute("BEGIN")
+            cur.executemany(update_sql, _sqlite_rows(df.iloc[start:start + batch_size]))
+            conn.commit()
+        cur.execute(f"PRAGMA synchronous={previous_synchronous}")
+        cur.close()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Bulk update of {table_name} failed: {e}")
+        raise
+    finally:
+        conn.close()
+    logging.info(f"Bulk updated {len(df)} rows in {table_name}")
+    return len(df)
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import logging
+import cProfile
+import resource
+import datetime
+import functools
+import threading
+from contextlib import contextmanager
+
+_run = None
+
+
+def _rss_bytes():
+    '''Current resident set size, or the process peak where /proc is not available'''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def _io_bytes():
+    '''(bytes read, bytes written) by this process so far, from /proc/self/io; (None, None) elsewhere'''
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def row_count(value):
+    '''Row count of a DataFrame, of the first element of a tuple, or an int result'''
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    return len(value) if hasattr(value, "columns") else None
+
+
+class _PeakSampler:
+    '''Samples RSS on a daemon thread every interval seconds and keeps the peak'''
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = _rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+        return self.peak
+
+
+class RunMetrics:
+    '''Per-stage and per-function measurements of one pipeline run.
+
+    Each stage and each instrumented function called inside it is written
+    as one JSON line to path: wall and CPU seconds, peak RSS, rows in and
+    out, and bytes read and written. With profile_dir every stage also runs
+    under cProfile and its stats are dumped there as <run_id>-<stage>.prof;
+    only one profiler can be active at a time, so run_dag then runs the
+    stages one by one. CPU time, RSS and I/O are process-wide, so the figures of stages that
+    run concurrently overlap.
+    '''
+
+    def __init__(self, path, profile_dir=None, sample_interval=0.05):
+        self.path = path
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self.run_id = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        # Stages may run concurrently on different threads; each tracks its own stage and calls
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def _write(self, record):
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        '''Measure the enclosed block as stage name; set record["rows_out"] inside it'''
+        self._local.stage_name = name
+        self._local.functions = {}
+        record = {"run_id": self.run_id, "kind": "stage", "name": name, "rows_in": rows_in, "rows_out": None}
+        read_start, written_start = _io_bytes()
+        sampler = _PeakSampler(self.sample_interval)
+        profiler = cProfile.Profile() if self.profile_dir else None
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            if profiler:
+                profiler.enable()
+            yield record
+        finally:
+            if profiler:
+                profiler.disable()
+            record["wall_seconds"] = round(time.perf_counter() - start, 4)
+            record["cpu_seconds"] = round(time.process_time() - cpu_start, 4)
+            record["peak_rss_bytes"] = sampler.stop()
+            read_end, written_end = _io_bytes()
+            record["bytes_read"] = read_end - read_start if read_end is not None else None
+            record["bytes_written"] = written_end - written_start if written_end is not None else None
+            self._write(record)
+            for function in self._local.functions.values():
+                self._write(function)
+            logging.info(f"Stage {name}: {record['wall_seconds']:.2f} s wall, {record['cpu_seconds']:.2f} s CPU, "
+                         f"peak RSS {record['peak_rss_bytes'] / 2**20:.0f} MiB, rows {rows_in} -> {record['rows_out']}")
+            if profiler:
+                profile_path = os.path.join(self.profile_dir, f"{self.run_id}-{name}.prof")
+                profiler.dump_stats(profile_path)
+                logging.info(f"Stage {name} profile written to {profile_path}")
+            self._local.stage_name = None
+
+    def add_call(self, name, wall, cpu, rows_in, rows_out, read, written):
+        if not hasattr(self._local, "functions"):
+            self._local.stage_name, self._local.functions = None, {}
+        function = self._local.functions.setdefault(name, {
+            "run_id": self.run_id, "kind": "function", "name": name, "stage": self._local.stage_name, "calls": 0,
+            "wall_seconds": 0.0, "cpu_seconds": 0.0, "rows_in": 0, "rows_out": 0, "bytes_read": 0, "bytes_written": 0,
+        })
+        function["calls"] += 1
+        function["wall_seconds"] = round(function["wall_seconds"] + wall, 4)
+        function["cpu_seconds"] = round(function["cpu_seconds"] + cpu, 4)
+        for key, value in (("rows_in", rows_in), ("rows_out", rows_out), ("bytes_read", read), ("bytes_written", written)):
+            if value is not None and function[key] is not None:
+                function[key] += value
+            else:
+                function[key] = None
+
+
+def start_run(path, profile_dir=None):
+    '''Start collecting metrics for this process into path; returns the RunMetrics'''
+    global _run
+    _run = RunMetrics(path, profile_dir)
+    return _run
+
+
+def profiling():
+    '''True when the current run profiles its stages'''
+    return _run is not None and bool(_run.profile_dir)
+
+
+def stage(name, rows_in=None):
+    '''Stage context of the current run; a no-op record when no run was started'''
+    if _run is None:
+        return _null_stage(name, rows_in)
+    return _run.stage(name, rows_in)
+
+
+@contextmanager
+def _null_stage(name, rows_in):
+    yield {"name": name, "rows_in": rows_in, "rows_out": None}
+
+
+def instrumented(function):
+    '''Add each call's time, rows and I/O to the current stage's metrics for function.
+
+    Rows in are counted from the first DataFrame argument and rows out from
+    the result. Calls outside a run only pay one None check.
+    '''
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _run is None:
+            return function(*args, **kwargs)
+        rows_in = next((len(arg) for arg in args if hasattr(arg, "columns")), None)
+        read_start, written_start = _io_bytes()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        result = function(*args, **kwargs)
+        wall, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+        read_end, written_end = _io_bytes()
+        _run.add_call(function.__name__, wall, cpu, rows_in, row_count(result),
+                      read_end - read_start if read_end is not None else None,
+                      written_end - written_start if written_end is not None else None)
+        return result
+    return wrapper
+
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 def drop_column(df, column_name):
@@ -11,4 +12,51 @@ def drop_column(df, column_name):
 
 def load_df(engine, table_name):
     df = pd.read_sql(f"SELECT * FROM {table_name}", con=engine)
-    return df
\ No newline at end of file
+    return df
+
+
+def iter_df(engine, table_name, chunk_size, columns=None):
+    '''Yield table_name in DataFrames of at most chunk_size rows'''
+    select = ", ".join(f'"{col}"' for col in columns) if columns else "*"
+    with engine.connect() as conn:
+        yield from pd.read_sql(f"SELECT {select} FROM {table_name}", con=conn, chunksize=chunk_size)
+
+
+def row_hashes(df):
+    '''64-bit hash of each row's values (the index is ignored)'''
+    return pd.util.hash_pandas_object(df, index=False, categorize=False).to_numpy()
+
+
+class SeenHashes:
+    '''Set of 64-bit row hashes kept as a few sorted arrays.
+
+    Memory is 8 bytes per distinct row, far below holding the rows
+    themselves; runs are merged once there are more than max_runs of them.
+    '''
+
+    def __init__(self, initial=None, max_runs=16):
+        self.runs = [np.asarray(initial, dtype=np.uint64)] if initial is not None and len(initial) else []
+        self.max_runs = max_runs
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    def contains(self, hashes):
+        seen = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            positions = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+            seen |= run[positions] == hashes
+        return seen
+
+    def add_new(self, hashes):
+        '''Add hashes and return a mask of the ones not seen before (first occurrence only)'''
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        new = ~pd.Index(hashes).duplicated() & ~self.contains(hashes)
+        if new.any():
+            self.runs.append(np.sort(hashes[new]))
+            if len(self.runs) > self.max_runs:
+                self.runs = [np.sort(np.concatenate(self.runs))]
+        return new
+
+    def to_array(self):
+        return np.sort(np.concatenate(self.runs)) if self.runs else np.empty(0, dtype=np.uint64)
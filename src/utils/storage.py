@@ -0,0 +1,113 @@
+import os
+import glob
+import shutil
+import time
+import logging
+import pandas as pd
+
+COLUMNAR_FORMATS = ("parquet", "feather")
+
+DEFAULT_STORAGE_PARAMS = {
+    "format": "parquet",
+    "compression": "zstd",
+    "memory_map": True,
+    "export_csv": False
+}
+
+
+def get_storage_params(config):
+    params = dict(DEFAULT_STORAGE_PARAMS)
+    params.update(config["params"].get("storage", {}))
+    return params
+
+
+def dataset_location(path, fmt):
+    '''CSV datasets are a single <path>.csv file; columnar ones a directory of parts'''
+    if fmt == "csv":
+        return path if path.endswith(".csv") else path + ".csv"
+    return path
+
+
+def dataset_exists(path, fmt):
+    location = dataset_location(path, fmt)
+    if fmt == "csv":
+        return os.path.exists(location)
+    return bool(_part_files(location, fmt))
+
+
+def remove_dataset(path, fmt):
+    location = dataset_location(path, fmt)
+    if os.path.isdir(location):
+        shutil.rmtree(location)
+    elif os.path.exists(location):
+        os.remove(location)
+
+
+def _part_files(directory, fmt):
+    return sorted(glob.glob(os.path.join(directory, f"part-*.{fmt}")))
+
+
+def write_dataset(df, path, fmt="parquet", compression="zstd", append=False):
+    '''Write df as the dataset at path, or add it as a new part when append is set'''
+    location = dataset_location(path, fmt)
+    if fmt == "csv":
+        os.makedirs(os.path.dirname(location) or ".", exist_ok=True)
+        exists = os.path.exists(location)
+        df.to_csv(location, mode="a" if append else "w", header=not (append and exists), index=False)
+        return location
+
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"Unsupported storage format: {fmt}")
+    os.makedirs(location, exist_ok=True)
+    if not append:
+        for part in _part_files(location, fmt):
+            os.remove(part)
+    part_path = os.path.join(location, f"part-{time.time_ns()}.{fmt}")
+    df = df.reset_index(drop=True)
+    if fmt == "parquet":
+        df.to_parquet(part_path, compression=compression, index=False)
+    else:
+        # With compression=None feather parts are memory-mapped zero-copy on read
+        df.to_feather(part_path, compression=compression or "uncompressed")
+    logging.info(f"Wrote {len(df)} rows to {part_path}")
+    return part_path
+
+
+def read_dataset(path, fmt="parquet", columns=None, memory_map=True):
+    '''Read the dataset at path, loading only columns if given'''
+    location = dataset_location(path, fmt)
+    if fmt == "csv":
+        return pd.read_csv(location, usecols=columns)
+
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    tables = []
+    for part in _part_files(location, fmt):
+        if fmt == "parquet":
+            tables.append(pq.read_table(part, columns=columns, memory_map=memory_map))
+        else:
+            tables.append(feather.read_table(part, columns=columns, memory_map=memory_map))
+    if not tables:
+        raise FileNotFoundError(f"No {fmt} parts found in {location}")
+    return pa.concat_tables(tables, promote_options="default").to_pandas()
+
+
+def iter_dataset(path, fmt="parquet", chunk_size=100000, columns=None):
+    '''Yield the dataset at path as DataFrames of at most chunk_size rows'''
+    location = dataset_location(path, fmt)
+    if fmt == "csv":
+        yield from pd.read_csv(location, usecols=columns, chunksize=chunk_size)
+        return
+
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    for part in _part_files(location, fmt):
+        if fmt == "parquet":
+            batches = pq.ParquetFile(part, memory_map=True).iter_batches(batch_size=chunk_size, columns=columns)
+        else:
+            batches = feather.read_table(part, columns=columns, memory_map=True).to_batches(max_chunksize=chunk_size)
+        for batch in batches:
+            yield batch.to_pandas()